@@ -0,0 +1,179 @@
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import extract, insert, select, update
+
+from models import db, money, Category, Expense, SpendingAggregate
+import alerts
+
+
+"""
+  Materialized spending aggregates (user, category, year, month -> total, count).
+  Expense writes record their changes in a SpendingDelta, which is applied in the
+  same transaction, so the dashboard and reports never re-sum the expenses table.
+  Applying a delta also checks the budget thresholds it crossed (alerts.py).
+"""
+
+def period_of(created_at):
+  # (year, month) of an expense date (also accepts "YYYY-MM-DD" strings)
+  if isinstance(created_at, str):
+    created_at = datetime.strptime(created_at[:10], "%Y-%m-%d")
+  return created_at.year, created_at.month
+
+
+class SpendingDelta:
+  def __init__(self):
+    self.changes = defaultdict(lambda: [0, 0])
+
+  def add(self, user_id, category_id, created_at, amount, sign=1):
+    # amount is the expense's normalized_amount (the user's base currency)
+    year, month = period_of(created_at)
+    change = self.changes[(user_id, category_id, year, month)]
+    change[0] += sign * money(amount)
+    change[1] += sign
+
+  def remove(self, user_id, category_id, created_at, amount):
+    self.add(user_id, category_id, created_at, amount, sign=-1)
+
+  def apply(self):
+    changes = [
+      {"user_id": user_id, "category_id": category_id, "year": year, "month": month,
+       "total": total, "count": count}
+      for (user_id, category_id, year, month), (total, count) in self.changes.items()
+      if total != 0 or count != 0
+    ]
+    self.changes.clear()
+    if not changes:
+      return
+
+    # Increment in place so concurrent writers never overwrite each other's totals
+    upsert = _upsert_statement(db.session.get_bind().dialect.name)
+    if upsert is not None:
+      db.session.connection().execute(upsert, changes)
+    else:
+      self._update_each(changes)
+    # budgets the new totals pushed past a threshold, same transaction
+    alerts.check(changes)
+
+  def _update_each(self, changes):
+    for change in changes:
+      result = db.session.execute(
+        update(SpendingAggregate)
+        .where(
+          SpendingAggregate.user_id==change["user_id"],
+          SpendingAggregate.category_id==change["category_id"],
+          SpendingAggregate.year==change["year"],
+          SpendingAggregate.month==change["month"],
+        )
+        .values(
+          total=SpendingAggregate.total + change["total"],
+          count=SpendingAggregate.count + change["count"],
+        ),
+        execution_options={"synchronize_session": False},
+      )
+      if result.rowcount == 0:
+        db.session.execute(insert(SpendingAggregate).values(**change))
+
+
+def _upsert_statement(dialect_name):
+  # INSERT ... ON CONFLICT DO UPDATE, sent as a single executemany (SQLite and PostgreSQL)
+  if dialect_name == "sqlite":
+    from sqlalchemy.dialects.sqlite import insert as dialect_insert
+  elif dialect_name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert as dialect_insert
+  else:
+    return None
+
+  stmt = dialect_insert(SpendingAggregate.__table__)
+  return stmt.on_conflict_do_update(
+    index_elements=["user_id", "category_id", "year", "month"],
+    set_={
+      "total": SpendingAggregate.__table__.c.total + stmt.excluded.total,
+      "count": SpendingAggregate.__table__.c.count + stmt.excluded.count,
+    },
+  )
+
+
+# Joining on (user_id, category_id) lets the primary key index serve the join
+def _aggregate_join():
+  return db.and_(
+    SpendingAggregate.user_id==Category.user_id,
+    SpendingAggregate.category_id==Category.id,
+  )
+
+
+def category_totals_query(user_id):
+  # Total spent and number of expenses per category, largest first (empty categories included)
+  return (
+    db.select(
+      Category.name,
+      db.func.coalesce(db.func.sum(SpendingAggregate.total), 0).label("total_spent"),
+      db.func.coalesce(db.func.sum(SpendingAggregate.count), 0).label("count"),
+    )
+    .outerjoin(SpendingAggregate, _aggregate_join())
+    .where(Category.user_id==user_id)
+    .group_by(Category.id, Category.name)
+    .order_by(db.desc("total_spent"))
+  )
+
+
+def category_totals(user_id):
+  return db.session.execute(category_totals_query(user_id)).all()
+
+
+def expected_aggregates(user_id=None):
+  # The aggregates recomputed from the Expense rows themselves
+  year = extract("year", Expense.created_at)
+  month = extract("month", Expense.created_at)
+  query = (
+    select(
+      Category.user_id,
+      Expense.category_id,
+      year.label("year"),
+      month.label("month"),
+      db.func.coalesce(db.func.sum(Expense.normalized_amount), 0).label("total"),
+      db.func.count(Expense.id).label("count"),
+    )
+    .join(Category, Expense.category_id==Category.id)
+    .group_by(Category.user_id, Expense.category_id, year, month)
+  )
+  if user_id is not None:
+    query = query.where(Category.user_id==user_id)
+  return query
+
+
+def rebuild(user_id=None):
+  stmt = db.delete(SpendingAggregate)
+  if user_id is not None:
+    stmt = stmt.where(SpendingAggregate.user_id==user_id)
+  db.session.execute(stmt)
+
+  columns = ["user_id", "category_id", "year", "month", "total", "count"]
+  db.session.execute(
+    insert(SpendingAggregate).from_select(columns, expected_aggregates(user_id))
+  )
+  db.session.commit()
+
+
+def verify(user_id=None):
+  # Returns a list of (key, stored, expected) tuples that disagree (totals are exact cents)
+  expected = {
+    (row.user_id, row.category_id, row.year, row.month): (row.total, row.count)
+    for row in db.session.execute(expected_aggregates(user_id))
+  }
+
+  query = select(SpendingAggregate)
+  if user_id is not None:
+    query = query.where(SpendingAggregate.user_id==user_id)
+  stored = {
+    (row.user_id, row.category_id, row.year, row.month): (row.total, row.count)
+    for row in db.session.execute(query).scalars()
+  }
+
+  mismatches = []
+  for key in expected.keys() | stored.keys():
+    have = stored.get(key, (0, 0))
+    want = expected.get(key, (0, 0))
+    if have != want:
+      mismatches.append((key, have, want))
+  return sorted(mismatches)
@@ -0,0 +1,159 @@
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, func, insert, select, update
+from sqlalchemy.orm import joinedload
+
+from models import db, BudgetAlert, BudgetEntry, SpendingAggregate
+
+
+"""
+  Budget threshold alerts, evaluated on every expense write.
+  SpendingDelta.apply() hands its changes to check() in the same transaction. The running
+  total of a (category, year, month) is its spending_aggregates row, already updated by
+  the delta, so nothing is re-summed: the total before the write is the new total minus
+  the change. A budget whose spending goes from below to at or above 50, 80 or 100% of
+  its limit gets a BudgetAlert row.
+
+  The budgets of the changed periods are read with their new totals in one query, through
+  the spending_aggregates primary key and ix_budget_entries_category_period. It is not
+  cached: a budget saved by another worker or by flask run-recurring counts on the very
+  next write.
+
+  Alerts are read by polling /api/alerts (?after=<id>), the default client path, or with
+  /api/alerts/stream (server-sent events). A stream polls the table every
+  ALERT_POLL_INTERVAL seconds and ends after ALERT_STREAM_SECONDS (15), the browser
+  reconnects with Last-Event-ID. The stream occupies a worker thread for that long, so it
+  needs threaded or async workers (gunicorn --threads, gevent); with sync workers each
+  open stream takes a whole worker.
+"""
+
+THRESHOLDS = (50, 80, 100)
+MAX_ALERTS = 100
+
+def budgets_query(keys):
+  # Budgets of the (user_id, category_id, year, month) periods in `keys`, with the
+  # period's running total. One IN list per key column: SQLite cannot search an index for
+  # a row-value IN of several rows, so this matches a superset that check() filters.
+  user_ids, category_ids, years, months = (set(column) for column in zip(*keys))
+  return (
+    select(
+      BudgetEntry.id, SpendingAggregate.user_id, BudgetEntry.category_id,
+      BudgetEntry.year, BudgetEntry.month, BudgetEntry.budget_limit, SpendingAggregate.total,
+    )
+    .join(SpendingAggregate, and_(
+      SpendingAggregate.category_id==BudgetEntry.category_id,
+      SpendingAggregate.year==BudgetEntry.year,
+      SpendingAggregate.month==BudgetEntry.month,
+    ))
+    .where(
+      SpendingAggregate.user_id.in_(user_ids),
+      SpendingAggregate.category_id.in_(category_ids),
+      SpendingAggregate.year.in_(years),
+      SpendingAggregate.month.in_(months),
+    )
+  )
+
+
+def crossed(before, after, limit):
+  # Thresholds passed on the way up from `before` to `after`
+  if limit <= 0:
+    return []
+  return [threshold for threshold in THRESHOLDS if before * 100 < limit * threshold <= after * 100]
+
+
+def check(changes):
+  # changes: the rows SpendingDelta.apply() just added to spending_aggregates
+  # only more spending crosses a threshold upwards
+  increases = {
+    (change["user_id"], change["category_id"], change["year"], change["month"]): change["total"]
+    for change in changes
+    if change["total"] > 0
+  }
+  if not increases:
+    return 0
+
+  alerts = []
+  for budget_id, user_id, category_id, year, month, limit, after in db.session.execute(budgets_query(list(increases))):
+    key = (user_id, category_id, year, month)
+    if key not in increases:
+      continue
+    before = after - increases[key]
+    for threshold in crossed(before, after, limit):
+      alerts.append({
+        "user_id": user_id, "budget_entry_id": budget_id,
+        "category_id": category_id, "year": year, "month": month,
+        "threshold": threshold, "total": after, "budget_limit": limit,
+        "created_at": datetime.utcnow(),
+      })
+  if alerts:
+    db.session.execute(insert(BudgetAlert), alerts)
+  return len(alerts)
+
+
+def alerts_query(user_id, after=None, limit=MAX_ALERTS):
+  # Alerts after the id `after`, oldest first; without it the unread ones
+  query = (
+    select(BudgetAlert)
+    .options(joinedload(BudgetAlert.category))
+    .where(BudgetAlert.user_id==user_id)
+    .order_by(BudgetAlert.id)
+    .limit(limit)
+  )
+  if after is None:
+    query = query.where(BudgetAlert.read_at.is_(None))
+  else:
+    query = query.where(BudgetAlert.id > after)
+  return query
+
+
+def user_alerts(user_id, after=None, limit=MAX_ALERTS):
+  return db.session.execute(alerts_query(user_id, after, limit)).scalars().all()
+
+
+def mark_read(user_id, up_to=None):
+  # Marks the user's alerts (up to an id) as read, returns how many
+  query = (
+    update(BudgetAlert)
+    .where(BudgetAlert.user_id==user_id, BudgetAlert.read_at.is_(None))
+    .values(read_at=datetime.utcnow())
+    .execution_options(synchronize_session=False)
+  )
+  if up_to is not None:
+    query = query.where(BudgetAlert.id <= up_to)
+  count = db.session.execute(query).rowcount
+  db.session.commit()
+  return count
+
+
+def stream(user_id, after=None):
+  # Server-sent events: one "budget-alert" event per alert, a comment line between polls.
+  # Without a last seen id the stream starts with the unread alerts.
+  interval = current_app.config["ALERT_POLL_INTERVAL"]
+  deadline = time.monotonic() + current_app.config["ALERT_STREAM_SECONDS"]
+  if after is None:
+    after = db.session.execute(
+      select(func.coalesce(func.max(BudgetAlert.id), 0)).where(BudgetAlert.user_id==user_id)
+    ).scalar()
+    pending = [alert for alert in user_alerts(user_id) if alert.id <= after]
+  else:
+    pending = user_alerts(user_id, after)
+
+  yield f"retry: {int(interval * 1000)}\n\n"
+  while True:
+    for alert in pending:
+      after = max(after, alert.id)
+      yield f"id: {alert.id}\nevent: budget-alert\ndata: {current_app.json.dumps(alert.to_dict())}\n\n"
+    # no connection or transaction is held while waiting
+    db.session.close()
+    if time.monotonic() >= deadline:
+      return
+    time.sleep(interval)
+    yield ": waiting\n\n"
+    pending = user_alerts(user_id, after)
+
+
+def init_app(app):
+  app.config.setdefault("ALERT_POLL_INTERVAL", 5)
+  app.config.setdefault("ALERT_STREAM_SECONDS", 15)
@@ -1,46 +1,84 @@
-import os
-from datetime import datetime
+import io
+from datetime import date, datetime
+import click
 from sqlalchemy import select
-from flask import Flask, flash, render_template, redirect, request, session, jsonify
-from werkzeug.security import check_password_hash, generate_password_hash
-from flask_session import Session
+from flask import Blueprint, Flask, Response, flash, render_template, redirect, request, session, jsonify, stream_template, stream_with_context
 
 # custom reusable model component
-from models import User, Income, Category, Expense, BudgetEntry, db
-from helpers import login_required
+from models import User, Income, Category, Expense, BudgetEntry, db, money
+from helpers import login_required, MoneyJSONProvider
+from cache import response_cache
+from auth import password_hasher
+import database
+import sessions
+import perf
+import assets
+from database import replica_read
+from config import Config
+from budgets import budget_rollup
+import aggregates
+import currencies
+import recurring
+import dashboard
+import reports as spending_reports
+import pagination
+import importer
+import exporter
+import batch
+import search
+import merchants
+import alerts
+import categories as user_categories
+
+
+# All routes and commands live on this blueprint, the app itself is built by create_app()
+main = Blueprint("main", __name__, cli_group=None)
 
 
 # configure FLask application
-app = Flask(__name__)
+def create_app(config=None):
+  app = Flask(__name__)
+  app.json = MoneyJSONProvider(app)
+  app.config.from_object(Config)
+  if config:
+    app.config.update(config)
 
-# Configure db location/path
-basedir = os.path.abspath(os.path.dirname(__file__))
+  sessions.init_app(app)
+  response_cache.init_app(app)
+  password_hasher.init_app(app)
 
-# https://www.reddit.com/r/flask/comments/gvekun/what_are_the_exact_uses_of_flasks_secret_key/
-# Reddit on understanding secret_keys
-app.secret_key = "your_secret_key"
-app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_TYPE'] = "filesystem"
-Session(app)
+  # database.init_app binds SQLAlchemy with the pool settings, SQLite PRAGMA profile and replica
+  # No connection is made and the schema is left alone: flask init-db / flask migrate create it
+  database.init_app(app)
+
+  # X-Query-Count header on every response
+  perf.init_app(app)
+  # fingerprinted, precompressed static files and compressed HTML/JSON responses
+  assets.init_app(app)
+  # optional in-process scheduler for recurring expenses and budgets
+  recurring.init_app(app)
+  alerts.init_app(app)
+
+  app.register_blueprint(main)
+  return app
 
-# Configure SQLAlchemy database
-app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///" + os.path.join(basedir, "expenses.db")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Define base class
 # Configure caching
-@app.after_request
+# Views that set their own Cache-Control (static files, the cached JSON endpoints) keep it
+# Pages of a signed-in user are never stored, public pages (login, register) are revalidated
+@main.after_app_request
 def after_request(response):
-  response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-  response.headers["Expires"] = 0
-  response.headers["Pragma"] = "no-cache"
+  if "Cache-Control" not in response.headers:
+    if session.get("user_id"):
+      response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+      response.headers["Expires"] = 0
+      response.headers["Pragma"] = "no-cache"
+    else:
+      response.headers["Cache-Control"] = "no-cache"
   return response
 
 
-# Initialize the database tables
-db.init_app(app)
-with app.app_context():
-  db.create_all()
 # Fake login for dev purposes
 #@app.before_request
 #def fake_login():
@@ -50,47 +88,16 @@ with app.app_context():
 
 # Dashboard/Home route
 # Views the Overall expense tracking, spending,
-@app.route("/", methods=["GET", "POST"])
+@main.route("/", methods=["GET", "POST"])
 @login_required
 def index():
   now = datetime.now()
   # Get user id
   user_id = session.get("user_id") 
 
-  # Get recent expense
-  recent_expense = (
-    db.session.query(Expense)
-    .join(Category)
-    .filter(Category.user_id == user_id)
-    .order_by(Expense.created_at.desc())
-    .first()
-  )
-
-
-  # Get recent budget entry
-  recent_budget = (
-    db.session.query(BudgetEntry)
-    .join(Category)
-    .filter(Category.user_id == user_id)
-    .order_by(BudgetEntry.id.desc())
-    .first()
-  )
-
+  # Recent expense, recent budget, top category and the chart data in one pass
+  data = dashboard.dashboard_data(user_id)
 
-  # Query category which most money is spent on
-  top_category = (
-    db.session.query(
-      Category.name,
-      db.func.sum(Expense.amount).label("total_spent")
-    )
-    .join(Expense)
-    .filter(Category.user_id == user_id)
-    .group_by(Category.id)
-    .order_by(db.desc("total_spent"))
-    .first()
-  )
-
-  
   # For now jsut display a Hello Fitness
   theme = session.get("theme", "light")
   
@@ -98,29 +105,30 @@ def index():
     return redirect("/")
   else:
     # Query charts and render charts --> Entire Overall user expense 
-    return render_template("index.html", theme=theme, expense=recent_expense, budget=recent_budget, top_category=top_category, now=now)
+    return render_template("index.html", theme=theme, expense=data["expense"], budget=data["budget"], top_category=data["top_category"], chart=data["chart"], now=now)
 
-@app.route("/api/chart-data")
+
+# All dashboard widgets as one JSON document (same data index renders inline)
+@main.route("/api/dashboard")
 @login_required
+@replica_read
+@response_cache.cached
+def dashboard_api():
+  user_id = session.get("user_id")
+  return jsonify(dashboard.as_json(dashboard.dashboard_data(user_id))), 200
+
+@main.route("/api/chart-data")
+@login_required
+@replica_read
+@response_cache.cached
 def bar_chart_endpoint():
   # Get user id
   user_id = session.get("user_id")
   # Adding a bar-chart from the chatJS lib
   # pie-chart for expenses -> Called in Index route
   # Aggregate expenses per category (include categories with zero expenses)
-   # Get user id
-  user_id = session.get("user_id")
-  line_data = (
-    db.session.query(
-      Category.name,
-      db.func.coalesce(db.func.sum(Expense.amount), 0).label("total_spent")
-    )
-    .outerjoin(Expense, Expense.category_id==Category.id)
-    .filter(Category.user_id==user_id)
-    .group_by(Category.id, Category.name)
-    .order_by(db.func.sum(Expense.amount).desc())
-    .all()
-  ) # Original adjusted by Copilot
+  # read from the maintained spending aggregates
+  line_data = aggregates.category_totals(user_id)
 
   # Chart.js expects labels and a dataset array
   labels = [row[0] for row in line_data]
@@ -136,7 +144,7 @@ def bar_chart_endpoint():
 
 
 # Add expense route
-@app.route("/add", methods=["GET", "POST"])
+@main.route("/add", methods=["GET", "POST"])
 @login_required
 def add_expense():
   user_id = session.get("user_id")
@@ -145,31 +153,21 @@ def add_expense():
     return redirect("/login")
 
   # ----------------------------
-  # Ensure categories exist by seeding default categories only once
-  existing_names = {c.name for c in Category.query.filter_by(user_id=user_id).all()}
-  default_categories = ["Food", "Transport", "Entertainment", "Utilities", "Shopping"]
-  
-
-  for name in default_categories:
-    if name not in existing_names:
-      add_category = Category()
-      add_category.name=name
-      add_category.user_id=user_id
-      db.session.add(add_category)
-  db.session.commit()
-
-  # Reload categories after seeding
-  categories = Category.query.filter_by(user_id=user_id).all()
+  # Default categories are seeded at registration; accounts created before that
+  # get them here once, later requests are served from the category cache
+  if user_categories.ensure_defaults(user_id):
+    response_cache.invalidate(user_id)
+  categories = user_categories.user_categories(user_id)
     # Get inputs/form
     # Select: category of expenses then: submit
   if request.method == "POST":
-    income = request.form.get("income", type=float)
+    income = request.form.get("income", type=money)
     expense = request.form.get("expense")
     merchant = request.form.get("merchant")
     category_name = request.form.get("category")
-    amount = request.form.get("amount", type=float)   # amount spent on the expense
+    amount = request.form.get("amount", type=money)   # amount spent on the expense
     currency = request.form.get("currency")
-    created_at = datetime.now().strftime("%Y-%m-%d")
+    created_at = date.today()
 
     # define a new errors list to handle all input errors altogether
     errors = []
@@ -181,8 +179,6 @@ def add_expense():
       errors.append("Expense is required")
     if not merchant:
       errors.append("Merchant is required")
-    if not category_name:
-      errors.append("Category is required")
     if not amount:
       errors.append("Amount is required")
     if not currency:
@@ -206,16 +202,29 @@ def add_expense():
       return redirect("/add")
 
     #--------------------------------------------------
-    # Get Category object 
-    category_obj = Category.query.filter_by(user_id=user_id, name=category_name).first()
+    # Get Category id; left on "Auto" it is predicted from the user's merchant history
+    if category_name:
+      category_id = user_categories.find(user_id, category_name)
+    else:
+      category_id = merchants.predict(user_id, merchant, expense)
+    if category_id is None:
+      flash("Category is required")
+      return redirect("/add")
 
     # Get user income
     user_income = db.session.query(Income).filter(user_id==user_id).first()
     if not user_income:
       return redirect("/profile")
     
+    # amount in the user's base currency, stored with the expense for the totals
+    try:
+      normalized_amount = currencies.normalize(amount, currency, currencies.base_currency(user_id))
+    except ValueError as error:
+      flash(str(error))
+      return redirect("/add")
+
     # for current session if amount of expense > income -> do not add expense
-    if amount > user_income.income_value:
+    if normalized_amount > user_income.income_value:
       flash(f"You cannot afford this expense: {expense}")
   
     # making sure variable types are not None before assigning
@@ -225,21 +234,30 @@ def add_expense():
       new_expense = Expense()
       new_expense.expense=expense
       new_expense.merchant=merchant
-      new_expense.category=category_obj
+      new_expense.category_id=category_id
       new_expense.amount=amount
       new_expense.currency=currency
+      new_expense.normalized_amount=normalized_amount
       new_expense.created_at=created_at
       
       # use button actions add data to the database
       db.session.add(new_expense)
+
+      # keep the spending aggregates in step, same transaction
+      delta = aggregates.SpendingDelta()
+      delta.add(user_id, category_id, created_at, normalized_amount)
+      delta.apply()
       db.session.commit()
+      response_cache.invalidate(user_id)
+      merchants.record(user_id, merchant, category_id, expense)
       flash("Expense added successfully!")
     return redirect("/add")
   return render_template("expense_form.html",mode="add", expense=None, categories=categories)
 
 
 # Bugeting route and data endpoint
-@app.route("/api/add_budget", methods=["GET", "POST"])
+@main.route("/api/add_budget", methods=["GET", "POST"])
+@replica_read
 def create_budget():
   user_id = session.get("user_id")
 
@@ -258,82 +276,110 @@ def create_budget():
     # Validate required fields
     if not all([name, month, year, budget_limit]):
       return jsonify({"success": False, "message": "All fields are required"}), 400
+    try:
+      budget_limit = money(budget_limit)
+    except ValueError as error:
+      return jsonify({"success": False, "message": str(error)}), 400
 
     # Retrieve user's income record
     income = db.session.query(Income).filter_by(user_id=user_id).first()
     if not income:
       return jsonify({"success": False, "message": "All fields are required"}), 400
 
-    # Ensure category exists (create if new)
-    category_obj = Category.query.filter_by(user_id=user_id, name=name).first()
-
-    if not category_obj:
-      category_obj = Category()
-      category_obj.user_id=user_id
-      category_obj.name=name
-      db.session.add(category_obj)
-      db.session.flush()  # Get ID without committing
+    # Ensure category exists (create if new, flushed to get its id without committing)
+    category_id = user_categories.get_or_create(user_id, name)
 
     # Create budget entry
     new_budget = BudgetEntry()
-    new_budget.category_id=category_obj.id
-    new_budget.category=category_obj
+    new_budget.category_id=category_id
     new_budget.income_id=income.id
     new_budget.month=month
     new_budget.year=year
     new_budget.budget_limit=budget_limit
 
-    total_spent = db.session.query(
-      db.func.sum(Expense.amount)  # since Expense table is linked to BudgetEntry
-    ).filter(Expense.budget_entry_id==new_budget.id).scalar() or 0
-
     db.session.add(new_budget)
     db.session.commit()
+    response_cache.invalidate(user_id)
+
+    # total spent for the new budget's month/year
+    data = budget_rollup(user_id, budget_id=new_budget.id)[0]
 
     return jsonify({
       "success": True,
-      "data": {
-        "id": new_budget.id,
-        "name": category_obj.name,
-        "month": new_budget.month,
-        "year": new_budget.year,
-        "budget_limit": new_budget.budget_limit,
-        "total_spent": total_spent,
-        "remaining": new_budget.budget_limit - total_spent
-      }
+      "data": data
     }), 201
   else:
     # GET method logic, gets the already saved data from the db (if any)
-    budgets = (
-      db.session.query(BudgetEntry, Category)
-      .join(Category, BudgetEntry.category_id==Category.id)
-      .filter(Category.user_id==user_id)
-      .all()
-    )
+    # total spent is computed for every budget in one grouped query
+    data = budget_rollup(user_id)
+    return jsonify({"data": data}), 200
 
-    # add total spent dynamically
-    data = []
+# Recurring expenses (rent, subscriptions) and monthly budgets
+# POST body: {"kind": "expense"|"budget", "category", "amount", "currency", "expense", "merchant",
+#             "frequency": "weekly"|"monthly"|"yearly", "start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}
+# Due dates are written by the scheduler (flask run-recurring or RECURRING_WORKER)
+@main.route("/api/recurring", methods=["GET", "POST"])
+@login_required
+def recurring_rules():
+  user_id = session.get("user_id")
+  if request.method == "POST":
+    try:
+      rule = recurring.create_rule(user_id, request.get_json(silent=True) or {})
+    except ValueError as error:
+      db.session.rollback()
+      return jsonify({"success": False, "message": str(error)}), 400
+    db.session.commit()
+    return jsonify({"success": True, "data": rule.to_dict()}), 201
+  return jsonify({"data": [rule.to_dict() for rule in recurring.user_rules(user_id)]}), 200
+
+
+# Stop a recurring rule, the expenses it already wrote are kept
+@main.route("/api/recurring/<int:rule_id>", methods=["DELETE"])
+@login_required
+def stop_recurring_rule(rule_id):
+  if not recurring.stop_rule(session.get("user_id"), rule_id):
+    return jsonify({"success": False, "message": "Not found"}), 404
+  return jsonify({"success": True}), 200
+
+# Budget threshold alerts (50/80/100% of a limit), written on every expense change
+# Poll: /api/alerts?after=<last id> (without it, the unread alerts)
+@main.route("/api/alerts")
+@login_required
+def alerts_api():
+  user_id = session.get("user_id")
+  data = [alert.to_dict() for alert in alerts.user_alerts(user_id, request.args.get("after", type=int))]
+  return jsonify({"data": data, "last_id": data[-1]["id"] if data else request.args.get("after", type=int)}), 200
+
+
+# Mark alerts as read, all of them or up to an id: {"up_to": 42}
+@main.route("/api/alerts/read", methods=["POST"])
+@login_required
+def read_alerts_api():
+  up_to = (request.get_json(silent=True) or {}).get("up_to")
+  # JSON true/false are ints to isinstance, they are not alert ids
+  if up_to is not None and (isinstance(up_to, bool) or not isinstance(up_to, int)):
+    return jsonify({"success": False, "message": "up_to must be an alert id"}), 400
+  return jsonify({"success": True, "read": alerts.mark_read(session.get("user_id"), up_to)}), 200
 
-    for budget, category in budgets:
-      total_spent = db.session.query(
-        db.func.sum(Expense.amount)
-      ).filter(Expense.category_id==category.id).scalar() or 0
-      
-      data.append({
-        "id": budget.id,
-        "name": category.name,
-        "month": budget.month,
-        "year": budget.year,
-        "budget_limit": budget.budget_limit,
-        "total_spent": total_spent,
-        "remaining": budget.budget_limit - total_spent
-      })
-      
-    return jsonify({"data": data}), 200
+
+# Server-sent events, for EventSource("/api/alerts/stream"); reconnects resume from Last-Event-ID
+# Holds a worker thread for up to ALERT_STREAM_SECONDS: threaded or async workers only
+@main.route("/api/alerts/stream")
+@login_required
+def alerts_stream():
+  user_id = session.get("user_id")
+  after = request.headers.get("Last-Event-ID", type=int)
+  if after is None:
+    after = request.args.get("after", type=int)
+  return Response(
+    stream_with_context(alerts.stream(user_id, after)),
+    mimetype="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
 
 # User can set budgets for categories and track their spending habits
 # against those limits
-@app.route("/budgeting", methods=["GET", "POST"])
+@main.route("/budgeting", methods=["GET", "POST"])
 @login_required
 def budgeting():
   return render_template("budgeting.html")
@@ -341,48 +387,170 @@ def budgeting():
 # Expenses route
 # User can view they already have and add a new expense if they want to
 # can only view expenses if expenses exist, otherwise nothing
-@app.route("/expenses", methods=["GET"])
+@main.route("/expenses", methods=["GET"])
 @login_required
+@replica_read
 def expenses():
   user_id = session.get("user_id")
   if request.method == "POST":
     return redirect("/expenses")
-  
-  # Query the expenses database
-  res = (
-    select(Expense)
-    .join(Category)
-    .where(Category.user_id == user_id)
-    .order_by(Expense.created_at.desc())
-  )
 
-  expenses = db.session.execute(res).scalars().all()
-  return render_template("expenses.html", expenses=expenses)
+  # ?q= searches descriptions and merchants, best matches first
+  if request.args.get("q"):
+    try:
+      expenses = search.search(user_id, request.args["q"], limit=search.MAX_RESULTS)
+    except ValueError:
+      return redirect("/expenses")
+    return render_template("expenses.html", expenses=expenses, next_cursor=None, streaming=False)
+
+  # ?stream=1 renders the whole history, rows are sent as they are fetched
+  if request.args.get("stream"):
+    expenses = pagination.iter_expenses(user_id)
+    return stream_template("expenses.html", expenses=expenses, next_cursor=None, streaming=True)
+
+  # Query one page of the expenses database
+  try:
+    expenses, next_cursor = pagination.expense_page(
+      user_id, request.args.get("cursor"), request.args.get("limit", type=int)
+    )
+  except ValueError:
+    return redirect("/expenses")
+  return render_template("expenses.html", expenses=expenses, next_cursor=next_cursor, streaming=False)
+
+
+# JSON variant of the expenses list: /api/expenses?cursor=...&limit=...
+@main.route("/api/expenses")
+@login_required
+@replica_read
+def expenses_api():
+  user_id = session.get("user_id")
+  try:
+    expenses, next_cursor = pagination.expense_page(
+      user_id, request.args.get("cursor"), request.args.get("limit", type=int)
+    )
+  except ValueError:
+    return jsonify({"error": "Invalid cursor"}), 400
+
+  return jsonify({
+    "data": [expense.to_dict() for expense in expenses],
+    "next_cursor": next_cursor,
+  }), 200
 
   """res = select(Expense).order_by(Expense.created_at)
   expenses = [expense for expense, in db.session.execute(res)]
   return render_template("expenses.html", expenses=expenses)"""
 
+# Merchant autocomplete for the expense form: /api/merchants/suggest?q=wool&limit=10
+# Answered from the user's in-memory merchant index (see merchants.py)
+@main.route("/api/merchants/suggest")
+@login_required
+@replica_read
+def merchant_suggestions_api():
+  user_id = session.get("user_id")
+  suggestions = merchants.suggest(user_id, request.args.get("q", ""), request.args.get("limit", type=int))
+  return jsonify({"data": suggestions}), 200
+
+# Full-text search: /api/expenses/search?q=coffee&category=&start=&end=&limit=
+# Every word is a prefix, results are ranked by relevance (see search.py)
+@main.route("/api/expenses/search")
+@login_required
+@replica_read
+def search_expenses_api():
+  user_id = session.get("user_id")
+  try:
+    start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+    end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+  except ValueError:
+    return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+  try:
+    expenses = search.search(
+      user_id, request.args.get("q"), request.args.get("category"), start, end,
+      request.args.get("limit", type=int),
+    )
+  except ValueError as error:
+    return jsonify({"error": str(error)}), 400
+  return jsonify({"data": [expense.to_dict() for expense in expenses]}), 200
+
+# Bulk import of a bank export (CSV or OFX) sent as the "file" field of a multipart form
+# Optional form fields: format (csv/ofx), default_category, currency
+@main.route("/api/expenses/import", methods=["POST"])
+@login_required
+def import_expenses_api():
+  user_id = session.get("user_id")
+  upload = request.files.get("file")
+  if not upload:
+    return jsonify({"success": False, "message": "A CSV or OFX file is required"}), 400
+
+  head = upload.stream.read(64).decode("utf-8", "ignore")
+  upload.stream.seek(0)
+  file_format = request.form.get("format") or importer.detect_format(upload.filename, head)
+
+  stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", errors="replace", newline="")
+  report = importer.import_expenses(
+    user_id,
+    stream,
+    file_format=file_format,
+    default_category=request.form.get("default_category") or importer.DEFAULT_CATEGORY,
+    default_currency=request.form.get("currency"),
+  )
+  response_cache.invalidate(user_id)
+  return jsonify({"success": True, **report}), 200
+
+# Several expense changes in one request and one transaction, for sync clients
+# POST body: {"create": [{...}], "update": [{"id", ...}], "delete": [id, ...]} (see batch.py)
+# Nothing is written unless every operation is valid; the errors list says which were not
+@main.route("/api/expenses/batch", methods=["POST"])
+@login_required
+def expenses_batch_api():
+  user_id = session.get("user_id")
+  payload = request.get_json(silent=True)
+  if not isinstance(payload, dict):
+    return jsonify({"success": False, "message": "A JSON object is required"}), 400
+  try:
+    report = batch.apply(user_id, payload)
+  except batch.BatchError as error:
+    return jsonify({"success": False, "message": str(error), "errors": error.errors}), 400
+  response_cache.invalidate(user_id)
+  merchants.invalidate(user_id)
+  return jsonify({"success": True, **report}), 200
+
+# Streaming export of the user's expenses
+# /api/expenses/export?format=csv|ndjson|columnar&dataset=expenses|monthly&start=&end=&category=
+@main.route("/api/expenses/export")
+@login_required
+def export_expenses_api():
+  user_id = session.get("user_id")
+  file_format = request.args.get("format", "csv")
+  dataset = request.args.get("dataset", "expenses")
+  if file_format not in exporter.FORMATS or dataset not in exporter.DATASETS:
+    return jsonify({"error": "Unknown format or dataset"}), 400
+
+  try:
+    start = date.fromisoformat(request.args["start"]) if request.args.get("start") else None
+    end = date.fromisoformat(request.args["end"]) if request.args.get("end") else None
+  except ValueError:
+    return jsonify({"error": "Dates must be YYYY-MM-DD"}), 400
+
+  mimetype, extension = exporter.FORMATS[file_format]
+  chunks = exporter.export(user_id, file_format, dataset, start, end, request.args.get("category"))
+  return Response(
+    stream_with_context(chunks),
+    mimetype=mimetype,
+    headers={"Content-Disposition": f"attachment; filename={dataset}.{extension}"},
+  )
+
 """
   Some API endpoints to display the REPORTS data represented in charts
 """
 
-@app.route("/api/reports-data")
+@main.route("/api/reports-data")
 @login_required
+@replica_read
+@response_cache.cached
 def reports_bar_chart():
   # Get user id
   user_id = session.get("user_id")
-  pie_data = (
-    db.session.query(
-      Category.name,
-      db.func.coalesce(db.func.sum(Expense.amount), 0).label("total_spent")
-    )
-    .outerjoin(Expense, Expense.category_id==Category.id)
-    .filter(Category.user_id==user_id)
-    .group_by(Category.id, Category.name)
-    .order_by(db.func.sum(Expense.amount).desc())
-    .all()
-  ) # Original adjusted by Copilot
+  pie_data = aggregates.category_totals(user_id)
 
   # Chart.js expects labels and a dataset array
   pie_labels = [row[0] for row in pie_data]
@@ -418,20 +586,46 @@ def reports_bar_chart():
     })
 
 
+# Spending per category per day/week/month over a date range, one page of periods at a time
+# /api/reports/timeseries?bucket=week&start=2025-01-01&end=2025-12-31&category=Food&limit=26
+@main.route("/api/reports/timeseries")
+@login_required
+@replica_read
+@response_cache.cached
+def reports_timeseries():
+  user_id = session.get("user_id")
+  try:
+    start = request.args.get("start")
+    end = request.args.get("end")
+    cursor = request.args.get("cursor")
+    data = spending_reports.timeseries(
+      user_id,
+      bucket=request.args.get("bucket", "month"),
+      start=date.fromisoformat(start) if start else None,
+      end=date.fromisoformat(end) if end else None,
+      category=request.args.get("category") or None,
+      cursor=date.fromisoformat(cursor) if cursor else None,
+      limit=request.args.get("limit", type=int),
+    )
+  except ValueError as error:
+    return jsonify({"error": str(error)}), 400
+  return jsonify(data), 200
+
+
 # reports
-@app.route("/reports", methods=["GET"])
+@main.route("/reports", methods=["GET"])
 @login_required
 def reports():
   return render_template("reports.html")
 
-@app.route("/profile", methods=["GET", "POST"])
+@main.route("/profile", methods=["GET", "POST"])
 @login_required
 def profile():
   user_id = session["user_id"]
   now = datetime.now()
   
   if request.method == "POST":
-    income = request.form.get("income", type=float)
+    income = request.form.get("income", type=money)
     action = request.form.get("action")
     
     # Validate inputs
@@ -462,6 +656,7 @@ def profile():
         if action == "save-income": 
           db.session.add(add_income)
           db.session.commit()
+          response_cache.invalidate(user_id)
     return redirect("/profile")
   else:
     # use date for when user enters income
@@ -478,7 +673,7 @@ def profile():
   CRUD extensions for the expense route.
   Here we implement a delete expense and Edit expense
 """
-@app.route("/delete-expense/<int:expense_id>", methods=["POST"])
+@main.route("/delete-expense/<int:expense_id>", methods=["POST"])
 @login_required
 def delete(expense_id):
   user_id = session.get("user_id")
@@ -494,13 +689,19 @@ def delete(expense_id):
   expense = db.session.execute(res).scalar_one_or_none()
 
   if expense:
+    delta = aggregates.SpendingDelta()
+    delta.remove(user_id, expense.category_id, expense.created_at, expense.normalized_amount)
+    delta.apply()
+
     db.session.delete(expense)
     db.session.commit()
+    response_cache.invalidate(user_id)
+    merchants.invalidate(user_id)
 
   return redirect("/expenses")
 
 # Edit expense route
-@app.route("/edit-expense/<int:expense_id>", methods=["GET", "POST", "PUT"])
+@main.route("/edit-expense/<int:expense_id>", methods=["GET", "POST", "PUT"])
 @login_required
 def edit_expense(expense_id):
   user_id = session.get("user_id")
@@ -511,24 +712,24 @@ def edit_expense(expense_id):
     .where(Category.user_id == user_id, Expense.id == expense_id)
   )
   expense = db.session.execute(res).scalar_one_or_none()
-  categories = Category.query.filter_by(user_id=user_id).all()
+  categories = user_categories.user_categories(user_id)
 
   if not expense:
     return redirect("/expenses")
 
   if request.method == "POST":
-    income = request.form.get("income", type=float)
-    expense = request.form.get("expense")
+    income = request.form.get("income", type=money)
+    expense_name = request.form.get("expense")
     merchant = request.form.get("merchant")
     category_name = request.form.get("category")
-    amount = request.form.get("amount", type=float)   # amount spent on the expense
+    amount = request.form.get("amount", type=money)   # amount spent on the expense
     currency = request.form.get("currency")
-    modified_at = datetime.now().strftime("%Y-%m-%d")
+    modified_at = date.today()
 
     # validate inputs
     if not income:
       return redirect(f"/edit-expense/{expense_id}")
-    if not expense:
+    if not expense_name:
       return redirect(f"/edit-expense/{expense_id}")
     if not merchant:
       return redirect(f"/edit-expense/{expense_id}")
@@ -551,31 +752,50 @@ def edit_expense(expense_id):
       flash("Amount must be greater than 0")
       return redirect(f"/edit-expense/{expense_id}")
     
-    update_expense = Expense()
-    update_expense.expense=expense
-    update_expense.category=category_name
-    update_expense.amount=amount
-    update_expense.currency=currency
-    update_expense.created_at=modified_at
+    category_id = user_categories.find(user_id, category_name)
+    if category_id is None:
+      return redirect(f"/edit-expense/{expense_id}")
+
+    try:
+      normalized_amount = currencies.normalize(amount, currency, currencies.base_currency(user_id))
+    except ValueError as error:
+      flash(str(error))
+      return redirect(f"/edit-expense/{expense_id}")
+
+    # Move the old values out of the aggregates and the new ones in
+    delta = aggregates.SpendingDelta()
+    delta.remove(user_id, expense.category_id, expense.created_at, expense.normalized_amount)
+    delta.add(user_id, category_id, modified_at, normalized_amount)
+
+    # Update the loaded expense in place
+    expense.expense=expense_name
+    expense.merchant=merchant
+    expense.category_id=category_id
+    expense.amount=amount
+    expense.currency=currency
+    expense.normalized_amount=normalized_amount
+    expense.created_at=modified_at
+
+    delta.apply()
 
     # Commit changes
     db.session.commit()
+    response_cache.invalidate(user_id)
+    merchants.invalidate(user_id)
     return redirect("/expenses")
 
   return render_template("expense_form.html", mode="edit", expense=expense, categories=categories)
 
 
 # Register / Sign up new user
-@app.route("/register", methods=["GET", "POST"])
+@main.route("/register", methods=["GET", "POST"])
+@password_hasher.throttled("register.html")
 def sign_up():
   if request.method == "POST":
     email = request.form.get("email")
     password = request.form.get("password")
     confirm_password = request.form.get("confirm-password")
 
-    print("EMAIL FORM FORM: ", repr(email))
-    print("PASSWORD FROM FORM", repr(password))
-
     #action = request.form.get("register")
 
     # Validate the form inputs
@@ -591,11 +811,6 @@ def sign_up():
     # first select user by email
     user = db.session.query(User).filter_by(email=email).first()
 
-    print("USER:", user)
-    print("HASH:", user.password_hash if user else None)
-    #rint("PASSWORD CHECK:", user.check_password(password))
-    
-    
     # store/insert the details in the database
     # check if user already exists in the User model, if not, add user
     if not user:
@@ -603,12 +818,16 @@ def sign_up():
 
       new_user = User()
       new_user.email=email
-      new_user.set_password(password)
-      print("PASSWORD CHECK:", new_user.check_password(password))
+      # hashed on the bounded hashing pool, not in the request thread
+      new_user.password_hash = password_hasher.hash(password)
 
 
       #if action == "register":
       db.session.add(new_user)
+      db.session.flush()
+
+      # one-time default categories, so the add expense page never has to write
+      user_categories.seed_defaults(new_user.id)
       db.session.commit()
       return redirect("/login")
     else:
@@ -618,7 +837,8 @@ def sign_up():
     return render_template("register.html")
 
 # Login
-@app.route("/login", methods=["GET", "POST"])
+@main.route("/login", methods=["GET", "POST"])
+@password_hasher.throttled("login.html")
 def login():
   #session.clear()
   if request.method == "POST":
@@ -634,10 +854,15 @@ def login():
     user = db.session.query(User).filter_by(email=email).first()
 
     # Verify user exists and password matches
-    if user is None or not check_password_hash(user.password_hash, password):
+    if user is None or not password_hasher.verify(user.password_hash, password):
       flash("Incorrect email and/or password")
       return redirect("/login")
 
+    # upgrade hashes made with older KDF settings while we have the password
+    if password_hasher.needs_rehash(user.password_hash):
+      user.password_hash = password_hasher.hash(password)
+      db.session.commit()
+
     # Successful login
     session["user_id"] = user.id
     return redirect("/")
@@ -648,7 +873,7 @@ def login():
   # -------------------------------------------
 #  Theme control
 # Dark mode light mode features
-@app.route("/toggle_theme")
+@main.route("/toggle_theme")
 def toggle_theme():
   current_theme = session.get("theme", "light")
   new_theme = "dark" if current_theme == "light" else "light"
@@ -657,26 +882,219 @@ def toggle_theme():
   ref = request.referrer or "/"
   return redirect(ref)
 
-@app.context_processor
+@main.app_context_processor
 def inject_theme():
   return {"theme": session.get("theme", "light")}
 
 # Logout -> on logout
-@app.route("/logout")
+@main.route("/logout")
 def logout():
   session.clear()
   # redirect to login page
   return render_template("logout.html")
 
-@app.context_processor
+@main.app_context_processor
 def inject_now():
   return {"now": datetime.utcnow()}
 
 
+# Create the tables of a new database
+# flask init-db
+@main.cli.command("init-db")
+def init_db_command():
+  # imported here, commands that are not run should not cost every worker its import
+  import migrations
+  migrations.create_schema()
+  click.echo("Database initialized")
+
+
+# Upgrade an existing database to the current schema (new columns, indexes, backfills)
+# flask migrate
+@main.cli.command("migrate")
+def migrate_command():
+  import migrations
+  migrations.upgrade()
+  click.echo("Database upgraded")
+
+
+# Print the query plans of the hot-path queries, fail on full table scans and unbounded sorts
+# flask check-plans [--user-id 1]
+@main.cli.command("check-plans")
+@click.option("--user-id", type=int, default=1)
+def check_plans_command(user_id):
+  import query_plans
+  failed = False
+  for name, (plan, problem) in query_plans.check(user_id).items():
+    click.echo(f"{problem or 'ok':<4} {name}")
+    for line in plan:
+      click.echo(f"       {line}")
+    if not problem and any(query_plans.TEMP_SORT.search(line) for line in plan):
+      click.echo(f"       (sort allowed: {query_plans.BOUNDED_SORTS[name]})")
+    failed = failed or bool(problem)
+  if failed:
+    raise SystemExit(1)
+
+
+# Import a bank export for a user
+# flask import-expenses statement.csv --email me@example.com
+@main.cli.command("import-expenses")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--email", required=True, help="Owner of the imported expenses.")
+@click.option("--format", "file_format", type=click.Choice(["csv", "ofx"]), default=None)
+@click.option("--default-category", default=importer.DEFAULT_CATEGORY, help="Category for rows without one.")
+@click.option("--currency", default=None, help="Currency for rows without one.")
+def import_expenses_command(path, email, file_format, default_category, currency):
+  user = db.session.query(User).filter_by(email=email).first()
+  if not user:
+    raise click.ClickException(f"No user with email {email}")
+
+  with open(path, encoding="utf-8-sig", errors="replace", newline="") as stream:
+    file_format = file_format or importer.detect_format(path, stream.read(64))
+    stream.seek(0)
+    report = importer.import_expenses(user.id, stream, file_format, default_category, currency)
+  response_cache.invalidate(user.id)
+
+  for error in report["errors"]:
+    click.echo(f"row {error['row']}: {error['error']}")
+  click.echo(f"Imported {report['imported']} expense(s), {report['failed']} row(s) failed")
+
+
+# Export a user's expenses to a file (or stdout with -o -)
+# flask export --email me@example.com --format columnar -o backup.expcol
+@main.cli.command("export")
+@click.option("--email", required=True)
+@click.option("--format", "file_format", type=click.Choice(list(exporter.FORMATS)), default="csv")
+@click.option("--dataset", type=click.Choice(list(exporter.DATASETS)), default="expenses")
+@click.option("--start", type=click.DateTime(["%Y-%m-%d"]), default=None)
+@click.option("--end", type=click.DateTime(["%Y-%m-%d"]), default=None)
+@click.option("--category", default=None)
+@click.option("-o", "--output", default="-", help="Output file, - for stdout.")
+def export_command(email, file_format, dataset, start, end, category, output):
+  user = db.session.query(User).filter_by(email=email).first()
+  if not user:
+    raise click.ClickException(f"No user with email {email}")
+
+  chunks = exporter.export(
+    user.id, file_format, dataset,
+    start.date() if start else None, end.date() if end else None, category,
+  )
+  mode = "wb" if file_format == "columnar" else "w"
+  with click.open_file(output, mode) as stream:
+    for chunk in chunks:
+      stream.write(chunk)
+
+
+# Recompute the spending aggregates from the Expense rows
+# flask rebuild-aggregates [--verify]
+@main.cli.command("rebuild-aggregates")
+@click.option("--verify", is_flag=True, help="Only compare the stored aggregates, do not rebuild.")
+@click.option("--user-id", type=int, default=None, help="Limit to a single user.")
+def rebuild_aggregates_command(verify, user_id):
+  if verify:
+    mismatches = aggregates.verify(user_id)
+    for key, have, want in mismatches:
+      click.echo(f"{key}: stored {have}, expected {want}")
+    click.echo(f"{len(mismatches)} mismatched aggregate(s)")
+    if mismatches:
+      raise SystemExit(1)
+    return
+
+  aggregates.rebuild(user_id)
+  if user_id is None:
+    response_cache.invalidate_all()
+  else:
+    response_cache.invalidate(user_id)
+  click.echo("Spending aggregates rebuilt")
+
+
+
+# Load exchange rates from the rates file and re-express stored amounts with them
+# flask load-rates [exchange_rates.json]
+@main.cli.command("load-rates")
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False))
+def load_rates_command(path):
+  count = currencies.load_rates(path)
+  updated, missing = currencies.renormalize()
+  response_cache.invalidate_all()
+  click.echo(f"Loaded {count} exchange rate(s), renormalized {updated} expense(s)")
+  if missing:
+    click.echo(f"No rate for: {', '.join(code.upper() for code in missing)}")
+
+
+# Recompute normalized amounts (and aggregates) from the current rates
+# flask renormalize [--user-id 1]
+@main.cli.command("renormalize")
+@click.option("--user-id", type=int, default=None, help="Limit to a single user.")
+def renormalize_command(user_id):
+  updated, missing = currencies.renormalize(user_id)
+  if user_id is None:
+    response_cache.invalidate_all()
+  else:
+    response_cache.invalidate(user_id)
+  click.echo(f"Renormalized {updated} expense(s)")
+  if missing:
+    click.echo(f"No rate for: {', '.join(code.upper() for code in missing)}")
+
+
+# Change the currency a user's totals are reported in
+# flask set-base-currency --email me@example.com --currency usd
+@main.cli.command("set-base-currency")
+@click.option("--email", required=True)
+@click.option("--currency", required=True)
+def set_base_currency_command(email, currency):
+  user = db.session.query(User).filter_by(email=email).first()
+  if not user:
+    raise click.ClickException(f"No user with email {email}")
+  try:
+    updated, missing = currencies.set_base_currency(user.id, currency)
+  except ValueError as error:
+    raise click.ClickException(str(error))
+  response_cache.invalidate(user.id)
+  click.echo(f"Base currency set to {currencies.code(currency).upper()}, renormalized {updated} expense(s)")
+  if missing:
+    click.echo(f"No rate for: {', '.join(code.upper() for code in missing)}")
+
+
+# Rebuild the expense search index from the expenses table
+# flask reindex-search
+@main.cli.command("reindex-search")
+def reindex_search_command():
+  if not search.create_index():
+    if not search.supports_fts(db.session.connection()):
+      raise click.ClickException("This database has no FTS5 support, search uses LIKE instead")
+    count = search.reindex()
+  else:
+    count = db.session.query(Expense).count()
+  db.session.commit()
+  click.echo(f"Search index rebuilt, {count} expense(s) indexed")
+
+
+# Write the recurring expenses and budgets due up to today (run it from cron)
+# flask run-recurring [--date 2025-01-31]
+@main.cli.command("run-recurring")
+@click.option("--date", "today", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Run as of this date.")
+@click.option("--batch-size", type=int, default=recurring.BATCH_SIZE)
+def run_recurring_command(today, batch_size):
+  report = recurring.run_due(today.date() if today else None, batch_size)
+  click.echo(
+    f"{report['rules']} rule(s) run: {report['expenses']} expense(s), {report['budgets']} budget(s),"
+    f" {report['skipped']} skipped"
+  )
+
+
+# Copy the primary database into the SQLite read replica (local two-file setups)
+# flask sync-replica
+@main.cli.command("sync-replica")
+def sync_replica_command():
+  if database.REPLICA not in db.engines:
+    raise click.ClickException("No read replica configured (DATABASE_REPLICA_URL)")
+  database.sync_replica()
+  click.echo("Replica synced")
 
 # Always validate main
+# There is no module-level app: wsgi.py builds one (used by `flask` and WSGI servers)
 if __name__ == "__main__":
-  app.run(debug=True)
+  create_app().run(debug=True)
 
 
 """
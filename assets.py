@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from collections import namedtuple
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+"""
+  Static files with content-hashed names, long-lived caching and compression.
+  url_for("static", filename="css/styles.css") returns /static/css/styles.<hash>.css, where
+  the hash is taken from the file's content. A URL whose hash matches the file is served
+  with "Cache-Control: public, max-age=31536000, immutable", so the browser never asks
+  for it again; a changed file gets a new name, so there is nothing to invalidate. Plain
+  or outdated names are still served, but revalidated with an ETag every time.
+
+  Text assets are compressed once per process, gzip (level 9) and brotli (quality 11, when
+  the brotli package is installed), and the best variant the browser accepts is sent.
+  Larger HTML and JSON responses of the app are compressed as they are sent
+  (compress_response()), unless they are streamed.
+
+  Config:
+    ASSETS_COMPRESS       compress HTML and JSON responses (default True)
+    COMPRESS_MIN_SIZE     smallest response body compressed, in bytes (default 1400)
+"""
+
+HASH_LENGTH = 12
+IMMUTABLE = "public, max-age=31536000, immutable"
+# files above this size are sent from disk as they are, not held in memory
+MAX_MEMORY_SIZE = 1024 * 1024
+# smaller files are not worth a Content-Encoding
+PRECOMPRESS_MIN_SIZE = 256
+PRECOMPRESSED = {
+  "application/javascript", "application/json", "image/svg+xml", "text/css", "text/html",
+  "text/javascript", "text/plain",
+}
+COMPRESSED = {"application/json", "text/html"}
+
+FINGERPRINT = re.compile(r"^(?P<name>.+)\.(?P<digest>[0-9a-f]{%d})(?P<ext>\.[^./]+)$" % HASH_LENGTH)
+
+Asset = namedtuple("Asset", ["path", "stamp", "digest", "mimetype", "variants"])
+
+
+def compress(data, encoding, level=None):
+  if encoding == "br":
+    return brotli.compress(data, quality=4 if level is None else level)
+  return gzip.compress(data, 6 if level is None else level, mtime=0)
+
+
+def encodings():
+  # Content codings this process can produce, best first
+  return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def accepted(variants):
+  # The best encoding in `variants` that the request accepts, None for the plain body
+  for encoding in encodings():
+    if encoding in variants and request.accept_encodings[encoding] > 0:
+      return encoding
+  return None
+
+
+class Manifest:
+  # filename -> Asset, loaded on first use and reloaded when the file changes on disk
+  def __init__(self, folder):
+    self.folder = folder
+    self.assets = {}
+    self.lock = threading.Lock()
+
+  def get(self, filename):
+    # safe_join refuses names outside the folder ("../app.py")
+    path = safe_join(self.folder, filename)
+    try:
+      stat = os.stat(path)
+    except (OSError, TypeError):
+      return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    asset = self.assets.get(filename)
+    if asset is None or asset.stamp != stamp:
+      with self.lock:
+        asset = self.assets[filename] = self._load(path, stamp)
+    return asset
+
+  def _load(self, path, stamp):
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+      for chunk in iter(lambda: file.read(65536), b""):
+        digest.update(chunk)
+    variants = {}
+    if stamp[1] <= MAX_MEMORY_SIZE:
+      with open(path, "rb") as file:
+        variants[None] = body = file.read()
+      if mimetype in PRECOMPRESSED and len(body) >= PRECOMPRESS_MIN_SIZE:
+        for encoding in encodings():
+          variants[encoding] = compress(body, encoding, 11 if encoding == "br" else 9)
+    return Asset(path, stamp, digest.hexdigest()[:HASH_LENGTH], mimetype, variants)
+
+  def url(self, filename):
+    # The fingerprinted name of a static file, the name itself if there is no such file
+    if FINGERPRINT.match(filename):
+      return filename
+    asset = self.get(filename)
+    if asset is None:
+      return filename
+    name, ext = os.path.splitext(filename)
+    return f"{name}.{asset.digest}{ext}"
+
+
+def manifest():
+  return current_app.extensions["assets"]
+
+
+def _fingerprint(endpoint, values):
+  if endpoint == "static" and "filename" in values:
+    values["filename"] = manifest().url(values["filename"])
+
+
+def serve(filename):
+  # Replaces Flask's static view: answers both fingerprinted and plain names
+  match = FINGERPRINT.match(filename)
+  asset = manifest().get(match["name"] + match["ext"] if match else filename)
+  if asset is None:
+    asset = manifest().get(filename)
+    match = None
+  if asset is None:
+    abort(404)
+  immutable = match is not None and match["digest"] == asset.digest
+
+  if None not in asset.variants:
+    response = send_file(asset.path, mimetype=asset.mimetype, conditional=True, etag=asset.digest)
+  else:
+    encoding = accepted(asset.variants)
+    response = current_app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+    if encoding:
+      response.headers["Content-Encoding"] = encoding
+    # one ETag per representation
+    response.set_etag(f"{asset.digest}-{encoding}" if encoding else asset.digest)
+    response.vary.add("Accept-Encoding")
+    response = response.make_conditional(request)
+  # an outdated hash gets today's file, which must not be kept as immutable
+  response.headers["Cache-Control"] = IMMUTABLE if immutable else "public, no-cache"
+  return response
+
+
+def compress_response(response):
+  # gzip or brotli for larger HTML and JSON responses that are not streamed
+  config = current_app.config
+  if (
+    not config["ASSETS_COMPRESS"]
+    or response.mimetype not in COMPRESSED
+    or response.status_code != 200
+    or response.direct_passthrough
+    or response.is_streamed
+    or "Content-Encoding" in response.headers
+  ):
+    return response
+  response.vary.add("Accept-Encoding")
+  encoding = accepted(encodings())
+  if encoding is None or (response.content_length or 0) < config["COMPRESS_MIN_SIZE"]:
+    return response
+  response.set_data(compress(response.get_data(), encoding))
+  response.headers["Content-Encoding"] = encoding
+  # the compressed body is a different representation of the same content
+  etag, weak = response.get_etag()
+  if etag and not weak:
+    response.set_etag(etag, weak=True)
+  return response
+
+
+def init_app(app):
+  app.config.setdefault("ASSETS_COMPRESS", True)
+  app.config.setdefault("COMPRESS_MIN_SIZE", 1400)
+  app.extensions["assets"] = Manifest(app.static_folder)
+  app.url_defaults(_fingerprint)
+  app.view_functions["static"] = serve
+  app.after_request(compress_response)
@@ -0,0 +1,157 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import wraps
+
+from flask import current_app, flash, render_template, request
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+"""
+  Password hashing off the request thread, and throttling for /login and /register.
+
+  Hashes are computed by a bounded pool (hashlib's scrypt/pbkdf2 release the GIL, so a
+  thread pool runs them in parallel). At most AUTH_HASH_WORKERS KDFs run at once and
+  at most AUTH_HASH_QUEUE wait; beyond that callers get HasherBusy straight away
+  instead of piling up, so a login flood cannot take every worker thread.
+
+  Before any hashing, each POST takes a token from an in-memory bucket for the client
+  IP and one for the submitted email; an empty bucket answers 429 with Retry-After.
+  Buckets are per process (per gunicorn worker).
+
+  Config:
+    AUTH_HASH_METHOD     werkzeug KDF spec for new hashes, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+    AUTH_HASH_EXECUTOR   "thread" (default), "process" or "inline" (hash in the request thread)
+    AUTH_HASH_WORKERS    concurrent KDF computations (default 4)
+    AUTH_HASH_QUEUE      hashes allowed to wait for a worker (default 4); keep workers + queue
+                         below the server's request threads so other routes always get one
+    AUTH_IP_RATE         attempts per minute per IP (default 20), AUTH_IP_BURST (default 10)
+    AUTH_EMAIL_RATE      attempts per minute per email (default 5), AUTH_EMAIL_BURST (default 5)
+"""
+
+
+class HasherBusy(Exception):
+  pass
+
+
+class TokenBucket:
+  # `rate` tokens per second up to `burst`, one bucket per key, least recently used keys dropped
+  def __init__(self, rate, burst, max_keys=100000):
+    self.rate = rate
+    self.burst = burst
+    self.max_keys = max_keys
+    self._buckets = OrderedDict()
+    self._lock = threading.Lock()
+
+  def take(self, key):
+    # Returns 0 when a token was taken, otherwise the seconds until one is available
+    now = time.monotonic()
+    with self._lock:
+      tokens, updated = self._buckets.pop(key, (self.burst, now))
+      tokens = min(self.burst, tokens + (now - updated) * self.rate)
+      if tokens >= 1:
+        tokens -= 1
+        wait = 0
+      else:
+        wait = (1 - tokens) / self.rate
+      self._buckets[key] = (tokens, now)
+      if len(self._buckets) > self.max_keys:
+        self._buckets.popitem(last=False)
+    return wait
+
+  def clear(self):
+    with self._lock:
+      self._buckets.clear()
+
+
+class PasswordHasher:
+  def __init__(self, app=None):
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault("AUTH_HASH_METHOD", "scrypt:32768:8:1")
+    app.config.setdefault("AUTH_HASH_EXECUTOR", "thread")
+    app.config.setdefault("AUTH_HASH_WORKERS", 4)
+    app.config.setdefault("AUTH_HASH_QUEUE", 4)
+    app.config.setdefault("AUTH_IP_RATE", 20)
+    app.config.setdefault("AUTH_IP_BURST", 10)
+    app.config.setdefault("AUTH_EMAIL_RATE", 5)
+    app.config.setdefault("AUTH_EMAIL_BURST", 5)
+
+    workers = app.config["AUTH_HASH_WORKERS"]
+    executor = None
+    if app.config["AUTH_HASH_EXECUTOR"] == "thread":
+      executor = ThreadPoolExecutor(workers, thread_name_prefix="password-hash")
+    elif app.config["AUTH_HASH_EXECUTOR"] == "process":
+      executor = ProcessPoolExecutor(workers)
+
+    app.extensions["auth"] = {
+      "executor": executor,
+      # workers + queue slots, taken before submitting and released when the hash is done
+      "slots": threading.BoundedSemaphore(workers + app.config["AUTH_HASH_QUEUE"]),
+      "ip": TokenBucket(app.config["AUTH_IP_RATE"] / 60, app.config["AUTH_IP_BURST"]),
+      "email": TokenBucket(app.config["AUTH_EMAIL_RATE"] / 60, app.config["AUTH_EMAIL_BURST"]),
+    }
+
+  @property
+  def state(self):
+    return current_app.extensions["auth"]
+
+  def submit(self, fn, *args):
+    # Future of fn(*args) on the pool, HasherBusy when the pool and its queue are full
+    state = self.state
+    if state["executor"] is None:
+      # inline: hash in the calling thread, still handed back as a future
+      future = Future()
+      try:
+        future.set_result(fn(*args))
+      except Exception as error:
+        future.set_exception(error)
+      return future
+
+    if not state["slots"].acquire(blocking=False):
+      raise HasherBusy()
+    future = state["executor"].submit(fn, *args)
+    future.add_done_callback(lambda _: state["slots"].release())
+    return future
+
+  def hash(self, password):
+    return self.submit(generate_password_hash, password, current_app.config["AUTH_HASH_METHOD"]).result()
+
+  def verify(self, password_hash, password):
+    return self.submit(check_password_hash, password_hash, password).result()
+
+  def needs_rehash(self, password_hash):
+    # Hashes made with older KDF parameters are upgraded at the next successful login
+    return not password_hash.startswith(current_app.config["AUTH_HASH_METHOD"] + "$")
+
+  def throttled(self, template):
+    # Rate limit POSTs per client IP and per submitted email, answering 429 with `template`
+    def decorator(view):
+      @wraps(view)
+      def decorated_function(*args, **kwargs):
+        if request.method == "POST":
+          state = self.state
+          wait = state["ip"].take(request.remote_addr)
+          email = (request.form.get("email") or "").strip().lower()
+          if not wait and email:
+            wait = state["email"].take(email)
+          if wait:
+            return self.too_many_attempts(template, wait)
+        try:
+          return view(*args, **kwargs)
+        except HasherBusy:
+          return self.too_many_attempts(template, 1)
+      return decorated_function
+    return decorator
+
+  def too_many_attempts(self, template, wait):
+    wait = math.ceil(wait)
+    flash(f"Too many attempts, try again in {wait} second{'s' if wait != 1 else ''}")
+    return render_template(template), 429, {"Retry-After": str(wait)}
+
+
+password_hasher = PasswordHasher()
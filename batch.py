@@ -0,0 +1,206 @@
+from datetime import date
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, money, Category, Expense
+import aggregates
+import categories
+import currencies
+
+
+"""
+  Batched expense changes for /api/expenses/batch:
+    {"create": [{"expense", "merchant", "category", "amount", "currency", "created_at"}, ...],
+     "update": [{"id", ...any of the create fields}, ...],
+     "delete": [id, ...]}
+  The whole batch is validated first, against one category map for the user (the cached
+  category list) and one query for the expenses it touches. If any operation is invalid
+  nothing is written and every error is reported; otherwise deletes, updates and creates
+  are sent as one bulk statement each, with the spending aggregates, in one transaction.
+"""
+
+MAX_OPERATIONS = 1000
+FIELDS = ("expense", "merchant", "category", "amount", "currency", "created_at")
+
+
+class BatchError(ValueError):
+  def __init__(self, message, errors=()):
+    super().__init__(message)
+    self.errors = list(errors)
+
+
+def _text(fields, name):
+  # A string field, stripped; JSON numbers, lists and objects are errors, not text
+  value = fields.get(name)
+  if value is None:
+    return ""
+  if not isinstance(value, str):
+    raise ValueError(f"{name} must be a string")
+  return value.strip()
+
+
+class _Batch:
+  def __init__(self, user_id):
+    self.user_id = user_id
+    self.base_currency = currencies.base_currency(user_id)
+    self.category_ids = {entry.name: entry.id for entry in categories.user_categories(user_id)}
+    self.errors = []
+
+  def error(self, operation, index, message):
+    self.errors.append({"op": operation, "index": index, "error": message})
+
+  def category(self, fields):
+    # names are matched exactly, like the expense form; unknown names are not created
+    name = _text(fields, "category")
+    if not name:
+      raise ValueError("Category is required")
+    if name not in self.category_ids:
+      self.category_ids[name] = categories.find(self.user_id, name)
+    if self.category_ids[name] is None:
+      raise ValueError(f"Unknown category: {name}")
+    return self.category_ids[name]
+
+  def row(self, fields, current=None):
+    # Column values for a create (current is None) or an update of the `current` row
+    current = current or {}
+    row = {}
+    for name in ("expense", "merchant"):
+      if name in fields or not current:
+        value = _text(fields, name)
+        if not value:
+          raise ValueError(f"{name.capitalize()} is required")
+        row[name] = value[:125]
+    if "category" in fields or not current:
+      row["category_id"] = self.category(fields)
+    if "amount" in fields or not current:
+      amount = fields.get("amount")
+      if amount is not None and (isinstance(amount, bool) or not isinstance(amount, (str, int, float))):
+        raise ValueError("amount must be a number or a string")
+      row["amount"] = money(amount)
+      if row["amount"] <= 0:
+        raise ValueError("Amount must be greater than 0")
+    if "currency" in fields or not current:
+      row["currency"] = currencies.code(_text(fields, "currency"))[:25]
+      if not row["currency"]:
+        raise ValueError("Currency is required")
+    if fields.get("created_at") or not current:
+      try:
+        row["created_at"] = date.fromisoformat(fields["created_at"]) if fields.get("created_at") else date.today()
+      except (TypeError, ValueError):
+        raise ValueError("created_at must be YYYY-MM-DD")
+    if "amount" in row or "currency" in row:
+      row["normalized_amount"] = currencies.normalize(
+        row.get("amount", current.get("amount")), row.get("currency", current.get("currency")), self.base_currency
+      )
+    return row
+
+
+def _operations(payload, name):
+  operations = payload.get(name) or []
+  if not isinstance(operations, list):
+    raise BatchError(f"{name} must be a list")
+  return operations
+
+
+def apply(user_id, payload):
+  # Returns {"created": [new ids], "updated": n, "deleted": n}; raises BatchError, nothing written
+  creates = _operations(payload, "create")
+  updates = _operations(payload, "update")
+  deletes = _operations(payload, "delete")
+  if len(creates) + len(updates) + len(deletes) > MAX_OPERATIONS:
+    raise BatchError(f"At most {MAX_OPERATIONS} operations per batch")
+
+  batch = _Batch(user_id)
+  targets = [(operation.get("id") if isinstance(operation, dict) else None) for operation in updates] + deletes
+  ids = [target for target in targets if isinstance(target, int) and not isinstance(target, bool)]
+  # the stored values of every expense the batch touches, in one query
+  current = {
+    row.id: row._asdict()
+    for row in db.session.execute(
+      select(
+        Expense.id, Expense.expense, Expense.merchant, Expense.category_id, Expense.created_at,
+        Expense.amount, Expense.currency, Expense.normalized_amount,
+      )
+      .join(Category)
+      .where(Category.user_id==user_id, Expense.id.in_(set(ids)))
+    )
+  }
+
+  seen = set()
+
+  def target(operation, index, expense_id):
+    if not isinstance(expense_id, int) or isinstance(expense_id, bool):
+      batch.error(operation, index, "id must be an integer")
+    elif expense_id not in current:
+      batch.error(operation, index, f"Expense {expense_id} not found")
+    elif expense_id in seen:
+      batch.error(operation, index, f"Expense {expense_id} is changed more than once")
+    else:
+      seen.add(expense_id)
+      return True
+    return False
+
+  delta = aggregates.SpendingDelta()
+  deleted = []
+  for index, expense_id in enumerate(deletes):
+    if target("delete", index, expense_id):
+      old = current[expense_id]
+      delta.remove(user_id, old["category_id"], old["created_at"], old["normalized_amount"])
+      deleted.append(expense_id)
+
+  updated = []
+  for index, fields in enumerate(updates):
+    if not isinstance(fields, dict):
+      batch.error("update", index, "An object is required")
+      continue
+    if not target("update", index, fields.get("id")):
+      continue
+    old = current[fields["id"]]
+    try:
+      row = batch.row({name: fields[name] for name in FIELDS if name in fields}, old)
+    except ValueError as error:
+      batch.error("update", index, str(error))
+      continue
+    new = {**old, **row}
+    delta.remove(user_id, old["category_id"], old["created_at"], old["normalized_amount"])
+    delta.add(user_id, new["category_id"], new["created_at"], new["normalized_amount"])
+    # every row of a bulk UPDATE by primary key carries the same columns
+    updated.append(new)
+
+  created = []
+  for index, fields in enumerate(creates):
+    if not isinstance(fields, dict):
+      batch.error("create", index, "An object is required")
+      continue
+    try:
+      row = batch.row(fields)
+    except ValueError as error:
+      batch.error("create", index, str(error))
+      continue
+    delta.add(user_id, row["category_id"], row["created_at"], row["normalized_amount"])
+    created.append(row)
+
+  if batch.errors:
+    db.session.rollback()
+    raise BatchError(f"{len(batch.errors)} invalid operation(s), nothing was changed", batch.errors)
+
+  try:
+    if deleted:
+      db.session.execute(
+        delete(Expense).where(Expense.id.in_(deleted)).execution_options(synchronize_session=False)
+      )
+    if updated:
+      db.session.execute(update(Expense), updated)
+    ids = []
+    if created:
+      ids = db.session.scalars(
+        insert(Expense).returning(Expense.id, sort_by_parameter_order=True), created
+      ).all()
+    delta.apply()
+    db.session.commit()
+  except IntegrityError:
+    # e.g. a recurring expense moved onto a date its rule already wrote
+    db.session.rollback()
+    raise BatchError("The batch conflicts with existing expenses, nothing was changed")
+  return {"created": ids, "updated": len(updated), "deleted": len(deleted)}
@@ -0,0 +1,4 @@
+"""
+  Benchmarks for the expense tracker.
+  Run them from the project root, e.g: python -m benchmarks.budget_rollup
+"""
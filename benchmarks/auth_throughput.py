@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash
+
+from models import User, db
+from benchmarks.common import make_web_app, percentile
+
+
+"""
+  /login under a flood of wrong-password attempts, served the way a threaded worker
+  serves it: a fixed number of request threads, requests arriving on a schedule
+  (open loop) whether or not earlier ones have finished, and one cheap page request
+  for every 4 attempts. Latency is measured from the scheduled arrival, so time
+  spent waiting for a free request thread counts.
+
+    inline      hashing in the request thread (the old behaviour)
+    pool        bounded hashing pool, attempts beyond workers + queue are shed with 429
+    throttled   the same flood from one IP, stopped by the token bucket before hashing
+
+  python -m benchmarks.auth_throughput [request threads] [attempts] [attempts per second]
+"""
+
+POOL = {"AUTH_HASH_EXECUTOR": "thread", "AUTH_HASH_WORKERS": 4, "AUTH_HASH_QUEUE": 4}
+
+SCENARIOS = {
+  "inline": ({"AUTH_HASH_EXECUTOR": "inline"}, False),
+  "pool": (POOL, False),
+  "throttled": (POOL, True),
+}
+
+# rate limits out of the way unless the scenario is about them
+NO_LIMITS = {
+  "AUTH_IP_RATE": 10 ** 9, "AUTH_IP_BURST": 10 ** 9,
+  "AUTH_EMAIL_RATE": 10 ** 9, "AUTH_EMAIL_BURST": 10 ** 9,
+}
+
+
+def run(config, one_ip, threads, attempts, rate):
+  app = make_web_app(**config, **({} if one_ip else NO_LIMITS))
+  with app.app_context():
+    method = app.config["AUTH_HASH_METHOD"]
+    db.session.add(User(email="bench@example.com", password_hash=generate_password_hash("secret", method)))
+    db.session.commit()
+  client = app.test_client(use_cookies=False)
+
+  def serve(arrival, kind, i, started):
+    if kind == "login":
+      response = client.post(
+        "/login",
+        data={"email": "bench@example.com", "password": "wrong"},
+        environ_base={"REMOTE_ADDR": "10.0.0.1" if one_ip else f"10.0.{i // 250}.{i % 250}"},
+      )
+    else:
+      response = client.get("/login")
+    return kind, response.status_code, time.perf_counter() - started - arrival
+
+  jobs = []
+  for i in range(attempts):
+    jobs.append((i / rate, "login", i))
+    if i % 4 == 0:
+      jobs.append((i / rate, "page", i))
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(threads) as pool:
+    futures = []
+    for arrival, kind, i in jobs:
+      delay = arrival - (time.perf_counter() - start)
+      if delay > 0:
+        time.sleep(delay)
+      futures.append(pool.submit(serve, arrival, kind, i, start))
+    results = [future.result() for future in futures]
+  elapsed = time.perf_counter() - start
+
+  checked = sum(1 for kind, status, _ in results if kind == "login" and status == 302)
+  shed = sum(1 for kind, status, _ in results if kind == "login" and status == 429)
+  logins = sorted(latency for kind, _, latency in results if kind == "login")
+  pages = sorted(latency for kind, _, latency in results if kind == "page")
+
+  path = app.config["BENCH_DB_PATH"]
+  with app.app_context():
+    db.engine.dispose()
+  for suffix in ("", "-wal", "-shm"):
+    if os.path.exists(path + suffix):
+      os.remove(path + suffix)
+  return elapsed, checked, shed, percentile(logins, 0.99), percentile(pages, 0.5), percentile(pages, 0.99)
+
+
+def main():
+  threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+  attempts = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+  rate = float(sys.argv[3]) if len(sys.argv) > 3 else 50
+  print(f"{threads} request threads, {attempts} login attempts at {rate:g}/s, {os.cpu_count()} CPU(s)")
+  print(f"{'scenario':>10} {'seconds':>8} {'hashed':>7} {'shed':>6} {'login p99':>10} {'page p50':>9} {'page p99':>9}")
+  for name, (config, one_ip) in SCENARIOS.items():
+    elapsed, checked, shed, login_p99, page_p50, page_p99 = run(config, one_ip, threads, attempts, rate)
+    print(f"{name:>10} {elapsed:>8.1f} {checked:>7} {shed:>6} {login_p99:>8.0f}ms {page_p50:>7.0f}ms {page_p99:>7.0f}ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,45 @@
+import os
+
+from models import Category, Expense, BudgetEntry, db
+from budgets import budget_rollup
+import aggregates
+from benchmarks.common import make_app, seed_user, timed
+
+
+# Previous GET /api/add_budget implementation: one SUM query per budget
+def per_budget_sum(user_id):
+  budgets = (
+    db.session.query(BudgetEntry, Category)
+    .join(Category, BudgetEntry.category_id==Category.id)
+    .filter(Category.user_id==user_id)
+    .all()
+  )
+  data = []
+  for budget, category in budgets:
+    total_spent = db.session.query(
+      db.func.sum(Expense.normalized_amount)
+    ).filter(Expense.category_id==category.id).scalar() or 0
+    data.append((budget.id, total_spent))
+  return data
+
+
+def main():
+  print(f"{'budgets':>8} {'expenses':>9} {'N+1 (ms)':>10} {'rollup (ms)':>12} {'speedup':>8}")
+  for budgets in (10, 100, 500, 2000):
+    app = make_app()
+    with app.app_context():
+      expenses = budgets * 20
+      user_id = seed_user(categories=max(5, budgets // 24), budgets=budgets, expenses=expenses)
+      # the rollup reads the spending aggregates, which seed_user() does not fill
+      aggregates.rebuild(user_id)
+
+      old = timed(lambda: (per_budget_sum(user_id), db.session.expire_all()))
+      new = timed(lambda: (budget_rollup(user_id), db.session.expire_all()))
+      print(f"{budgets:>8} {expenses:>9} {old:>10.2f} {new:>12.2f} {old / new:>7.1f}x")
+      db.session.remove()
+      db.engine.dispose()
+    os.remove(app.config['BENCH_DB_PATH'])
+
+
+if __name__ == "__main__":
+  main()
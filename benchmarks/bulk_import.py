@@ -0,0 +1,43 @@
+import io
+import os
+import random
+import time
+from datetime import date, timedelta
+
+import importer
+from models import db
+from benchmarks.common import make_app, seed_user
+
+
+def make_statement(rows, seed=42):
+  # A CSV bank statement with `rows` expenses spread over two years
+  rnd = random.Random(seed)
+  start = date(2024, 1, 1)
+  lines = ["Date,Description,Merchant,Category,Amount,Currency"]
+  for i in range(rows):
+    day = start + timedelta(days=rnd.randint(0, 729))
+    category = rnd.choice(["Food", "Transport", "Utilities", "Shopping", "Entertainment", "Travel"])
+    lines.append(f"{day.isoformat()},Purchase {i},Merchant {rnd.randint(1, 500)},{category},{rnd.uniform(5, 500):.2f},zar")
+  return "\n".join(lines) + "\n"
+
+
+def main():
+  print(f"{'rows':>8} {'seconds':>8} {'rows/s':>9}")
+  for rows in (1000, 10000, 100000):
+    app = make_app()
+    with app.app_context():
+      user_id = seed_user(expenses=0, budgets=0)
+      statement = io.StringIO(make_statement(rows))
+
+      start = time.perf_counter()
+      report = importer.import_expenses(user_id, statement)
+      elapsed = time.perf_counter() - start
+      assert report["imported"] == rows, report
+      print(f"{rows:>8} {elapsed:>8.2f} {rows / elapsed:>9.0f}")
+      db.session.remove()
+      db.engine.dispose()
+    os.remove(app.config['BENCH_DB_PATH'])
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,104 @@
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from flask import Flask
+
+from models import User, Income, Category, Expense, BudgetEntry, db
+import database
+
+
+# Standalone app bound to a throwaway database, so benchmarks never touch expenses.db
+def make_app(path=None, **config):
+  if path is None:
+    fd, path = tempfile.mkstemp(prefix="bench-", suffix=".db")
+    os.close(fd)
+
+  app = Flask(__name__)
+  app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///" + path
+  app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+  app.config.update(config)
+  database.init_app(app)
+  with app.app_context():
+    db.create_all()
+  app.config['BENCH_DB_PATH'] = path
+  return app
+
+
+# The full application (routes, extensions) on a throwaway database
+def make_web_app(path=None, **config):
+  from app import create_app
+
+  if path is None:
+    fd, path = tempfile.mkstemp(prefix="bench-", suffix=".db")
+    os.close(fd)
+  config.setdefault('PERF_LOG', False)
+  config.setdefault('SESSION_BACKEND', "cookie")
+  app = create_app({'SQLALCHEMY_DATABASE_URI': "sqlite:///" + path, 'BENCH_DB_PATH': path, **config})
+  with app.app_context():
+    db.create_all()
+  return app
+
+
+def seed_user(email="bench@example.com", categories=5, budgets=10, expenses=100, seed=42):
+  # Insert one user with budgets spread over categories and months (call inside app context)
+  rnd = random.Random(seed)
+  user = User(email=email, password_hash="x")
+  db.session.add(user)
+  db.session.flush()
+
+  income = Income(user_id=user.id, income_value=50000)
+  db.session.add(income)
+
+  cats = [Category(name=f"Category {i}", user_id=user.id) for i in range(categories)]
+  db.session.add_all(cats)
+  db.session.flush()
+
+  periods = [(year, month) for year in (2024, 2025) for month in range(1, 13)]
+  if budgets:
+    db.session.execute(db.insert(BudgetEntry), [
+      {
+        "category_id": cats[i % categories].id,
+        "income_id": income.id,
+        "year": periods[i // categories % len(periods)][0],
+        "month": periods[i // categories % len(periods)][1],
+        "budget_limit": rnd.randint(500, 5000),
+      }
+      for i in range(budgets)
+    ])
+
+  rows = []
+  for i in range(expenses):
+    year, month = rnd.choice(periods)
+    amount = round(rnd.uniform(5, 500), 2)
+    rows.append({
+      "expense": f"Expense {i}",
+      "merchant": f"Merchant {rnd.randint(1, 50)}",
+      "amount": amount,
+      "normalized_amount": amount,
+      "currency": "zar",
+      "created_at": date(year, month, rnd.randint(1, 28)),
+      "category_id": rnd.choice(cats).id,
+    })
+  if rows:
+    db.session.execute(db.insert(Expense), rows)
+  db.session.commit()
+  return user.id
+
+
+def percentile(values, fraction):
+  # values sorted, in seconds; result in milliseconds
+  return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else 0
+
+
+def timed(fn, repeat=5):
+  # Best wall time of `repeat` runs, in milliseconds
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    best = elapsed if best is None else min(best, elapsed)
+  return best
@@ -0,0 +1,396 @@
+import argparse
+import http.client
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.test import EnvironBuilder
+from flask import url_for
+
+from models import User, Category, Expense, db
+import aggregates
+import recurring
+from benchmarks.common import make_web_app, percentile, seed_user
+
+
+"""
+  Every route of the app against a seeded database (users x categories x expenses x budgets),
+  driven two ways:
+    client  the Flask test client, one request at a time (no network, no concurrency)
+    http    a threaded werkzeug server on localhost and `--concurrency` client threads,
+            a new connection per request
+  Per route and driver: requests/s, p50/p95/p99 latency and queries per request (the
+  X-Query-Count header; streamed responses only count the queries made before the body).
+  Requests rotate over the seeded users, each with a signed session cookie, after a few
+  unmeasured warm-up requests per route.
+
+  Results can be stored as a baseline and compared against it. A route regresses when it
+  runs more queries than in the baseline, fails where it did not, or its p95 grows by more
+  than --tolerance (and by at least --min-delta ms). Any regression exits with status 1.
+
+  python -m benchmarks.routes                      # run, compare with benchmarks/baseline.json
+  python -m benchmarks.routes --save-baseline      # run and store the results as the baseline
+  python -m benchmarks.routes --users 20 --expenses 5000 --requests 200 --concurrency 16
+
+  Timings depend on the machine; save the baseline on the machine that compares against it.
+  Passwords use a cheap hash here, the cost of real hashing is measured by auth_throughput.
+"""
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PASSWORD = "bench-password"
+
+CONFIG = {
+  "AUTH_HASH_METHOD": "pbkdf2:sha256:1000",
+  "AUTH_HASH_EXECUTOR": "inline",
+  "AUTH_IP_RATE": 10 ** 9, "AUTH_IP_BURST": 10 ** 9,
+  "AUTH_EMAIL_RATE": 10 ** 9, "AUTH_EMAIL_BURST": 10 ** 9,
+  "PERF_DEBUG_TOKEN": "bench",
+  # one pass of the alert stream, without waiting for new alerts
+  "ALERT_STREAM_SECONDS": 0, "ALERT_POLL_INTERVAL": 0,
+}
+
+IMPORT_CSV = (
+  "Date,Description,Merchant,Category,Amount,Currency\n"
+  "2025-03-01,Groceries,Market,Category 0,120.50,zar\n"
+  "2025-03-02,Fuel,Garage,Category 1,640.00,zar\n"
+  "2025-03-03,Lunch,Cafe,,85.20,zar\n"
+)
+
+
+def seed(users, categories, expenses, budgets):
+  # users bench0..benchN with the same password, aggregates rebuilt, statistics gathered
+  password_hash = generate_password_hash(PASSWORD, CONFIG["AUTH_HASH_METHOD"])
+  user_ids = [
+    seed_user(email=f"bench{i}@example.com", categories=categories, budgets=budgets, expenses=expenses, seed=i)
+    for i in range(users)
+  ]
+  db.session.execute(db.update(User).values(password_hash=password_hash))
+  db.session.commit()
+  aggregates.rebuild()
+  # one recurring expense per user, not due during the run
+  rules = {
+    user_id: recurring.create_rule(user_id, {
+      "category": "Category 0", "amount": "99.00", "currency": "zar", "expense": "Subscription", "start": "2099-01-01",
+    })
+    for user_id in user_ids
+  }
+  db.session.commit()
+  db.session.execute(db.text("ANALYZE"))
+  db.session.commit()
+
+  owned = {user_id: [] for user_id in user_ids}
+  for user_id, expense_id in db.session.execute(
+    db.select(Category.user_id, Expense.id).join(Category).order_by(Expense.id)
+  ):
+    owned[user_id].append(expense_id)
+  return user_ids, owned, {user_id: rule.id for user_id, rule in rules.items()}
+
+
+class Workload:
+  # Builds the request (EnvironBuilder arguments) for the n-th call of each route
+  def __init__(self, app, user_ids, owned, rules):
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config["SESSION_COOKIE_NAME"]
+    self.cookies = {user_id: f"{name}={serializer.dumps({'user_id': user_id})}" for user_id in user_ids}
+    self.user_ids = user_ids
+    self.emails = {user_id: f"bench{i}@example.com" for i, user_id in enumerate(user_ids)}
+    # the first expense of each user is edited, the others are there to be deleted
+    self.edited = {user_id: ids[0] for user_id, ids in owned.items()}
+    self.deletable = {user_id: ids[:0:-1] for user_id, ids in owned.items()}
+    # stopping a rule again is a no-op update, the same rule is stopped every time
+    self.rules = rules
+    self.registered = count()
+    with app.test_request_context():
+      self.script = url_for("static", filename="js/script.js")
+
+  def user(self, n):
+    return self.user_ids[n % len(self.user_ids)]
+
+  def request(self, method, path, user=None, headers=None, **kwargs):
+    headers = dict(headers or {})
+    if user is not None:
+      headers["Cookie"] = self.cookies[user]
+    return {"method": method, "path": path, "headers": headers, **kwargs}
+
+  def expense_form(self, n):
+    return {
+      "income": "50000", "expense": f"Bench {n}", "merchant": "Bench",
+      "category": "Category 0", "amount": "42.50", "currency": "zar",
+    }
+
+  def delete(self, user):
+    ids = self.deletable[user]
+    return ids.pop() if ids else 0
+
+  def cases(self):
+    # (name, fn(n, user) -> request); every endpoint of the app is covered (see uncovered())
+    get = lambda path, login=True: lambda n, user: self.request("GET", path, user if login else None)
+    return [
+      ("GET /", get("/")),
+      ("GET /api/dashboard", get("/api/dashboard")),
+      ("GET /api/chart-data", get("/api/chart-data")),
+      ("GET /expenses", get("/expenses")),
+      ("GET /expenses?stream=1", get("/expenses?stream=1")),
+      ("GET /expenses gzip", lambda n, user: self.request(
+        "GET", "/expenses", user, headers={"Accept-Encoding": "gzip, br"}
+      )),
+      ("GET /api/expenses", get("/api/expenses?limit=50")),
+      ("GET /api/merchants/suggest", get("/api/merchants/suggest?q=merchant+1")),
+      ("GET /api/expenses/search", get("/api/expenses/search?q=merch")),
+      ("GET /api/expenses/export", get("/api/expenses/export?format=csv&start=2025-01-01&end=2025-03-31")),
+      ("GET /add", get("/add")),
+      ("POST /add", lambda n, user: self.request("POST", "/add", user, data=self.expense_form(n))),
+      ("GET /edit-expense", lambda n, user: self.request("GET", f"/edit-expense/{self.edited[user]}", user)),
+      ("POST /edit-expense", lambda n, user: self.request(
+        "POST", f"/edit-expense/{self.edited[user]}", user, data=self.expense_form(n)
+      )),
+      ("POST /delete-expense", lambda n, user: self.request("POST", f"/delete-expense/{self.delete(user)}", user)),
+      ("POST /api/expenses/import", lambda n, user: self.request(
+        "POST", "/api/expenses/import", user,
+        data={"file": (io.BytesIO(IMPORT_CSV.encode()), "statement.csv")},
+      )),
+      ("POST /api/expenses/batch", lambda n, user: self.request("POST", "/api/expenses/batch", user, json={
+        "create": [
+          {"expense": f"Bench {n}.{i}", "merchant": "Bench", "category": "Category 1",
+           "amount": "12.00", "currency": "zar", "created_at": "2025-03-01"}
+          for i in range(5)
+        ],
+        "update": [{"id": self.edited[user], "amount": f"{n % 90 + 10}.00"}],
+      })),
+      ("GET /budgeting", get("/budgeting")),
+      ("GET /api/add_budget", get("/api/add_budget")),
+      ("POST /api/add_budget", lambda n, user: self.request(
+        "POST", "/api/add_budget", user,
+        json={"category": f"Category {n % 3}", "budget_limit": 1500, "month": n % 12 + 1, "year": 2025},
+      )),
+      ("GET /reports", get("/reports")),
+      ("GET /api/reports-data", get("/api/reports-data")),
+      ("GET /api/reports/timeseries", get("/api/reports/timeseries?bucket=week&start=2024-07-01&end=2025-06-30")),
+      ("GET /api/recurring", get("/api/recurring")),
+      ("POST /api/recurring", lambda n, user: self.request("POST", "/api/recurring", user, json={
+        "category": f"Category {n % 3}", "amount": "250.00", "currency": "zar", "expense": f"Bench {n}",
+        "frequency": "weekly", "start": "2099-01-01",
+      })),
+      ("DELETE /api/recurring", lambda n, user: self.request("DELETE", f"/api/recurring/{self.rules[user]}", user)),
+      ("GET /api/alerts", get("/api/alerts?after=0")),
+      ("POST /api/alerts/read", lambda n, user: self.request("POST", "/api/alerts/read", user, json={})),
+      ("GET /api/alerts/stream", get("/api/alerts/stream?after=0")),
+      ("GET /profile", get("/profile")),
+      # without action=save-income the form is validated but nothing is stored
+      ("POST /profile", lambda n, user: self.request("POST", "/profile", user, data={"income": "60000"})),
+      ("GET /toggle_theme", get("/toggle_theme")),
+      ("GET /login", get("/login", login=False)),
+      ("POST /login", lambda n, user: self.request(
+        "POST", "/login", data={"email": self.emails[user], "password": PASSWORD}
+      )),
+      ("GET /register", get("/register", login=False)),
+      ("POST /register", lambda n, user: self.request("POST", "/register", data={
+        "email": f"new{next(self.registered)}@example.com",
+        "password": PASSWORD, "confirm-password": PASSWORD,
+      })),
+      ("GET /logout", get("/logout")),
+      ("GET /debug/perf", lambda n, user: self.request(
+        "GET", "/debug/perf", headers={"Authorization": f"Bearer {CONFIG['PERF_DEBUG_TOKEN']}"}
+      )),
+      ("GET /static", get("/static/css/styles.css", login=False)),
+      ("GET /static fingerprinted", lambda n, user: self.request(
+        "GET", self.script, headers={"Accept-Encoding": "gzip, br"}
+      )),
+    ]
+
+
+def uncovered(app, cases, workload):
+  # Endpoints of the app that no case requests
+  adapter = app.url_map.bind("localhost")
+  covered = set()
+  for _, make in cases:
+    request = make(0, workload.user_ids[0])
+    path = request["path"].split("?")[0]
+    covered.add(adapter.match(path, method=request["method"])[0])
+  return sorted({rule.endpoint for rule in app.url_map.iter_rules()} - covered)
+
+
+def drive_client(app, make, workload, requests):
+  client = app.test_client(use_cookies=False)
+  results = []
+  start = time.perf_counter()
+  for n in range(requests):
+    request = make(n, workload.user(n))
+    began = time.perf_counter()
+    response = client.open(**request)
+    response.get_data()
+    results.append((time.perf_counter() - began, response.status_code, response.headers.get("X-Query-Count")))
+    response.close()
+  return time.perf_counter() - start, results
+
+
+class QuietHandler(WSGIRequestHandler):
+  def log(self, type, message, *args):
+    pass
+
+
+def encode(request):
+  # method, path with query string, headers and body bytes of a request, ready for http.client
+  builder = EnvironBuilder(**request)
+  try:
+    environ = builder.get_environ()
+    body = environ["wsgi.input"].read()
+    headers = dict(builder.headers)
+    if environ.get("CONTENT_TYPE"):
+      headers["Content-Type"] = environ["CONTENT_TYPE"]
+    headers["Content-Length"] = str(len(body))
+    path = builder.path + (f"?{builder.query_string}" if builder.query_string else "")
+    return builder.method, path, headers, body
+  finally:
+    builder.close()
+
+
+def drive_http(port, make, workload, requests, concurrency):
+  def one(n):
+    method, path, headers, body = encode(make(n, workload.user(n)))
+    began = time.perf_counter()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    try:
+      connection.request(method, path, body=body, headers=headers)
+      response = connection.getresponse()
+      response.read()
+      return time.perf_counter() - began, response.status, response.getheader("X-Query-Count")
+    finally:
+      connection.close()
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(concurrency) as pool:
+    results = list(pool.map(one, range(requests)))
+  return time.perf_counter() - start, results
+
+
+def summarize(elapsed, results):
+  latencies = sorted(latency for latency, _, _ in results)
+  queries = [int(value) for _, _, value in results if value is not None]
+  return {
+    "rps": round(len(results) / elapsed, 1),
+    "p50": round(percentile(latencies, 0.50), 2),
+    "p95": round(percentile(latencies, 0.95), 2),
+    "p99": round(percentile(latencies, 0.99), 2),
+    "queries": round(sum(queries) / len(queries), 2) if queries else None,
+    "errors": sum(1 for _, status, _ in results if status >= 500),
+  }
+
+
+def regressions(results, baseline, tolerance, min_delta):
+  found = []
+  for key, now in results.items():
+    before = baseline.get(key)
+    if before is None:
+      continue
+    if now["errors"] and not before["errors"]:
+      found.append(f"{key}: {now['errors']} server error(s)")
+    if now["queries"] is not None and before["queries"] is not None and now["queries"] > before["queries"] + 0.5:
+      found.append(f"{key}: {now['queries']:g} queries per request, was {before['queries']:g}")
+    if now["p95"] > before["p95"] * (1 + tolerance) and now["p95"] - before["p95"] >= min_delta:
+      found.append(f"{key}: p95 {now['p95']:.1f}ms, was {before['p95']:.1f}ms")
+  return found
+
+
+def print_table(results, baseline):
+  print(f"{'route':>34} {'driver':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'errors':>6} {'p95 vs base':>11}")
+  for key, row in results.items():
+    driver, name = key.split(" ", 1)
+    before = baseline.get(key)
+    change = f"{(row['p95'] / before['p95'] - 1) * 100:+.0f}%" if before and before["p95"] else ""
+    queries = "-" if row["queries"] is None else f"{row['queries']:g}"
+    print(
+      f"{name:>34} {driver:>6} {row['rps']:>8.1f} {row['p50']:>6.1f}ms {row['p95']:>6.1f}ms"
+      f" {row['p99']:>6.1f}ms {queries:>8} {row['errors']:>6} {change:>11}"
+    )
+
+
+def main():
+  parser = argparse.ArgumentParser(prog="python -m benchmarks.routes", description="Benchmark every route of the app.")
+  parser.add_argument("--users", type=int, default=10)
+  parser.add_argument("--categories", type=int, default=8)
+  parser.add_argument("--expenses", type=int, default=2000, help="expenses per user")
+  parser.add_argument("--budgets", type=int, default=24, help="budget entries per user")
+  parser.add_argument("--requests", type=int, default=100, help="requests per route and driver")
+  parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests first (fills the caches)")
+  parser.add_argument("--concurrency", type=int, default=8, help="client threads of the http driver")
+  parser.add_argument("--driver", choices=("client", "http", "both"), default="both")
+  parser.add_argument("--route", action="append", help="only routes whose name contains this (repeatable)")
+  parser.add_argument("--baseline", default=BASELINE)
+  parser.add_argument("--save-baseline", action="store_true")
+  parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative p95 growth (0.5 = +50%%)")
+  parser.add_argument("--min-delta", type=float, default=2.0, help="ignore p95 changes smaller than this (ms)")
+  args = parser.parse_args()
+
+  settings = {name: getattr(args, name) for name in ("users", "categories", "expenses", "budgets", "requests", "concurrency")}
+  drivers = ("client", "http") if args.driver == "both" else (args.driver,)
+
+  app = make_web_app(**CONFIG)
+  with app.app_context():
+    started = time.perf_counter()
+    user_ids, owned, rules = seed(args.users, args.categories, args.expenses, args.budgets)
+    print(f"seeded {args.users} users x {args.categories} categories x {args.expenses} expenses"
+          f" x {args.budgets} budgets in {time.perf_counter() - started:.1f}s, {os.cpu_count()} CPU(s)")
+    workload = Workload(app, user_ids, owned, rules)
+  cases = workload.cases()
+  missing = uncovered(app, cases, workload)
+  if missing:
+    print(f"not benchmarked: {', '.join(missing)}")
+  if args.route:
+    cases = [(name, make) for name, make in cases if any(part in name for part in args.route)]
+
+  server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+  threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+
+  results = {}
+  try:
+    for driver in drivers:
+      for name, make in cases:
+        for requests in (args.warmup, args.requests):
+          if driver == "client":
+            elapsed, rows = drive_client(app, make, workload, requests)
+          else:
+            elapsed, rows = drive_http(server.port, make, workload, requests, args.concurrency)
+        results[f"{driver} {name}"] = summarize(elapsed, rows)
+  finally:
+    server.shutdown()
+    path = app.config["BENCH_DB_PATH"]
+    with app.app_context():
+      db.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+      if os.path.exists(path + suffix):
+        os.remove(path + suffix)
+
+  baseline = {}
+  if not args.save_baseline and os.path.exists(args.baseline):
+    with open(args.baseline, encoding="utf-8") as stream:
+      stored = json.load(stream)
+    if stored.get("settings") != settings:
+      print(f"baseline was recorded with {stored.get('settings')}, timings may not be comparable")
+    baseline = stored["results"]
+
+  print_table(results, baseline)
+
+  if args.save_baseline:
+    with open(args.baseline, "w", encoding="utf-8") as stream:
+      json.dump({"settings": settings, "results": results}, stream, indent=2, sort_keys=True)
+      stream.write("\n")
+    print(f"baseline saved to {args.baseline}")
+    return
+
+  found = regressions(results, baseline, args.tolerance, args.min_delta)
+  for line in found:
+    print(f"REGRESSION {line}")
+  if found:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,98 @@
+import os
+import random
+import sys
+from datetime import date
+
+from models import User, Category, Expense, db
+from benchmarks.common import make_app, timed
+import search
+
+
+"""
+  Expense search at scale: FTS5 (ranked, prefix terms) against the LIKE fallback (newest
+  first, unranked) on a table of `rows` expenses, for the heaviest user (a quarter of
+  all rows) and a typical one.
+
+  python -m benchmarks.search [rows] [users]
+"""
+
+WORDS = [
+  "coffee", "groceries", "fuel", "rent", "electricity", "water", "internet", "phone", "lunch",
+  "dinner", "taxi", "train", "flight", "hotel", "books", "gym", "pharmacy", "doctor", "cinema",
+  "music", "shoes", "jacket", "gift", "insurance", "parking", "toll", "bakery", "butcher",
+  "hardware", "garden", "repairs", "school", "stationery", "subscription", "streaming", "games",
+]
+MERCHANTS = [f"{word.capitalize()} {kind}" for word in WORDS for kind in ("Market", "Store", "Co", "Express")]
+
+QUERIES = [
+  ("no match", "zzyzx", {}),
+  ("one word", "stationery", {}),
+  ("common prefix", "co", {}),
+  ("two words", "coffee mark", {}),
+  ("word + dates", "fuel", {"start": date(2025, 6, 1), "end": date(2025, 6, 30)}),
+]
+
+
+def seed(rows, users, seed=42):
+  rnd = random.Random(seed)
+  db.session.add_all(User(email=f"search{i}@example.com", password_hash="x") for i in range(users))
+  db.session.flush()
+  user_ids = [user_id for user_id, in db.session.execute(db.select(User.id))]
+  db.session.add_all(Category(name=f"Category {i % 5}", user_id=user_id) for user_id in user_ids for i in range(5))
+  db.session.flush()
+  category_ids = [category_id for category_id, in db.session.execute(db.select(Category.id))]
+
+  batch = []
+  for i in range(rows):
+    amount = round(rnd.uniform(5, 500), 2)
+    batch.append({
+      "expense": " ".join(rnd.sample(WORDS, 2)),
+      "merchant": rnd.choice(MERCHANTS),
+      "amount": amount,
+      "normalized_amount": amount,
+      "currency": "zar",
+      "created_at": date(rnd.choice((2024, 2025)), rnd.randint(1, 12), rnd.randint(1, 28)),
+      # a skewed split, the first user owns a large share of the rows
+      "category_id": category_ids[0] if i % 4 == 0 else rnd.choice(category_ids),
+    })
+    if len(batch) == 50000:
+      db.session.execute(db.insert(Expense), batch)
+      batch.clear()
+  if batch:
+    db.session.execute(db.insert(Expense), batch)
+  db.session.commit()
+  db.session.execute(db.text("ANALYZE"))
+  return user_ids[0]
+
+
+def main():
+  rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  users = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+  app = make_app()
+  with app.app_context():
+    heavy = seed(rows, users)
+    typical = heavy + 1
+    print(f"{rows} expenses, {users} users")
+    print(f"{'user rows':>9} {'query':>14} {'matches':>8} {'fts (ms)':>9} {'like (ms)':>10}")
+    for user_id in (heavy, typical):
+      owned = db.session.execute(
+        db.select(db.func.count()).select_from(Expense).join(Category).where(Category.user_id==user_id)
+      ).scalar()
+      for name, query, filters in QUERIES:
+        fts_query = search.search_query(user_id, query, limit=50, **filters)
+        like_query = search.search_query(user_id, query, limit=50, indexed=False, **filters)
+        matches = db.session.execute(
+          db.select(db.func.count()).select_from(
+            search.search_query(user_id, query, indexed=False, **filters).order_by(None).limit(None).subquery()
+          )
+        ).scalar()
+        fts_ms = timed(lambda: db.session.execute(fts_query).scalars().all())
+        like_ms = timed(lambda: db.session.execute(like_query).scalars().all())
+        print(f"{owned:>9} {name:>14} {matches:>8} {fts_ms:>9.1f} {like_ms:>10.1f}")
+    db.session.remove()
+    db.engine.dispose()
+  os.remove(app.config['BENCH_DB_PATH'])
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,108 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from flask import Flask, session
+
+import sessions
+
+
+"""
+  Per-request session overhead of each SESSION_BACKEND, on a bare app so nothing
+  else is measured. Each backend answers the same three kinds of request:
+    read    a logged-in request that only reads user_id/theme (most page views)
+    write   a request that changes the session (theme toggle, flash message)
+    new     a first visit that creates a session
+  Times are per request, minus the same request on an app without sessions.
+
+  python -m benchmarks.session_backends [requests]
+"""
+
+BACKENDS = ("cookie", "sqlite", "filesystem")
+
+
+def make_session_app(backend, directory):
+  app = Flask(__name__, instance_path=directory)
+  app.secret_key = "bench"
+  app.config.update(
+    SESSION_BACKEND=backend,
+    SESSION_PERMANENT=False,
+    SESSION_FILE_DIR=os.path.join(directory, "flask_session"),
+    SESSION_SWEEP_INTERVAL=0,
+  )
+  sessions.init_app(app)
+
+  @app.route("/read")
+  def read():
+    return f"{session.get('user_id')} {session.get('theme')}"
+
+  @app.route("/write")
+  def write():
+    session["theme"] = "dark" if session.get("theme") == "light" else "light"
+    return "ok"
+
+  @app.route("/login")
+  def login():
+    session["user_id"] = 1
+    session["theme"] = "light"
+    return "ok"
+
+  return app
+
+
+def per_request(client, path, requests):
+  start = time.perf_counter()
+  for _ in range(requests):
+    client.get(path)
+  return (time.perf_counter() - start) / requests * 1e6
+
+
+def per_new_client(app, path, requests):
+  start = time.perf_counter()
+  for _ in range(requests):
+    app.test_client().get(path)
+  return (time.perf_counter() - start) / requests * 1e6
+
+
+def baseline(requests):
+  # No secret key: Flask hands out a NullSession and never loads or saves anything
+  app = Flask(__name__)
+
+  @app.route("/none")
+  def none():
+    return "ok"
+
+  return per_request(app.test_client(), "/none", requests), per_new_client(app, "/none", requests)
+
+
+def run(backend, requests, base, base_new):
+  directory = tempfile.mkdtemp(prefix="bench-sessions-")
+  try:
+    app = make_session_app(backend, directory)
+    client = app.test_client()
+    client.get("/login")
+
+    read = per_request(client, "/read", requests) - base
+    write = per_request(client, "/write", requests) - base
+    new = per_new_client(app, "/login", requests) - base_new
+
+    cookie = client.get_cookie(app.config["SESSION_COOKIE_NAME"])
+    return read, write, new, len(cookie.value) if cookie else 0
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+  requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+  base, base_new = baseline(requests)
+  print(f"{requests} requests per kind, overhead per request")
+  print(f"{'backend':>11} {'read':>9} {'write':>9} {'new':>9} {'cookie':>7}")
+  for backend in BACKENDS:
+    read, write, new, cookie = run(backend, requests, base, base_new)
+    print(f"{backend:>11} {read:>7.0f}us {write:>7.0f}us {new:>7.0f}us {cookie:>6}B")
+
+
+if __name__ == "__main__":
+  main()
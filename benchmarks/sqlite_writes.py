@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+from sqlalchemy.exc import OperationalError
+
+from models import Expense, db
+import aggregates
+from benchmarks.common import make_app, seed_user
+
+
+"""
+  Concurrent write load against one SQLite file, the way several gunicorn workers hit it.
+  Each process runs the add_expense write (insert + aggregate upsert + commit) in a loop
+  and reports per-transaction latencies; the run is repeated for each SQLite profile.
+
+  python -m benchmarks.sqlite_writes [workers] [writes per worker]
+"""
+
+def worker(path, profile, writes, user_id, category_id, results):
+  app = make_app(path, SQLITE_PROFILE=profile)
+  latencies, errors = [], 0
+  with app.app_context():
+    for i in range(writes):
+      start = time.perf_counter()
+      try:
+        expense = Expense(expense=f"Load {i}", merchant="Bench", amount=10.0, normalized_amount=10.0,
+                          currency="zar", created_at=date.today(), category_id=category_id)
+        db.session.add(expense)
+        delta = aggregates.SpendingDelta()
+        delta.add(user_id, category_id, expense.created_at, expense.normalized_amount)
+        delta.apply()
+        db.session.commit()
+        latencies.append(time.perf_counter() - start)
+      except OperationalError:
+        # "database is locked"
+        db.session.rollback()
+        errors += 1
+  results.put((latencies, errors))
+
+
+def run(profile, workers, writes):
+  app = make_app(SQLITE_PROFILE=profile)
+  path = app.config['BENCH_DB_PATH']
+  with app.app_context():
+    user_id = seed_user(categories=1, budgets=0, expenses=0)
+    category_id = db.session.execute(db.text("SELECT id FROM categories")).scalar()
+    db.engine.dispose()
+
+  results = multiprocessing.Queue()
+  processes = [
+    multiprocessing.Process(target=worker, args=(path, profile, writes, user_id, category_id, results))
+    for _ in range(workers)
+  ]
+  start = time.perf_counter()
+  for process in processes:
+    process.start()
+  collected = [results.get() for _ in processes]
+  for process in processes:
+    process.join()
+  elapsed = time.perf_counter() - start
+
+  latencies = sorted(latency for worker_latencies, _ in collected for latency in worker_latencies)
+  errors = sum(worker_errors for _, worker_errors in collected)
+  for suffix in ("", "-wal", "-shm"):
+    if os.path.exists(path + suffix):
+      os.remove(path + suffix)
+
+  if not latencies:
+    return profile, 0, 0, 0, errors
+  p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+  return profile, len(latencies) / elapsed, statistics.median(latencies) * 1000, p99 * 1000, errors
+
+
+def main():
+  workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+  writes = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+  print(f"{workers} workers x {writes} writes")
+  print(f"{'profile':>12} {'writes/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'locked':>7}")
+  for profile in ("default", "production"):
+    name, throughput, p50, p99, errors = run(profile, workers, writes)
+    print(f"{name:>12} {throughput:>9.0f} {p50:>9.2f} {p99:>9.2f} {errors:>7}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""
+  What a new worker process or CLI invocation pays before it can serve, each sample in a
+  fresh interpreter:
+    import      import app
+    create_app  create_app(), and the database connections it opens (must be none)
+    forked GET  a fork of the built app serving its first request (/login, no database
+                work), what each worker of a preloading server (gunicorn --preload) pays
+    wsgi preload / preloaded GET
+                the same with wsgi.py, which also compiles the templates before the fork
+    first GET   the first request in the process that built the app, without a fork
+    flask cli   flask --app app routes, a command that needs no database
+  `workers` interpreters are also started at once, like a preforking server after a deploy,
+  and the slowest of them is reported. Exits with status 1 if create_app() connects to the
+  database.
+
+  python -m benchmarks.startup [runs] [workers]
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, os, time
+
+
+def forked_get(application):
+  # a preforked worker: a child forked from the built app serves its first request
+  started = time.perf_counter()
+  read, write = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    application.test_client().get("/login")
+    os.write(write, b"x")
+    os._exit(0)
+  os.read(read, 1)
+  os.waitpid(pid, 0)
+  return (time.perf_counter() - started) * 1000
+
+
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, "connect", lambda *args: connections.append(1))
+application = app.create_app({"PERF_LOG": False})
+created = time.perf_counter()
+forked = forked_get(application)
+loading = time.perf_counter()
+import wsgi
+loaded = time.perf_counter()
+booted = len(connections)
+preloaded = forked_get(wsgi.app)
+serving = time.perf_counter()
+application.test_client().get("/login")
+served = time.perf_counter()
+print(json.dumps({
+  "import": (imported - started) * 1000,
+  "create_app": (created - imported) * 1000,
+  "forked GET": forked,
+  "wsgi preload": (loaded - loading) * 1000,
+  "preloaded GET": preloaded,
+  "first GET": (served - serving) * 1000,
+  "connections": booted,
+}))"""
+
+
+def run(command, env):
+  started = time.perf_counter()
+  output = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+  return output, (time.perf_counter() - started) * 1000
+
+
+def boot(env):
+  output, total = run([sys.executable, "-c", CHILD], env)
+  result = json.loads(output.strip().splitlines()[-1])
+  result["process"] = total
+  return result
+
+
+def main():
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+  # a database file that does not exist yet: starting must not need (or create) a schema
+  directory = tempfile.mkdtemp(prefix="bench-startup-")
+  path = os.path.join(directory, "startup.db")
+  env = {**os.environ, "DATABASE_URL": "sqlite:///" + path, "PYTHONPATH": ROOT}
+
+  samples = [boot(env) for _ in range(runs)]
+  cli = [run([sys.executable, "-m", "flask", "--app", "app", "routes"], env)[1] for _ in range(runs)]
+  with ThreadPoolExecutor(workers) as pool:
+    parallel = list(pool.map(lambda _: boot(env), range(workers)))
+
+  print(f"{runs} runs, median ms")
+  for name in ("import", "create_app", "forked GET", "wsgi preload", "preloaded GET", "first GET", "process"):
+    print(f"{name:>13} {statistics.median(sample[name] for sample in samples):>8.1f}")
+  print(f"{'flask cli':>13} {statistics.median(cli):>8.1f}")
+  print(f"{workers} workers at once, slowest process: {max(sample['process'] for sample in parallel):.1f} ms")
+
+  connected = max(sample["connections"] for sample in samples + parallel)
+  created = os.path.exists(path)
+  print(f"database connections in create_app: {connected}, database file created: {created}")
+  shutil.rmtree(directory)
+  if connected:
+    raise SystemExit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+from models import Expense, db
+import aggregates
+import reports
+from benchmarks.common import make_app, seed_user, timed
+
+
+"""
+  /api/reports/timeseries queries against one user with a large history
+  (default 1M expenses over 3 years, 8 categories), next to loading the same
+  range into Python and bucketing it there.
+
+  python -m benchmarks.timeseries [expenses]
+"""
+
+FIRST_DAY = date(2023, 1, 1)
+DAYS = 3 * 365
+
+
+def seed_expenses(user_id, category_ids, count, chunk_size=50000, seed=42):
+  rnd = random.Random(seed)
+  for offset in range(0, count, chunk_size):
+    rows = []
+    for i in range(offset, min(offset + chunk_size, count)):
+      amount = round(rnd.uniform(5, 500), 2)
+      rows.append({
+        "expense": f"Expense {i}",
+        "merchant": f"Merchant {rnd.randint(1, 500)}",
+        "amount": amount,
+        "normalized_amount": amount,
+        "currency": "zar",
+        "created_at": FIRST_DAY + timedelta(days=rnd.randrange(DAYS)),
+        "category_id": rnd.choice(category_ids),
+      })
+    db.session.execute(db.insert(Expense), rows)
+    db.session.commit()
+
+
+def python_buckets(user_id, start, end):
+  # The naive way: fetch every expense of the range and group by ISO week in Python
+  totals = {}
+  for created_at, category_id, amount in db.session.execute(
+    db.select(Expense.created_at, Expense.category_id, Expense.normalized_amount)
+    .where(Expense.created_at >= start, Expense.created_at < end)
+  ):
+    key = (reports.floor(created_at, "week"), category_id)
+    totals[key] = totals.get(key, 0) + amount
+  return totals
+
+
+def all_pages(user_id, bucket, start, end, limit):
+  cursor = None
+  while True:
+    page = reports.timeseries(user_id, bucket, start, end, cursor=date.fromisoformat(cursor) if cursor else None, limit=limit)
+    cursor = page["next_cursor"]
+    if cursor is None:
+      return
+
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+  app = make_app()
+  with app.app_context():
+    user_id = seed_user(categories=8, budgets=24, expenses=0)
+    category_ids = list(db.session.execute(db.text("SELECT id FROM categories")).scalars())
+    seed_expenses(user_id, category_ids, count)
+    aggregates.rebuild(user_id)
+    db.session.execute(db.text("ANALYZE"))
+
+    cases = [
+      ("month, 24 periods", lambda: reports.timeseries(user_id, "month", date(2024, 1, 1), date(2025, 12, 31), limit=24)),
+      ("week, 26 periods", lambda: reports.timeseries(user_id, "week", date(2025, 1, 1), date(2025, 12, 31), limit=26)),
+      ("day, 31 periods", lambda: reports.timeseries(user_id, "day", date(2025, 3, 1), date(2025, 3, 31))),
+      ("week, 3 years (all pages)", lambda: all_pages(user_id, "week", FIRST_DAY, date(2025, 12, 31), 52)),
+      ("python, week, 26 periods", lambda: python_buckets(user_id, date(2024, 12, 30), date(2025, 6, 30))),
+    ]
+    print(f"{count} expenses")
+    print(f"{'query':>28} {'ms':>9}")
+    for name, fn in cases:
+      print(f"{name:>28} {timed(fn, repeat=3):>9.1f}")
+    db.engine.dispose()
+  os.remove(app.config['BENCH_DB_PATH'])
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,53 @@
+from sqlalchemy import select
+
+from models import db, BudgetEntry, Category, SpendingAggregate
+
+
+"""
+  Budget rollup query layer.
+  Computes total_spent and remaining for all of a user's budgets in one query, reading
+  each budget's month from the spending aggregates instead of summing its expenses.
+"""
+
+def budget_rollup_query(user_id, budget_id=None):
+  # Only the spending of the budget's own month/year counts against its limit, read from
+  # the maintained spending aggregates (one primary key lookup per budget). No ORDER BY:
+  # the categories' index hands the budgets out per category, budget_rollup() sorts them.
+  total_spent = db.func.coalesce(SpendingAggregate.total, 0)
+  query = (
+    select(
+      BudgetEntry.id,
+      Category.name,
+      BudgetEntry.month,
+      BudgetEntry.year,
+      BudgetEntry.budget_limit,
+      total_spent.label("total_spent"),
+    )
+    .join(Category, BudgetEntry.category_id==Category.id)
+    .outerjoin(SpendingAggregate, db.and_(
+      SpendingAggregate.user_id==Category.user_id,
+      SpendingAggregate.category_id==BudgetEntry.category_id,
+      SpendingAggregate.year==BudgetEntry.year,
+      SpendingAggregate.month==BudgetEntry.month,
+    ))
+    .where(Category.user_id==user_id)
+  )
+  if budget_id is not None:
+    query = query.where(BudgetEntry.id==budget_id)
+  return query
+
+
+def budget_rollup(user_id, budget_id=None):
+  data = []
+  # oldest budget first; sorting the user's budgets here keeps the query free of a temp B-tree
+  for row in sorted(db.session.execute(budget_rollup_query(user_id, budget_id)), key=lambda row: row.id):
+    data.append({
+      "id": row.id,
+      "name": row.name,
+      "month": row.month,
+      "year": row.year,
+      "budget_limit": row.budget_limit,
+      "total_spent": row.total_spent,
+      "remaining": row.budget_limit - row.total_spent
+    })
+  return data
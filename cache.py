@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from cachelib import FileSystemCache, NullCache, SimpleCache
+from flask import current_app, make_response, request, session
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CacheVersion
+
+
+"""
+  Per-user response cache for the JSON endpoints.
+  Entries are keyed by endpoint + user + that user's cache version. Write routes call
+  response_cache.invalidate(user_id), which bumps the version so every cached response
+  of that user is skipped from then on (old entries simply age out); commands that change
+  every user's data call response_cache.invalidate_all().
+
+  The versions are rows of the cache_versions table, not backend entries, so a bump by
+  one worker or by a CLI command is seen by every process on its next request. A cached
+  response costs one primary key read, an invalidation one small write. versions() and
+  bump_version() also version the exchange rates cached by currencies.py.
+
+  Backends (RESPONSE_CACHE_TYPE):
+    "lru"         in-process LRU with TTL (default, one copy per worker)
+    "filesystem"  cachelib FileSystemCache, shared by all workers on the host
+    "simple"      cachelib SimpleCache
+    "null"        no caching
+"""
+
+class LRUCache:
+  # Same get/set/delete/clear interface as the cachelib backends
+  def __init__(self, threshold=1024, default_timeout=300):
+    self.threshold = threshold
+    self.default_timeout = default_timeout
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      expires, value = entry
+      if expires and expires < time.monotonic():
+        del self._entries[key]
+        return None
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, timeout=None):
+    timeout = self.default_timeout if timeout is None else timeout
+    expires = time.monotonic() + timeout if timeout else 0
+    with self._lock:
+      self._entries[key] = (expires, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.threshold:
+        self._entries.popitem(last=False)
+    return True
+
+  def delete(self, key):
+    with self._lock:
+      return self._entries.pop(key, None) is not None
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+    return True
+
+
+def versions(*scopes):
+  # scope -> its current version in the cache_versions table, 0 for a scope never bumped
+  found = dict(db.session.execute(
+    db.select(CacheVersion.scope, CacheVersion.version).where(CacheVersion.scope.in_(scopes))
+  ).all())
+  return {scope: found.get(scope, 0) for scope in scopes}
+
+
+def bump_version(scope):
+  # A new version number makes everything cached under the old one unreachable, in
+  # every process; commits
+  version = time.time_ns()
+  updated = db.session.execute(
+    db.update(CacheVersion).where(CacheVersion.scope==scope).values(version=version)
+  ).rowcount
+  if not updated:
+    db.session.add(CacheVersion(scope=scope, version=version))
+  try:
+    db.session.commit()
+  except IntegrityError:
+    # another process created the row first, its version is just as new
+    db.session.rollback()
+  return version
+
+
+def make_backend(config):
+  cache_type = config["RESPONSE_CACHE_TYPE"]
+  timeout = config["RESPONSE_CACHE_TIMEOUT"]
+  threshold = config["RESPONSE_CACHE_THRESHOLD"]
+
+  if cache_type == "lru":
+    return LRUCache(threshold=threshold, default_timeout=timeout)
+  if cache_type == "filesystem":
+    return FileSystemCache(config["RESPONSE_CACHE_DIR"], threshold=threshold, default_timeout=timeout)
+  if cache_type == "simple":
+    return SimpleCache(threshold=threshold, default_timeout=timeout)
+  if cache_type == "null":
+    return NullCache()
+  raise ValueError(f"Unknown RESPONSE_CACHE_TYPE: {cache_type}")
+
+
+class ResponseCache:
+  def __init__(self, app=None):
+    if app is not None:
+      self.init_app(app)
+
+  def init_app(self, app):
+    app.config.setdefault("RESPONSE_CACHE_TYPE", "lru")
+    app.config.setdefault("RESPONSE_CACHE_TIMEOUT", 300)
+    app.config.setdefault("RESPONSE_CACHE_THRESHOLD", 1024)
+    app.config.setdefault("RESPONSE_CACHE_DIR", os.path.join(os.getcwd(), "flask_cache"))
+    app.extensions["response_cache"] = make_backend(app.config)
+
+  @property
+  def backend(self):
+    return current_app.extensions["response_cache"]
+
+  def _versions(self, user_id):
+    scopes = versions("all", f"user:{user_id}")
+    return f"{scopes['all']}.{scopes[f'user:{user_id}']}"
+
+  def invalidate(self, user_id):
+    return bump_version(f"user:{user_id}")
+
+  def invalidate_all(self):
+    return bump_version("all")
+
+  def key(self, endpoint, user_id):
+    query = request.query_string.decode()
+    return f"response:{endpoint}:{user_id}:{self._versions(user_id)}:{query}"
+
+  def cached(self, view):
+    # Cache a JSON view per user, and answer If-None-Match with 304 Not Modified
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+      key = self.key(request.endpoint, session.get("user_id"))
+      entry = self.backend.get(key)
+
+      if entry is None:
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200:
+          return response
+        body = response.get_data()
+        entry = (body, hashlib.sha1(body).hexdigest())
+        self.backend.set(key, entry)
+
+      body, etag = entry
+      response = current_app.response_class(body, mimetype="application/json")
+      response.set_etag(etag)
+      # the browser may keep it, but must revalidate with the ETag every time
+      response.headers["Cache-Control"] = "private, no-cache"
+      return response.make_conditional(request)
+    return decorated_function
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Category
+from cache import LRUCache
+
+
+"""
+  Per-user category lookups shared by add_expense, edit_expense, create_budget and
+  the importer. Each user's (id, name) list is cached in-process for a short time;
+  a name that is not in the cached list is looked up in the database before it is
+  created, and the unique (user_id, name) index turns a create racing another worker's
+  into a lookup of theirs, so a category is never duplicated.
+"""
+
+DEFAULT_CATEGORIES = ["Food", "Transport", "Entertainment", "Utilities", "Shopping"]
+
+CategoryEntry = namedtuple("CategoryEntry", ["id", "name"])
+
+_categories = LRUCache(threshold=4096, default_timeout=60)
+
+
+def invalidate(user_id):
+  _categories.delete(user_id)
+
+
+def user_categories(user_id):
+  entries = _categories.get(user_id)
+  if entries is None:
+    entries = [
+      CategoryEntry(*row)
+      for row in db.session.execute(
+        select(Category.id, Category.name).where(Category.user_id==user_id).order_by(Category.id)
+      )
+    ]
+    _categories.set(user_id, entries)
+  return entries
+
+
+def find(user_id, name):
+  # Category id for a name, None if the user has no such category
+  for entry in user_categories(user_id):
+    if entry.name == name:
+      return entry.id
+  category_id = db.session.execute(
+    select(Category.id).where(Category.user_id==user_id, Category.name==name)
+  ).scalar()
+  if category_id is not None:
+    invalidate(user_id)
+  return category_id
+
+
+def _insert_ignoring_duplicates(dialect_name):
+  # INSERT ... ON CONFLICT DO NOTHING on the (user_id, name) index (SQLite and PostgreSQL)
+  if dialect_name == "sqlite":
+    from sqlalchemy.dialects.sqlite import insert as dialect_insert
+  elif dialect_name == "postgresql":
+    from sqlalchemy.dialects.postgresql import insert as dialect_insert
+  else:
+    return None
+  return dialect_insert(Category.__table__).on_conflict_do_nothing(index_elements=["user_id", "name"])
+
+
+def _add(user_id, names):
+  # Inserts the names into the current transaction, skipping any the user already has
+  # (the unique index refuses them, even when another worker created them a moment ago)
+  rows = [{"user_id": user_id, "name": name} for name in names]
+  stmt = _insert_ignoring_duplicates(db.session.get_bind().dialect.name)
+  if stmt is not None:
+    db.session.execute(stmt, rows)
+  else:
+    for row in rows:
+      try:
+        with db.session.begin_nested():
+          db.session.execute(insert(Category), row)
+      except IntegrityError:
+        pass
+  invalidate(user_id)
+
+
+def create(user_id, name):
+  # Adds the category to the current transaction and returns its id, the caller commits.
+  # When another worker created the same name first, that category's id is returned.
+  _add(user_id, [name])
+  return db.session.execute(
+    select(Category.id).where(Category.user_id==user_id, Category.name==name)
+  ).scalar()
+
+
+def get_or_create(user_id, name):
+  category_id = find(user_id, name)
+  if category_id is None:
+    category_id = create(user_id, name)
+  return category_id
+
+
+def seed_defaults(user_id):
+  # Default categories for a new user (at registration) in one statement, the caller commits
+  _add(user_id, DEFAULT_CATEGORIES)
+
+
+def ensure_defaults(user_id):
+  # Users registered before seeding moved to sign-up get the defaults on first use, but
+  # only while they have no categories at all: a user's own set is never added to.
+  # Afterwards it is answered from the cached list. Two workers seeding the same user
+  # at once end up with one set, the second seeding skips the categories of the first.
+  if user_categories(user_id):
+    return False
+  # an empty cached list may predate another worker's seeding
+  invalidate(user_id)
+  if user_categories(user_id):
+    return False
+  seed_defaults(user_id)
+  db.session.commit()
+  return True
@@ -0,0 +1,71 @@
+import os
+
+
+"""
+  Application configuration, read from the environment.
+  create_app() loads Config and then applies any overrides passed to it.
+
+    DATABASE_URL          primary database (default: sqlite expenses.db next to app.py)
+    DATABASE_REPLICA_URL  optional read replica for the read-only endpoints
+    SECRET_KEY            session signing key
+    SESSION_BACKEND       cookie | sqlite | a Flask-Session type such as filesystem (see sessions.py)
+    RESPONSE_CACHE_TYPE   lru | filesystem | simple | null
+    SQLITE_PROFILE        production | default
+    PERF_DEBUG_TOKEN      enables /debug/perf for requests carrying this bearer token
+    RECURRING_WORKER      1 to run the recurring expense scheduler inside the app processes
+    ASSETS_COMPRESS       0 to leave HTML and JSON responses uncompressed (see assets.py)
+"""
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+
+def database_url(value):
+  # Some hosts still hand out postgres://, which SQLAlchemy no longer accepts
+  if value and value.startswith("postgres://"):
+    value = "postgresql://" + value[len("postgres://"):]
+  return value
+
+
+class Config:
+  # https://www.reddit.com/r/flask/comments/gvekun/what_are_the_exact_uses_of_flasks_secret_key/
+  # Reddit on understanding secret_keys
+  SECRET_KEY = os.environ.get("SECRET_KEY", "your_secret_key")
+  SESSION_PERMANENT = False
+  SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "cookie")
+
+  # Configure SQLAlchemy database
+  SQLALCHEMY_DATABASE_URI = database_url(os.environ.get("DATABASE_URL")) or "sqlite:///" + os.path.join(basedir, "expenses.db")
+  SQLALCHEMY_BINDS = (
+    {"replica": database_url(os.environ["DATABASE_REPLICA_URL"])}
+    if os.environ.get("DATABASE_REPLICA_URL") else {}
+  )
+  SQLALCHEMY_TRACK_MODIFICATIONS = False
+  SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "production")
+  REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+  # Per-user cache for the chart JSON endpoints (see cache.py for the backends)
+  RESPONSE_CACHE_TYPE = os.environ.get("RESPONSE_CACHE_TYPE", "lru")
+
+  # Request instrumentation (see perf.py)
+  PERF_LOG = os.environ.get("PERF_LOG", "1") == "1"
+  PERF_SLOW_QUERY_MS = int(os.environ.get("PERF_SLOW_QUERY_MS", 100))
+  PERF_DEBUG_TOKEN = os.environ.get("PERF_DEBUG_TOKEN")
+
+  # Password hashing and login throttling (see auth.py)
+  AUTH_HASH_METHOD = os.environ.get("AUTH_HASH_METHOD", "scrypt:32768:8:1")
+  AUTH_HASH_WORKERS = int(os.environ.get("AUTH_HASH_WORKERS", 4))
+
+  # Background scheduler for recurring rules, off by default in favour of cron (see recurring.py)
+  RECURRING_WORKER = os.environ.get("RECURRING_WORKER", "0") == "1"
+  RECURRING_INTERVAL = int(os.environ.get("RECURRING_INTERVAL", 3600))
+
+  # gzip/brotli for HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes (see assets.py)
+  ASSETS_COMPRESS = os.environ.get("ASSETS_COMPRESS", "1") == "1"
+  COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1400))
+
+  # Budget alert stream: seconds between polls and before the client reconnects (see alerts.py)
+  ALERT_POLL_INTERVAL = float(os.environ.get("ALERT_POLL_INTERVAL", 5))
+  ALERT_STREAM_SECONDS = int(os.environ.get("ALERT_STREAM_SECONDS", 15))
+
+  # Exchange rates loaded by flask migrate / flask load-rates (see currencies.py)
+  EXCHANGE_RATES_FILE = os.environ.get("EXCHANGE_RATES_FILE", os.path.join(basedir, "exchange_rates.json"))
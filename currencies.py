@@ -0,0 +1,150 @@
+import json
+import os
+from datetime import date
+from decimal import Decimal
+
+from flask import current_app, g
+
+from models import db, money, User, Category, Expense, ExchangeRate
+from cache import LRUCache, bump_version, versions
+import aggregates
+
+
+"""
+  Exchange rates and amounts normalized to the user's base currency.
+  Rates are loaded from a local JSON file into the exchange_rates table and cached
+  in-process under the "rates" version of cache_versions (cache.py), checked once per app
+  context (request, CLI command, scheduler run), so flask load-rates reaches every worker
+  before its next write. The base currency is read from the users row on every write.
+  Every expense stores normalized_amount (its amount in the owner's base currency) when it
+  is written, so totals and aggregates are plain SQL sums; a stale rate or base currency
+  would stay in them.
+
+  Rates file (EXCHANGE_RATES_FILE):
+    {"base": "usd", "date": "2025-10-01", "rates": {"zar": 17.3, "eur": 0.85, ...}}
+  After loading new rates, renormalize() recomputes the stored amounts and aggregates
+  (flask load-rates does both).
+"""
+
+DEFAULT_BASE_CURRENCY = "zar"
+RATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exchange_rates.json")
+
+# codes used by older forms -> ISO 4217
+ALIASES = {"euro": "eur"}
+
+# rates version -> table, only the newest is kept
+_rates = LRUCache(threshold=1, default_timeout=0)
+
+
+def code(currency):
+  currency = (currency or "").strip().lower()
+  return ALIASES.get(currency, currency)
+
+
+def rates():
+  # currency -> units per one unit of the reference currency
+  if "rates" not in g:
+    version = versions("rates")["rates"]
+    table = _rates.get(version)
+    if table is None:
+      table = dict(db.session.execute(db.select(ExchangeRate.currency, ExchangeRate.rate)).all())
+      _rates.set(version, table)
+    g.rates = table
+  return g.rates
+
+
+def factor(from_currency, to_currency):
+  from_currency, to_currency = code(from_currency), code(to_currency)
+  if from_currency == to_currency:
+    return 1.0
+  table = rates()
+  for currency in (from_currency, to_currency):
+    if currency not in table:
+      raise ValueError(f"No exchange rate for {currency.upper()}")
+  return table[to_currency] / table[from_currency]
+
+
+def normalize(amount, currency, base_currency):
+  # Decimal amount in the base currency, rounded to cents
+  return money(money(amount) * Decimal(factor(currency, base_currency)))
+
+
+def base_currency(user_id):
+  # Not cached: another process may have just changed it (flask set-base-currency)
+  currency = db.session.execute(db.select(User.base_currency).where(User.id==user_id)).scalar()
+  return currency or DEFAULT_BASE_CURRENCY
+
+
+def set_base_currency(user_id, currency):
+  # Changes the user's base currency and re-expresses all their expenses in it
+  currency = code(currency)
+  if currency != DEFAULT_BASE_CURRENCY and currency not in rates():
+    raise ValueError(f"No exchange rate for {currency.upper()}")
+  db.session.execute(db.update(User).where(User.id==user_id).values(base_currency=currency))
+  db.session.commit()
+  return renormalize(user_id)
+
+
+def load_rates(path=None):
+  # Replaces the exchange_rates table with the file's rates, returns the number of currencies
+  path = path or current_app.config.get("EXCHANGE_RATES_FILE", RATES_FILE)
+  with open(path, encoding="utf-8") as stream:
+    data = json.load(stream)
+  as_of = date.fromisoformat(data["date"]) if data.get("date") else None
+  table = {code(currency): float(rate) for currency, rate in data["rates"].items()}
+  table[code(data["base"])] = 1.0
+
+  db.session.execute(db.delete(ExchangeRate))
+  db.session.execute(db.insert(ExchangeRate), [
+    {"currency": currency, "rate": rate, "as_of": as_of} for currency, rate in table.items()
+  ])
+  db.session.commit()
+  bump_version("rates")
+  g.pop("rates", None)
+  return len(table)
+
+
+def _converted(amount, ratio):
+  # amount * ratio rounded to whole cents, in SQL; the ratio is a plain number, not Money
+  return db.cast(db.func.round(amount * db.literal(ratio, db.Float)), db.BigInteger)
+
+
+def renormalize(user_id=None, batch_size=50000):
+  # Recomputes normalized_amount from the current rates, one UPDATE per
+  # (base currency, stored currency, id range) so the write lock is held briefly,
+  # then rebuilds the spending aggregates. Returns (rows updated, currencies without a rate).
+  users = db.select(User.base_currency).distinct()
+  if user_id is not None:
+    users = users.where(User.id==user_id)
+  bases = [base or DEFAULT_BASE_CURRENCY for base in db.session.execute(users).scalars()]
+  stored = list(db.session.execute(db.select(Expense.currency).distinct()).scalars())
+  low, high = db.session.execute(db.select(db.func.min(Expense.id), db.func.max(Expense.id))).one()
+
+  updated, missing = 0, set()
+  for base in bases:
+    owners = db.select(User.id).where(db.func.coalesce(User.base_currency, DEFAULT_BASE_CURRENCY)==base)
+    if user_id is not None:
+      owners = owners.where(User.id==user_id)
+    owned = db.select(Category.id).where(Category.user_id.in_(owners))
+    for currency in stored:
+      try:
+        ratio = factor(currency, base)
+      except ValueError:
+        missing.add(code(currency))
+        continue
+      for start in range(low or 0, (high or 0) + 1, batch_size):
+        updated += db.session.execute(
+          db.update(Expense)
+          .where(
+            Expense.currency==currency,
+            Expense.category_id.in_(owned),
+            Expense.id >= start,
+            Expense.id < start + batch_size,
+          )
+          .values(normalized_amount=_converted(Expense.amount, ratio))
+          .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
+  aggregates.rebuild(user_id)
+  return updated, sorted(missing)
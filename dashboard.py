@@ -0,0 +1,97 @@
+from collections import namedtuple
+
+from models import db, Category, Expense, BudgetEntry, SpendingAggregate
+from aggregates import category_totals_query
+
+
+"""
+  Everything the dashboard shows, computed in two queries:
+    - one pass over the spending aggregates gives the per-category totals, which feed
+      both the chart and the top category
+    - one UNION ALL statement fetches the most recent expense and budget entry
+  index() renders it inline, /api/dashboard serves the same data as one JSON document.
+"""
+
+CategoryTotal = namedtuple("CategoryTotal", ["name", "total_spent", "count"])
+RecentExpense = namedtuple("RecentExpense", ["amount", "created_at"])
+RecentBudget = namedtuple("RecentBudget", ["budget_limit", "month", "year"])
+
+
+def category_totals(user_id):
+  return [CategoryTotal(*row) for row in db.session.execute(category_totals_query(user_id))]
+
+
+def recent_entries_query(user_id):
+  # Latest expense and latest budget entry as (kind, amount, created_at, month, year) rows
+  expense = (
+    db.select(
+      db.literal("expense").label("kind"),
+      Expense.amount.label("amount"),
+      Expense.created_at.label("created_at"),
+      db.null().label("month"),
+      db.null().label("year"),
+    )
+    .join(Category, Expense.category_id==Category.id)
+    .where(Category.user_id==user_id)
+    .order_by(Expense.created_at.desc(), Expense.id.desc())
+    .limit(1)
+    .subquery()
+  )
+  budget = (
+    db.select(
+      db.literal("budget").label("kind"),
+      BudgetEntry.budget_limit.label("amount"),
+      db.null().label("created_at"),
+      BudgetEntry.month,
+      BudgetEntry.year,
+    )
+    .join(Category, BudgetEntry.category_id==Category.id)
+    .where(Category.user_id==user_id)
+    .order_by(BudgetEntry.id.desc())
+    .limit(1)
+    .subquery()
+  )
+  return db.union_all(db.select(expense), db.select(budget))
+
+
+def recent_entries(user_id):
+  # (latest expense, latest budget entry), either may be None
+  recent = {"expense": None, "budget": None}
+  for kind, amount, created_at, month, year in db.session.execute(recent_entries_query(user_id)):
+    if kind == "expense":
+      recent[kind] = RecentExpense(amount, created_at)
+    else:
+      recent[kind] = RecentBudget(amount, month, year)
+  return recent["expense"], recent["budget"]
+
+
+def dashboard_data(user_id):
+  totals = category_totals(user_id)
+  expense, budget = recent_entries(user_id)
+  top_category = next((row for row in totals if row.count > 0), None)
+  return {
+    "expense": expense,
+    "budget": budget,
+    "top_category": top_category,
+    "chart": {
+      "keys": [row.name for row in totals],
+      "values": [float(row.total_spent) for row in totals],
+      "label": "Total Expenses",
+      "title": "Expenses by Category",
+    },
+  }
+
+
+def as_json(data):
+  # The dashboard data with plain dicts, for jsonify
+  def plain(entry):
+    return None if entry is None else {
+      name: value.isoformat() if hasattr(value, "isoformat") else value
+      for name, value in entry._asdict().items()
+    }
+  return {
+    "expense": plain(data["expense"]),
+    "budget": plain(data["budget"]),
+    "top_category": plain(data["top_category"]),
+    "chart": data["chart"],
+  }
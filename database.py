@@ -0,0 +1,135 @@
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+
+"""
+  Engine setup for the app: pool sizing, the SQLite tuning profile and read replicas.
+  The profile's PRAGMAs are applied on every new DBAPI connection, so each pooled
+  connection (in every gunicorn worker) runs with the same settings.
+
+  Config:
+    SQLITE_PROFILE    "production" (default) or "default" (SQLite's own defaults)
+    SQLITE_PRAGMAS    dict of PRAGMA overrides on top of the profile
+    SQLITE_POOL_SIZE, SQLITE_MAX_OVERFLOW, SQLITE_POOL_TIMEOUT  connection pool sizing
+    SQLALCHEMY_BINDS["replica"]  optional read replica used by @replica_read views
+    REPLICA_STICKY_SECONDS  after a write, the user's reads stay on the primary this long
+"""
+
+REPLICA = "replica"
+
+
+class RoutingSession(Session):
+  # Reads inside a @replica_read view go to the replica, anything that flushes goes to the primary
+  def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+    if bind is None and not self._flushing and has_app_context() and g.get("use_replica"):
+      engine = self._db.engines.get(REPLICA)
+      if engine is not None:
+        return engine
+    return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+SQLITE_PROFILES = {
+  "default": {},
+  "production": {
+    # readers never block the writer and vice versa
+    "journal_mode": "WAL",
+    # fsync at checkpoints only, still safe against corruption in WAL mode
+    "synchronous": "NORMAL",
+    # wait up to 5s for the write lock instead of failing with "database is locked"
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    # negative means KiB: 64 MiB page cache per connection
+    "cache_size": -64 * 1024,
+    # ORDER BY / GROUP BY temp b-trees stay in memory
+    "temp_store": "MEMORY",
+  },
+}
+
+
+def sqlite_pragmas(config):
+  pragmas = dict(SQLITE_PROFILES[config.get("SQLITE_PROFILE", "production")])
+  pragmas.update(config.get("SQLITE_PRAGMAS") or {})
+  return pragmas
+
+
+def _is_sqlite_file(uri):
+  return uri.startswith("sqlite") and ":memory:" not in uri and uri.rstrip("/") not in ("sqlite:", "sqlite:/")
+
+
+def init_app(app):
+  uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+  options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+  if _is_sqlite_file(uri):
+    options.setdefault("pool_size", app.config.get("SQLITE_POOL_SIZE", 10))
+    options.setdefault("max_overflow", app.config.get("SQLITE_MAX_OVERFLOW", 10))
+    options.setdefault("pool_timeout", app.config.get("SQLITE_POOL_TIMEOUT", 30))
+  elif not uri.startswith("sqlite"):
+    # server databases drop idle connections, check them before use
+    options.setdefault("pool_pre_ping", True)
+
+  db.init_app(app)
+
+  pragmas = sqlite_pragmas(app.config)
+  with app.app_context():
+    for engine in db.engines.values():
+      if engine.dialect.name == "sqlite" and pragmas:
+        event.listen(engine, "connect", _pragma_listener(pragmas))
+
+  if REPLICA in (app.config.get("SQLALCHEMY_BINDS") or {}):
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 5)
+    app.after_request(_remember_write)
+
+
+def replica_read(view):
+  # GET/HEAD of this view read from the replica, unless the user wrote something moments ago
+  @wraps(view)
+  def decorated_function(*args, **kwargs):
+    if request.method in ("GET", "HEAD") and not _recently_wrote():
+      g.use_replica = True
+    return view(*args, **kwargs)
+  return decorated_function
+
+
+def _recently_wrote():
+  wrote_at = session.get("db_write_at")
+  return wrote_at is not None and time.time() - wrote_at < current_app.config["REPLICA_STICKY_SECONDS"]
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _flag_write(db_session, flush_context):
+  if has_app_context():
+    g.db_wrote = True
+
+
+def _remember_write(response):
+  # read-your-writes: the replica may not have this request's changes yet
+  if g.get("db_wrote"):
+    session["db_write_at"] = time.time()
+  return response
+
+
+def sync_replica():
+  # Copies the primary into the replica with SQLite's backup API (local two-file setups)
+  primary = db.engines[None].raw_connection()
+  replica = db.engines[REPLICA].raw_connection()
+  try:
+    primary.driver_connection.backup(replica.driver_connection)
+  finally:
+    primary.close()
+    replica.close()
+
+
+def _pragma_listener(pragmas):
+  def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+      cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+  return set_pragmas
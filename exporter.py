@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+import struct
+import zlib
+from datetime import date
+from decimal import Decimal
+
+import msgspec
+
+from models import db, Category, Expense, SpendingAggregate
+
+
+"""
+  Streaming export of a user's expenses (or monthly report rows).
+  Rows are read in batches from a server-side cursor and written out as they
+  arrive, so memory stays flat whatever the number of rows.
+
+  Formats:
+    csv       header + one line per row
+    ndjson    one JSON object per line
+    columnar  compact binary archive: zlib-compressed msgpack row groups, one list per column
+"""
+
+BATCH_SIZE = 1000
+FORMATS = {
+  "csv": ("text/csv", "csv"),
+  "ndjson": ("application/x-ndjson", "ndjson"),
+  "columnar": ("application/octet-stream", "expcol"),
+}
+
+COLUMNAR_MAGIC = b"EXPCOL1\n"
+
+
+def expenses_query(user_id, start=None, end=None, category=None):
+  query = (
+    db.select(
+      Expense.id,
+      Expense.created_at,
+      Expense.expense,
+      Expense.merchant,
+      Category.name.label("category"),
+      Expense.amount,
+      Expense.currency,
+      Expense.normalized_amount,
+    )
+    .join(Category, Expense.category_id==Category.id)
+    .where(Category.user_id==user_id)
+    .order_by(Expense.created_at, Expense.id)
+  )
+  if start:
+    query = query.where(Expense.created_at >= start)
+  if end:
+    query = query.where(Expense.created_at <= end)
+  if category:
+    query = query.where(Category.name==category)
+  return query
+
+
+def monthly_query(user_id, start=None, end=None, category=None):
+  # The report rows: spending per category per month, from the maintained aggregates
+  query = (
+    db.select(
+      SpendingAggregate.year,
+      SpendingAggregate.month,
+      Category.name.label("category"),
+      SpendingAggregate.total,
+      SpendingAggregate.count,
+    )
+    .join(Category, SpendingAggregate.category_id==Category.id)
+    .where(SpendingAggregate.user_id==user_id, SpendingAggregate.count > 0)
+    .order_by(SpendingAggregate.year, SpendingAggregate.month, Category.name)
+  )
+  period = SpendingAggregate.year * 100 + SpendingAggregate.month
+  if start:
+    query = query.where(period >= start.year * 100 + start.month)
+  if end:
+    query = query.where(period <= end.year * 100 + end.month)
+  if category:
+    query = query.where(Category.name==category)
+  return query
+
+
+DATASETS = {
+  "expenses": expenses_query,
+  "monthly": monthly_query,
+}
+
+
+def iter_batches(query, batch_size=BATCH_SIZE):
+  # Yields (column names, list of row tuples) batches from a server-side cursor
+  result = db.session.execute(
+    query, execution_options={"stream_results": True, "yield_per": batch_size}
+  )
+  columns = list(result.keys())
+  for partition in result.partitions():
+    yield columns, partition
+
+
+def _plain(value):
+  if isinstance(value, Decimal):
+    # money columns, same numbers as the JSON endpoints
+    return float(value)
+  return value.isoformat() if isinstance(value, date) else value
+
+
+def write_csv(batches):
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  header = False
+  for columns, rows in batches:
+    if not header:
+      writer.writerow(columns)
+      header = True
+    writer.writerows([_plain(value) for value in row] for row in rows)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def write_ndjson(batches):
+  for columns, rows in batches:
+    yield "".join(
+      json.dumps(dict(zip(columns, map(_plain, row)))) + "\n" for row in rows
+    )
+
+
+def write_columnar(batches):
+  # magic, then (length, zlib(msgpack(row group))) frames, then a zero length
+  yield COLUMNAR_MAGIC
+  for columns, rows in batches:
+    group = {
+      "rows": len(rows),
+      "columns": {name: [_plain(value) for value in values] for name, values in zip(columns, zip(*rows))},
+    }
+    frame = zlib.compress(msgspec.msgpack.encode(group), 6)
+    yield struct.pack(">I", len(frame)) + frame
+  yield struct.pack(">I", 0)
+
+
+def read_columnar(stream):
+  # Yields the rows of a columnar export back as dicts, one row group in memory at a time
+  if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+    raise ValueError("Not a columnar expense export")
+  while True:
+    (length,) = struct.unpack(">I", stream.read(4))
+    if length == 0:
+      return
+    group = msgspec.msgpack.decode(zlib.decompress(stream.read(length)))
+    names = list(group["columns"])
+    for values in zip(*group["columns"].values()):
+      yield dict(zip(names, values))
+
+
+WRITERS = {
+  "csv": write_csv,
+  "ndjson": write_ndjson,
+  "columnar": write_columnar,
+}
+
+
+def export(user_id, file_format="csv", dataset="expenses", start=None, end=None, category=None):
+  # Generator of str (csv/ndjson) or bytes (columnar) chunks; nothing runs until iterated
+  query = DATASETS[dataset](user_id, start, end, category)
+  yield from WRITERS[file_format](iter_batches(query))
@@ -1,5 +1,7 @@
 #import requests
+from decimal import Decimal
 from flask import redirect, render_template, session, flash
+from flask.json.provider import DefaultJSONProvider
 from functools import wraps
 
 # simple login_required decorator using session
@@ -11,5 +13,13 @@ def login_required(f):
     return f(*args, **kwargs)
   return decorated_function
 
+# Money columns load as Decimal, which Flask would send as a string; send a JSON number
+class MoneyJSONProvider(DefaultJSONProvider):
+  @staticmethod
+  def default(o):
+    if isinstance(o, Decimal):
+      return float(o)
+    return DefaultJSONProvider.default(o)
+
 #def usd(value):
 #  return f"${value:,.2f}"
\ No newline at end of file
@@ -0,0 +1,224 @@
+import csv
+import re
+from datetime import date, datetime
+
+from sqlalchemy import insert
+
+from models import db, money, Expense
+import aggregates
+import categories
+import currencies
+import merchants
+
+
+"""
+  Bulk expense import from bank exports (CSV or OFX).
+  Files are parsed row by row, categories are resolved through an in-memory
+  name -> id map and rows are written with executemany inserts, one transaction
+  per chunk. Memory stays bounded by the chunk size, however long the statement is.
+  Rows without a category get the one merchants.predict() picks from the user's
+  history, or the default category.
+"""
+
+CHUNK_SIZE = 1000
+MAX_ERRORS = 1000
+DEFAULT_CATEGORY = "Other"
+
+# Accepted CSV header names for each expense field
+CSV_COLUMNS = {
+  "created_at": ("date", "created_at", "transaction date", "posted", "posting date"),
+  "expense": ("expense", "description", "details", "memo"),
+  "merchant": ("merchant", "payee", "name"),
+  "category": ("category",),
+  "amount": ("amount", "value", "debit"),
+  "currency": ("currency",),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%d/%m/%Y", "%Y%m%d")
+
+
+def parse_csv(stream):
+  # Yields (row number, raw fields) for every data row
+  reader = csv.DictReader(stream)
+  headers = {(name or "").strip().lower(): name for name in reader.fieldnames or []}
+  columns = {}
+  for field, aliases in CSV_COLUMNS.items():
+    for alias in aliases:
+      if alias in headers:
+        columns[field] = headers[alias]
+        break
+
+  for number, record in enumerate(reader, start=1):
+    yield number, {field: record.get(column) for field, column in columns.items()}
+
+
+OFX_TAG = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+
+
+def _ofx_tags(stream, chunk_size=65536):
+  # Tags are read chunk by chunk, a tag cut off at the end of a chunk waits for the next one
+  buffer = ""
+  while True:
+    chunk = stream.read(chunk_size)
+    buffer += chunk
+    cut = max(buffer.rfind("<"), 0) if chunk else len(buffer)
+    for match in OFX_TAG.finditer(buffer, 0, cut):
+      yield match.group(1) == "/", match.group(2).upper(), match.group(3).strip()
+    buffer = buffer[cut:]
+    if not chunk:
+      return
+
+
+def parse_ofx(stream):
+  # OFX 1.x (SGML) and 2.x (XML) statements: one expense per <STMTTRN> debit
+  currency = None
+  transaction = None
+  number = 0
+
+  for closing, tag, text in _ofx_tags(stream):
+    if tag == "CURDEF" and not closing:
+      currency = text.lower()
+    elif tag == "STMTTRN":
+      if transaction is not None:
+        yield number, transaction
+        transaction = None
+      if not closing:
+        number += 1
+        transaction = {"currency": currency}
+    elif transaction is not None and not closing:
+      transaction[tag] = text
+  if transaction is not None:
+    yield number, transaction
+
+
+def ofx_fields(transaction):
+  amount = money(transaction.get("TRNAMT"))
+  # debits are negative in a statement, credits are not expenses
+  if amount >= 0:
+    raise ValueError("Credit transaction, not an expense")
+  return {
+    "created_at": (transaction.get("DTPOSTED") or "")[:8],
+    "expense": transaction.get("MEMO") or transaction.get("NAME"),
+    "merchant": transaction.get("NAME") or transaction.get("PAYEE"),
+    "category": None,
+    "amount": -amount,
+    "currency": transaction.get("currency"),
+  }
+
+
+def parse_date(value):
+  value = (value or "").strip()
+  # fast path for ISO dates, the common case
+  try:
+    return date.fromisoformat(value)
+  except ValueError:
+    pass
+  for fmt in DATE_FORMATS:
+    try:
+      return datetime.strptime(value, fmt).date()
+    except ValueError:
+      continue
+  raise ValueError(f"Invalid date: {value!r}")
+
+
+class CategoryMap:
+  # name -> id for one user (case-insensitive); a name missing from the cached list goes
+  # through categories.get_or_create, so one another worker just created is reused
+  def __init__(self, user_id):
+    self.user_id = user_id
+    self.ids = {entry.name.lower(): entry.id for entry in categories.user_categories(user_id)}
+
+  def resolve(self, name):
+    key = name.strip().lower()
+    if key not in self.ids:
+      self.ids[key] = categories.get_or_create(self.user_id, name.strip()[:125])
+    return self.ids[key]
+
+  def predict(self, merchant, expense, default_category):
+    # in-memory merchant index, no query per row
+    category_id = merchants.predict(self.user_id, merchant, expense)
+    return category_id if category_id is not None else self.resolve(default_category)
+
+
+def build_row(fields, categories, default_category, default_currency, base_currency):
+  expense = (fields.get("expense") or "").strip()
+  merchant = (fields.get("merchant") or "").strip()
+  if not expense and not merchant:
+    raise ValueError("Expense or merchant is required")
+
+  amount = fields.get("amount")
+  if amount is None or amount == "":
+    raise ValueError("Amount is required")
+  amount = money(amount)
+  if amount <= 0:
+    raise ValueError("Amount must be greater than 0")
+
+  currency = (fields.get("currency") or default_currency or "").strip().lower()
+  if not currency:
+    raise ValueError("Currency is required")
+
+  expense, merchant = (expense or merchant)[:125], (merchant or expense)[:125]
+  created_at = parse_date(fields.get("created_at"))
+  normalized_amount = currencies.normalize(amount, currency, base_currency)
+  if fields.get("category"):
+    category_id = categories.resolve(fields["category"])
+  else:
+    category_id = categories.predict(merchant, expense, default_category)
+  return {
+    "expense": expense,
+    "merchant": merchant,
+    "amount": amount,
+    "currency": currency[:25],
+    "normalized_amount": normalized_amount,
+    "created_at": created_at,
+    "category_id": category_id,
+  }
+
+
+def detect_format(filename, head):
+  if filename and filename.lower().endswith((".ofx", ".qfx")):
+    return "ofx"
+  if head.lstrip().upper().startswith(("OFXHEADER", "<?XML", "<OFX")):
+    return "ofx"
+  return "csv"
+
+
+def import_expenses(user_id, stream, file_format="csv", default_category=DEFAULT_CATEGORY,
+                    default_currency=None, chunk_size=CHUNK_SIZE):
+  # Returns a report: {"imported", "failed", "errors": [{"row", "error"}, ...]}
+  if file_format == "ofx":
+    records, to_fields = parse_ofx(stream), ofx_fields
+  else:
+    records, to_fields = parse_csv(stream), dict
+
+  categories = CategoryMap(user_id)
+  base_currency = currencies.base_currency(user_id)
+  report = {"imported": 0, "failed": 0, "errors": []}
+  rows = []
+  delta = aggregates.SpendingDelta()
+
+  def flush():
+    if rows:
+      db.session.execute(insert(Expense), rows)
+      delta.apply()
+    db.session.commit()
+    report["imported"] += len(rows)
+    rows.clear()
+
+  for number, fields in records:
+    try:
+      row = build_row(to_fields(fields), categories, default_category, default_currency, base_currency)
+    except ValueError as error:
+      report["failed"] += 1
+      if len(report["errors"]) < MAX_ERRORS:
+        report["errors"].append({"row": number, "error": str(error)})
+      continue
+
+    rows.append(row)
+    delta.add(user_id, row["category_id"], row["created_at"], row["normalized_amount"])
+    # later rows of the same statement learn from this one
+    merchants.record(user_id, row["merchant"], row["category_id"], row["expense"])
+    if len(rows) >= chunk_size:
+      flush()
+  flush()
+  return report
@@ -0,0 +1,204 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter, namedtuple
+
+from sqlalchemy import func, select
+
+from models import db, Category, Expense
+from cache import LRUCache
+import categories
+
+
+"""
+  Merchant autocomplete and category prediction, from each user's own expenses.
+  A user's MerchantIndex is built on first use with one grouped query (merchant,
+  description, category, count) and kept in an in-process LRU across users, so typing in
+  the merchant field and categorizing imported rows never query the database. Autocomplete is a bisect over a
+  sorted list of name keys (the whole name and the name from each later word, so "nero"
+  finds "Cafe Nero"); suggestions are ordered by how often the merchant was used.
+
+  Predicting a category for a new expense, first rule that applies:
+    1. a merchant used before: its most frequent category
+    2. the words of the merchant and description, each voting with the categories it was
+       used under, when one category clearly wins
+    3. KEYWORD_RULES, for a user's default categories
+  Writes that add expenses record them in the loaded index; edits, deletes and bulk
+  writes drop it so the next request rebuilds it. Each worker holds its own copy for
+  at most INDEX_TTL seconds.
+"""
+
+MAX_SUGGESTIONS = 10
+# merchants kept per user (the most used), and users kept per process
+MAX_MERCHANTS = 5000
+MAX_USERS = 1024
+INDEX_TTL = 600
+# share of the word votes the winning category needs
+MIN_VOTE_SHARE = 0.6
+
+WORD = re.compile(r"\w+")
+
+KEYWORD_RULES = {
+  "Food": (
+    "bakery", "butcher", "cafe", "checkers", "coffee", "dinner", "grocer", "groceries", "kfc",
+    "lunch", "mcdonalds", "pick", "restaurant", "shoprite", "spar", "takeaway", "woolworths",
+  ),
+  "Transport": (
+    "bolt", "bus", "engen", "fuel", "gautrain", "parking", "petrol", "shell", "taxi", "toll",
+    "train", "uber",
+  ),
+  "Entertainment": (
+    "cinema", "concert", "disney", "games", "movies", "netflix", "showmax", "spotify", "steam",
+    "theatre",
+  ),
+  "Utilities": (
+    "airtime", "electricity", "eskom", "fibre", "gas", "internet", "municipality", "phone",
+    "prepaid", "rates", "vodacom", "water",
+  ),
+  "Shopping": (
+    "amazon", "clothing", "edgars", "game", "makro", "mall", "shoes", "store", "takealot",
+  ),
+}
+KEYWORDS = {word: name for name, words in KEYWORD_RULES.items() for word in words}
+
+Merchant = namedtuple("Merchant", ["names", "categories"])
+
+_indexes = LRUCache(threshold=MAX_USERS, default_timeout=INDEX_TTL)
+
+
+def key(name):
+  # case, accents and punctuation do not matter: "Café Booking.com" -> "cafe booking com"
+  name = (name or "").casefold()
+  if not name.isascii():
+    name = "".join(char for char in unicodedata.normalize("NFKD", name) if not unicodedata.combining(char))
+  return " ".join(WORD.findall(name))
+
+
+class MerchantIndex:
+  def __init__(self):
+    # merchant key -> Merchant(spellings Counter, category id Counter)
+    self.merchants = {}
+    # word -> category id Counter, for merchants and descriptions never seen whole
+    self.words = {}
+    # sorted (search key, merchant key)
+    self.prefixes = []
+    self.lock = threading.Lock()
+
+  def add(self, merchant, category_id, count=1, expense=None):
+    merchant_key = key(merchant)
+    if not merchant_key:
+      return
+    with self.lock:
+      entry = self.merchants.get(merchant_key)
+      if entry is None:
+        entry = self.merchants[merchant_key] = Merchant(Counter(), Counter())
+        words = merchant_key.split()
+        for i in range(len(words)):
+          insort(self.prefixes, (" ".join(words[i:]), merchant_key))
+      entry.names[merchant.strip()] += count
+      entry.categories[category_id] += count
+      for word in set(merchant_key.split()) | set(key(expense).split()):
+        counts = self.words.get(word)
+        if counts is None:
+          counts = self.words[word] = Counter()
+        counts[category_id] += count
+
+  def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+    # [(display name, times used, most used category id)], most used first
+    prefix = key(prefix)
+    if not prefix:
+      return []
+    with self.lock:
+      found = set()
+      i = bisect_left(self.prefixes, (prefix,))
+      while i < len(self.prefixes) and self.prefixes[i][0].startswith(prefix):
+        found.add(self.prefixes[i][1])
+        i += 1
+      ranked = sorted(found, key=lambda merchant_key: -sum(self.merchants[merchant_key].categories.values()))
+      return [
+        (
+          self.merchants[merchant_key].names.most_common(1)[0][0],
+          sum(self.merchants[merchant_key].categories.values()),
+          self.merchants[merchant_key].categories.most_common(1)[0][0],
+        )
+        for merchant_key in ranked[:limit]
+      ]
+
+  def predict(self, merchant, expense=None):
+    # category id from the user's history (rules 1 and 2), None if it says nothing clear
+    with self.lock:
+      entry = self.merchants.get(key(merchant))
+      if entry is not None:
+        return entry.categories.most_common(1)[0][0]
+      votes = Counter()
+      for word in set(key(merchant).split()) | set(key(expense).split()):
+        counts = self.words.get(word)
+        if counts is None or len(word) < 3:
+          continue
+        total = sum(counts.values())
+        for category_id, count in counts.items():
+          votes[category_id] += count / total
+    if not votes:
+      return None
+    category_id, score = votes.most_common(1)[0]
+    return category_id if score / sum(votes.values()) >= MIN_VOTE_SHARE else None
+
+
+def _build(user_id):
+  index = MerchantIndex()
+  rows = db.session.execute(
+    select(Expense.merchant, Expense.expense, Expense.category_id, func.count())
+    .join(Category)
+    .where(Category.user_id==user_id)
+    .group_by(Expense.merchant, Expense.expense, Expense.category_id)
+  ).all()
+  totals = Counter()
+  for merchant, _, _, count in rows:
+    totals[key(merchant)] += count
+  kept = {merchant_key for merchant_key, _ in totals.most_common(MAX_MERCHANTS)}
+  for merchant, expense, category_id, count in rows:
+    if key(merchant) in kept:
+      index.add(merchant, category_id, count, expense)
+  return index
+
+
+def get_index(user_id):
+  index = _indexes.get(user_id)
+  if index is None:
+    index = _build(user_id)
+    _indexes.set(user_id, index)
+  return index
+
+
+def invalidate(user_id):
+  _indexes.delete(user_id)
+
+
+def record(user_id, merchant, category_id, expense=None):
+  # A new expense, added to the user's index if it is loaded (otherwise it is read on build)
+  index = _indexes.get(user_id)
+  if index is not None:
+    index.add(merchant, category_id, expense=expense)
+
+
+def suggest(user_id, prefix, limit=MAX_SUGGESTIONS):
+  limit = min(max(limit or MAX_SUGGESTIONS, 1), MAX_SUGGESTIONS)
+  names = {entry.id: entry.name for entry in categories.user_categories(user_id)}
+  return [
+    {"merchant": name, "count": count, "category": names.get(category_id)}
+    for name, count, category_id in get_index(user_id).suggest(prefix, limit)
+  ]
+
+
+def predict(user_id, merchant, expense=None):
+  # Category id for a new expense, None when no rule applies
+  category_id = get_index(user_id).predict(merchant, expense)
+  if category_id is not None:
+    return category_id
+  ids = {entry.name.casefold(): entry.id for entry in categories.user_categories(user_id)}
+  for word in key(merchant).split() + key(expense).split():
+    name = KEYWORDS.get(word)
+    if name is not None and name.casefold() in ids:
+      return ids[name.casefold()]
+  return None
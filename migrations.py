@@ -0,0 +1,226 @@
+import os
+
+from flask import current_app
+from sqlalchemy import Integer, delete, func, inspect, select, text, update
+from sqlalchemy.schema import CreateTable
+
+from models import (
+  db, Money, BudgetAlert, BudgetEntry, Category, Expense, ExchangeRate, RecurringRule, SpendingAggregate,
+)
+import aggregates
+import currencies
+import search
+
+
+"""
+  Schema creation (flask init-db) and upgrades for existing databases (e.g. the bundled
+  expenses.db). db.create_all() only creates missing tables, so changes to tables that
+  already exist are applied here. Every step is idempotent and safe to run again. The
+  app never does either on startup.
+"""
+
+def normalize_expense_dates():
+  # Expense.created_at used to be a free String(60) column; keep only the ISO date.
+  # SQLite has no real DATE storage class, "YYYY-MM-DD" text is what the Date type reads.
+  if db.engine.dialect.name != "sqlite":
+    return
+  db.session.execute(text(
+    "UPDATE expenses SET created_at = substr(created_at, 1, 10) WHERE length(created_at) > 10"
+  ))
+
+
+def add_missing_columns():
+  # New model columns on tables that already exist. SQLite cannot add a NOT NULL column
+  # without a default, such columns are added nullable and filled by a backfill step.
+  connection = db.session.connection()
+  inspector = inspect(connection)
+  for table in db.metadata.sorted_tables:
+    if not inspector.has_table(table.name):
+      continue
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    for column in table.columns:
+      if column.name in existing:
+        continue
+      ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+      if column.server_default is not None:
+        ddl += f" NOT NULL DEFAULT '{column.server_default.arg}'"
+      db.session.execute(text(ddl))
+
+
+def _money_columns(table):
+  return [column for column in table.columns if isinstance(column.type, Money)]
+
+
+def convert_money_columns():
+  # Money columns used to be Float (units), they are integer cents now. SQLite cannot change a
+  # column's type, so those tables are rebuilt: create the new table, copy the rows with
+  # round(value * 100), drop the old one and rename (indexes come back in create_missing_indexes).
+  connection = db.session.connection()
+  inspector = inspect(connection)
+  stale = []
+  for table in db.metadata.sorted_tables:
+    if not _money_columns(table) or not inspector.has_table(table.name):
+      continue
+    types = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+    if any(not isinstance(types.get(column.name, Integer()), Integer) for column in _money_columns(table)):
+      stale.append((table, types))
+  if not stale:
+    return
+
+  if connection.dialect.name != "sqlite":
+    for table, types in stale:
+      for column in _money_columns(table):
+        if not isinstance(types[column.name], Integer):
+          db.session.execute(text(
+            f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT"
+            f" USING round({column.name} * 100)"
+          ))
+    return
+
+  # DROP TABLE would cascade through the foreign keys; the SQLite profiles leave them off
+  if db.session.execute(text("PRAGMA foreign_keys")).scalar():
+    raise RuntimeError("Run flask migrate with PRAGMA foreign_keys=OFF to convert the money columns")
+  # expenses without a normalized amount (older databases) are copied with 0 and renormalized below
+  missing_normalized = any(
+    table.name == "expenses" and "normalized_amount" in types for table, types in stale
+  ) and db.session.execute(text("SELECT count(*) FROM expenses WHERE normalized_amount IS NULL")).scalar()
+
+  for table, types in stale:
+    copied = [column for column in table.columns if column.name in types]
+    values = []
+    for column in copied:
+      value = column.name
+      if isinstance(column.type, Money):
+        if not isinstance(types[column.name], Integer):
+          value = f"CAST(round({value} * 100) AS INTEGER)"
+        if not column.nullable:
+          value = f"coalesce({value}, 0)"
+      values.append(value)
+    names = ", ".join(column.name for column in copied)
+    ddl = str(CreateTable(table).compile(connection)).replace(
+      f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}__money ", 1
+    )
+    db.session.execute(text(ddl))
+    db.session.execute(text(
+      f"INSERT INTO {table.name}__money ({names}) SELECT {', '.join(values)} FROM {table.name}"
+    ))
+    db.session.execute(text(f"DROP TABLE {table.name}"))
+    db.session.execute(text(f"ALTER TABLE {table.name}__money RENAME TO {table.name}"))
+
+  if missing_normalized:
+    currencies.renormalize()
+
+
+def merge_duplicate_categories():
+  # Categories had no unique (user_id, name) index, so two workers could create the same
+  # one. Each duplicate is folded into the oldest category of its name (rows pointing at it
+  # are moved over, the user's aggregates rebuilt) before create_missing_indexes adds it.
+  oldest = (
+    select(Category.user_id, Category.name, func.min(Category.id).label("id"))
+    .group_by(Category.user_id, Category.name)
+    .having(func.count() > 1)
+    .subquery()
+  )
+  duplicates = db.session.execute(
+    select(Category.id, oldest.c.id, Category.user_id)
+    .join(oldest, (Category.user_id==oldest.c.user_id) & (Category.name==oldest.c.name))
+    .where(Category.id != oldest.c.id)
+  ).all()
+  if not duplicates:
+    return
+
+  for duplicate, kept, _ in duplicates:
+    for model in (Expense, BudgetEntry, RecurringRule, BudgetAlert):
+      db.session.execute(update(model).where(model.category_id==duplicate).values(category_id=kept))
+  ids = [duplicate for duplicate, _, _ in duplicates]
+  db.session.execute(delete(SpendingAggregate).where(SpendingAggregate.category_id.in_(ids)))
+  db.session.execute(delete(Category).where(Category.id.in_(ids)))
+  for user_id in {user_id for _, _, user_id in duplicates}:
+    aggregates.rebuild(user_id)
+
+
+def create_missing_indexes():
+  connection = db.session.connection()
+  inspector = inspect(connection)
+  for table in db.metadata.sorted_tables:
+    if not inspector.has_table(table.name):
+      continue
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+      if index.name not in existing:
+        index.create(bind=connection)
+
+
+def create_search_index():
+  # The FTS5 expense search index and its triggers, built from the existing expenses
+  search.create_index()
+
+
+# Indexes superseded by a wider one under a new name
+REPLACED_INDEXES = {
+  "expenses": ["ix_expenses_category_created", "ix_expenses_category_created_amount"],
+}
+
+
+def drop_replaced_indexes():
+  inspector = inspect(db.session.connection())
+  for table, names in REPLACED_INDEXES.items():
+    if not inspector.has_table(table):
+      continue
+    existing = {index["name"] for index in inspector.get_indexes(table)}
+    for name in names:
+      if name in existing:
+        db.session.execute(text(f"DROP INDEX {name}"))
+
+
+def load_default_rates():
+  # A database without exchange rates starts with the bundled rates file
+  has_rates = db.session.execute(select(func.count()).select_from(ExchangeRate)).scalar()
+  if not has_rates and os.path.exists(current_app.config.get("EXCHANGE_RATES_FILE", currencies.RATES_FILE)):
+    currencies.load_rates()
+
+
+def backfill_normalized_amounts():
+  # Expenses written before normalized_amount existed; renormalize also rebuilds the aggregates
+  missing = db.session.execute(
+    select(func.count()).select_from(Expense).where(Expense.normalized_amount.is_(None))
+  ).scalar()
+  if missing:
+    currencies.renormalize()
+
+
+def backfill_spending_aggregates():
+  # Databases created before spending_aggregates existed start with an empty table
+  has_aggregates = db.session.execute(select(func.count()).select_from(SpendingAggregate)).scalar()
+  has_expenses = db.session.execute(select(func.count()).select_from(Expense)).scalar()
+  if has_expenses and not has_aggregates:
+    aggregates.rebuild()
+
+
+STEPS = [
+  normalize_expense_dates,
+  add_missing_columns,
+  load_default_rates,
+  convert_money_columns,
+  merge_duplicate_categories,
+  create_missing_indexes,
+  create_search_index,
+  drop_replaced_indexes,
+  backfill_normalized_amounts,
+  backfill_spending_aggregates,
+]
+
+
+def create_schema():
+  # A new database: every table and index (the search index with the expenses table), and
+  # the bundled exchange rates
+  db.create_all()
+  load_default_rates()
+  db.session.commit()
+
+
+def upgrade():
+  db.create_all()
+  for step in STEPS:
+    step()
+  db.session.commit()
@@ -1,18 +1,59 @@
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import Integer, String, Float, ForeignKey, Date, select
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from sqlalchemy import BigInteger, Integer, String, Float, ForeignKey, Date, DateTime, Index, TypeDecorator, select
 from werkzeug.security import check_password_hash, generate_password_hash
 
+# the SQLAlchemy extension lives in database.py (engine and session setup)
+from database import db
+
 class Base(DeclarativeBase):
   pass
 
-db = SQLAlchemy()
-
 """
   Create SQLAlchemy models matching the sql tables in my database.sql file
   ========== Adapted from SQLAlchemy Documentation ==============
   https://docs.sqlalchemy.org/en/20/orm/quickstart.html
 """
+
+CENT = Decimal("0.01")
+# Money columns are signed 64-bit integers of cents
+MAX_CENTS = 2 ** 63 - 1
+
+
+def money(value):
+  # An amount as a Decimal rounded to cents; ValueError if it is not a finite number or
+  # its cents do not fit a Money column
+  if not isinstance(value, Decimal):
+    try:
+      value = Decimal(str(value).strip().replace(",", ""))
+    except InvalidOperation:
+      raise ValueError(f"Invalid amount: {value!r}")
+  if not value.is_finite():
+    raise ValueError(f"Invalid amount: {value!r}")
+  try:
+    # more digits than the decimal context holds ("1e400")
+    value = value.quantize(CENT, rounding=ROUND_HALF_UP)
+  except InvalidOperation:
+    raise ValueError(f"Amount out of range: {value}")
+  if abs(value.scaleb(2)) > MAX_CENTS:
+    raise ValueError(f"Amount out of range: {value}")
+  return value
+
+
+class Money(TypeDecorator):
+  # Stored as integer minor units (cents), so SUMs and comparisons are exact; Decimal in Python.
+  # Values compared with or added to a Money column are converted too (amount > 100 -> > 10000).
+  impl = BigInteger
+  cache_ok = True
+
+  def process_bind_param(self, value, dialect):
+    return None if value is None else int(money(value).scaleb(2))
+
+  def process_result_value(self, value, dialect):
+    return None if value is None else money(Decimal(value).scaleb(-2))
+
+
 # User class model
 class User(db.Model):
   __tablename__ = "users"
@@ -20,6 +61,8 @@ class User(db.Model):
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
   email: Mapped[str] = mapped_column(String(60), unique=True, nullable=False)
   password_hash: Mapped[str] = mapped_column(String(250), nullable=False)
+  # dashboard and report totals are expressed in this currency
+  base_currency: Mapped[str] = mapped_column(String(25), nullable=False, default="zar", server_default="zar")
 
   # Below In-Model hasshing adapted from ->
   # https://dev.to/goke/securing-your-flask-application-hashing-passwords-tutorial-2f0p
@@ -39,7 +82,7 @@ class Income(db.Model):
   __tablename__ = "incomes"
 
   id: Mapped[int] = mapped_column(primary_key=True)
-  income_value: Mapped[float] = mapped_column(Float, nullable=False)
+  income_value: Mapped[Decimal] = mapped_column(Money, nullable=False)
 
   # Foreign data
   user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), unique=True)
@@ -52,12 +95,16 @@ class Income(db.Model):
 # Category model
 class Category(db.Model):
   __tablename__ = "categories"
+  __table_args__ = (
+    # one category of a name per user, however many workers create it at once
+    Index("ux_categories_user_id_name", "user_id", "name", unique=True),
+  )
 
   id: Mapped[int] = mapped_column(Integer, primary_key=True)
   name: Mapped[str] = mapped_column(String(125), nullable=False)
 
   # Foreign data
-  user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+  user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
   user = relationship("User", back_populates="categories")
 
   # Relationships
@@ -68,6 +115,10 @@ class Category(db.Model):
 # Budget entry model
 class BudgetEntry(db.Model):
   __tablename__ = "budget_entries"
+  __table_args__ = (
+    # budgets of a category for a given month/year
+    Index("ix_budget_entries_category_period", "category_id", "year", "month"),
+  )
 
   id: Mapped[int] = mapped_column(primary_key=True)
 
@@ -78,7 +129,7 @@ class BudgetEntry(db.Model):
   month: Mapped[int] = mapped_column(Integer, nullable=False)  # Jan to Dec in (1-12)
   year: Mapped[int] = mapped_column(Integer, nullable=False)
 
-  budget_limit: Mapped[float] = mapped_column(Float, nullable=False)
+  budget_limit: Mapped[Decimal] = mapped_column(Money, nullable=False)
 
   # Relationships
   category = relationship("Category", back_populates="budget_entries")
@@ -90,18 +141,157 @@ class BudgetEntry(db.Model):
 # Expenses class model
 class Expense(db.Model):
   __tablename__ = "expenses"
-    
+  __table_args__ = (
+    # user -> category -> newest first, the shape of the expense list and dashboard queries;
+    # normalized_amount makes it covering for the per-day sums of the time-series reports
+    Index(
+      "ix_expenses_category_created_normalized",
+      "category_id", db.desc("created_at"), db.desc("id"), "normalized_amount",
+    ),
+    Index("ix_expenses_recurring_rule_created", "recurring_rule_id", "created_at", unique=True),
+  )
+
   id: Mapped[int] = mapped_column(primary_key=True)
   expense: Mapped[str] = mapped_column(String(125), nullable=False)
   merchant: Mapped[str] = mapped_column(String(125), nullable=False)
-  amount: Mapped[float] = mapped_column(Float, nullable=False)
+  amount: Mapped[Decimal] = mapped_column(Money, nullable=False)
   currency: Mapped[str] = mapped_column(String(25), nullable=False)
-  created_at: Mapped[str] = mapped_column(String(60))
+  # amount in the owner's base currency, set on every write (see currencies.py)
+  normalized_amount: Mapped[Decimal] = mapped_column(Money, nullable=False)
+  created_at: Mapped[date] = mapped_column(Date, nullable=False)
 
   # Foreign data
   category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
-  budget_entry_id: Mapped[int] = mapped_column(ForeignKey("budget_entries.id"), nullable=True)
+  budget_entry_id: Mapped[int] = mapped_column(ForeignKey("budget_entries.id"), nullable=True, index=True)
+  # set on expenses written by a recurring rule, one expense per rule and date
+  recurring_rule_id: Mapped[int] = mapped_column(ForeignKey("recurring_rules.id"), nullable=True)
 
   # Relationships
   category = relationship("Category", back_populates="expenses")
-  budget_entry = relationship("BudgetEntry", back_populates="expenses")
\ No newline at end of file
+  budget_entry = relationship("BudgetEntry", back_populates="expenses")
+
+  def to_dict(self):
+    return {
+      "id": self.id,
+      "expense": self.expense,
+      "merchant": self.merchant,
+      "category": self.category.name,
+      "amount": self.amount,
+      "currency": self.currency,
+      "normalized_amount": self.normalized_amount,
+      "created_at": self.created_at.isoformat(),
+    }
+
+# Spending aggregate model
+# Running totals per user/category/month, kept up to date on every expense write
+class SpendingAggregate(db.Model):
+  __tablename__ = "spending_aggregates"
+
+  user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+  category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"), primary_key=True)
+  year: Mapped[int] = mapped_column(Integer, primary_key=True)
+  month: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+  total: Mapped[Decimal] = mapped_column(Money, nullable=False, default=0)
+  count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+# Exchange rate model
+# Units of `currency` per one unit of the rates file's reference currency
+class ExchangeRate(db.Model):
+  __tablename__ = "exchange_rates"
+
+  currency: Mapped[str] = mapped_column(String(25), primary_key=True)
+  rate: Mapped[float] = mapped_column(Float, nullable=False)
+  as_of: Mapped[date] = mapped_column(Date, nullable=True)
+
+
+# Recurring rule model
+# A repeating expense (rent, subscriptions) or a monthly budget limit, written by recurring.py
+class RecurringRule(db.Model):
+  __tablename__ = "recurring_rules"
+  __table_args__ = (
+    # the scheduler's only lookup: rules due on or before a date (inactive rules have no next_run)
+    Index("ix_recurring_rules_next_run", "next_run"),
+  )
+
+  id: Mapped[int] = mapped_column(primary_key=True)
+  user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+  category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"))
+
+  kind: Mapped[str] = mapped_column(String(10), nullable=False)  # expense | budget
+  frequency: Mapped[str] = mapped_column(String(10), nullable=False)  # weekly | monthly | yearly
+  amount: Mapped[Decimal] = mapped_column(Money, nullable=False)  # budget limit for budget rules
+  currency: Mapped[str] = mapped_column(String(25), nullable=True)
+  expense: Mapped[str] = mapped_column(String(125), nullable=True)
+  merchant: Mapped[str] = mapped_column(String(125), nullable=True)
+
+  # day of the month the rule was started on, later months are clamped to their last day
+  anchor_day: Mapped[int] = mapped_column(Integer, nullable=False)
+  next_run: Mapped[date] = mapped_column(Date, nullable=True)
+  end_date: Mapped[date] = mapped_column(Date, nullable=True)
+
+  category = relationship("Category")
+
+  def to_dict(self):
+    return {
+      "id": self.id,
+      "kind": self.kind,
+      "frequency": self.frequency,
+      "category": self.category.name,
+      "amount": self.amount,
+      "currency": self.currency,
+      "expense": self.expense,
+      "merchant": self.merchant,
+      "next_run": self.next_run.isoformat() if self.next_run else None,
+      "end_date": self.end_date.isoformat() if self.end_date else None,
+    }
+
+
+# Budget alert model
+# A budget passing 50/80/100% of its limit, written with the expense change that did it (alerts.py)
+class BudgetAlert(db.Model):
+  __tablename__ = "budget_alerts"
+  __table_args__ = (
+    # polling reads a user's alerts after the last id seen
+    Index("ix_budget_alerts_user_id", "user_id", "id"),
+  )
+
+  id: Mapped[int] = mapped_column(primary_key=True)
+  user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False)
+  budget_entry_id: Mapped[int] = mapped_column(ForeignKey("budget_entries.id"), nullable=False)
+  category_id: Mapped[int] = mapped_column(ForeignKey("categories.id"), nullable=False)
+  year: Mapped[int] = mapped_column(Integer, nullable=False)
+  month: Mapped[int] = mapped_column(Integer, nullable=False)
+
+  threshold: Mapped[int] = mapped_column(Integer, nullable=False)  # percent of the limit
+  total: Mapped[Decimal] = mapped_column(Money, nullable=False)  # spent when it was crossed
+  budget_limit: Mapped[Decimal] = mapped_column(Money, nullable=False)
+  created_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+  read_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+  category = relationship("Category")
+
+  def to_dict(self):
+    return {
+      "id": self.id,
+      "budget_id": self.budget_entry_id,
+      "category": self.category.name,
+      "year": self.year,
+      "month": self.month,
+      "threshold": self.threshold,
+      "total": self.total,
+      "budget_limit": self.budget_limit,
+      "created_at": self.created_at.isoformat(timespec="seconds"),
+      "read": self.read_at is not None,
+    }
+
+
+# Response cache version model
+# The version every cached response of a scope ("all", "user:<id>") is keyed by (cache.py),
+# kept here so an invalidation by one worker or CLI command is seen by all of them
+class CacheVersion(db.Model):
+  __tablename__ = "cache_versions"
+
+  scope: Mapped[str] = mapped_column(String(40), primary_key=True)
+  version: Mapped[int] = mapped_column(BigInteger, nullable=False)
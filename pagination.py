@@ -0,0 +1,71 @@
+import base64
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.orm import contains_eager
+
+from models import db, Category, Expense
+
+
+"""
+  Keyset (cursor) pagination over a user's expenses, newest first.
+  The cursor is the (created_at, id) of the last row on the page, so each page reads one
+  range of the (category_id, created_at) index per category, merged newest first and
+  cut off at the page size, instead of an OFFSET that re-reads every earlier row.
+"""
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(expense):
+  raw = f"{expense.created_at.isoformat()}|{expense.id}"
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+  # Raises ValueError for anything that is not a cursor we handed out
+  try:
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, expense_id = raw.split("|")
+    return date.fromisoformat(created_at), int(expense_id)
+  except (TypeError, UnicodeDecodeError, ValueError):
+    raise ValueError("Invalid cursor")
+
+
+def expenses_query(user_id):
+  # The category is joined anyway, load it with the row instead of once per row in the template
+  return (
+    select(Expense)
+    .join(Category)
+    .where(Category.user_id == user_id)
+    .options(contains_eager(Expense.category))
+    .order_by(Expense.created_at.desc(), Expense.id.desc())
+  )
+
+
+def page_query(user_id, after=None, limit=PAGE_SIZE):
+  # The rows after the (created_at, id) position `after`, one more than the page size
+  query = expenses_query(user_id)
+  if after:
+    # a row-value comparison is one index range per category; the equivalent OR is planned
+    # as a MULTI-INDEX OR that reads and sorts the whole history
+    query = query.where(db.tuple_(Expense.created_at, Expense.id) < db.tuple_(*after))
+  return query.limit(limit + 1)
+
+
+def expense_page(user_id, cursor=None, limit=None):
+  # Returns (expenses, next_cursor); next_cursor is None on the last page
+  limit = min(max(limit or PAGE_SIZE, 1), MAX_PAGE_SIZE)
+  after = decode_cursor(cursor) if cursor else None
+
+  # one extra row tells whether there is a next page
+  rows = db.session.execute(page_query(user_id, after, limit)).scalars().all()
+  next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+  return rows[:limit], next_cursor
+
+
+def iter_expenses(user_id, batch_size=100):
+  # Lazily executed so that, when streamed, the query runs inside the streaming context
+  res = expenses_query(user_id).execution_options(yield_per=batch_size)
+  yield from db.session.execute(res).scalars()
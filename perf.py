@@ -0,0 +1,214 @@
+import heapq
+import hmac
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, abort, current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+
+from database import db
+
+
+"""
+  Request instrumentation built on SQLAlchemy engine events and Flask request hooks.
+  For every request it records the number of SQL statements, the time spent in the
+  database and the slowest statements, and reports them:
+    - X-Query-Count and Server-Timing response headers (shown in the browser dev tools)
+    - one JSON line per request on the "perf" logger
+    - per-endpoint totals at /debug/perf (per worker process, needs PERF_DEBUG_TOKEN)
+
+  Config:
+    PERF_LOG               log a line per request (default True)
+    PERF_SLOW_QUERY_MS     statements slower than this are logged as warnings (default 100)
+    PERF_SLOWEST_KEPT      slowest statements kept per endpoint (default 5)
+    PERF_DEBUG_TOKEN       token for /debug/perf (Authorization: Bearer <token>), unset = disabled
+
+  Tests and benchmarks can cap the statements of a block with max_queries():
+    with perf.max_queries(3):
+      client.get("/")
+"""
+
+logger = logging.getLogger("perf")
+
+debug = Blueprint("perf", __name__)
+
+
+class PerfStats:
+  # Per-endpoint totals for this process
+  def __init__(self, slowest_kept=5):
+    self.slowest_kept = slowest_kept
+    self._endpoints = {}
+    self._lock = threading.Lock()
+
+  def record(self, endpoint, duration, queries):
+    with self._lock:
+      stats = self._endpoints.setdefault(endpoint, {
+        "requests": 0, "queries": 0, "max_queries": 0,
+        "time": 0.0, "max_time": 0.0, "db_time": 0.0, "slowest": [],
+      })
+      stats["requests"] += 1
+      stats["queries"] += len(queries)
+      stats["max_queries"] = max(stats["max_queries"], len(queries))
+      stats["time"] += duration
+      stats["max_time"] = max(stats["max_time"], duration)
+      for elapsed, statement in queries:
+        stats["db_time"] += elapsed
+        # min-heap of the slowest statements seen on this endpoint
+        if len(stats["slowest"]) < self.slowest_kept:
+          heapq.heappush(stats["slowest"], (elapsed, statement))
+        elif elapsed > stats["slowest"][0][0]:
+          heapq.heapreplace(stats["slowest"], (elapsed, statement))
+
+  def report(self):
+    with self._lock:
+      return {
+        endpoint: {
+          "requests": stats["requests"],
+          "avg_queries": round(stats["queries"] / stats["requests"], 2),
+          "max_queries": stats["max_queries"],
+          "avg_ms": round(stats["time"] / stats["requests"] * 1000, 2),
+          "max_ms": round(stats["max_time"] * 1000, 2),
+          "avg_db_ms": round(stats["db_time"] / stats["requests"] * 1000, 2),
+          "slowest": [
+            {"ms": round(elapsed * 1000, 2), "statement": statement}
+            for elapsed, statement in sorted(stats["slowest"], reverse=True)
+          ],
+        }
+        for endpoint, stats in sorted(self._endpoints.items())
+      }
+
+  def clear(self):
+    with self._lock:
+      self._endpoints.clear()
+
+
+def init_app(app):
+  app.config.setdefault("PERF_LOG", True)
+  app.config.setdefault("PERF_SLOW_QUERY_MS", 100)
+  app.config.setdefault("PERF_SLOWEST_KEPT", 5)
+  app.config.setdefault("PERF_DEBUG_TOKEN", None)
+  app.extensions["perf"] = PerfStats(app.config["PERF_SLOWEST_KEPT"])
+
+  with app.app_context():
+    for engine in db.engines.values():
+      event.listen(engine, "before_cursor_execute", _before_execute)
+      event.listen(engine, "after_cursor_execute", _after_execute)
+
+  if app.config["PERF_LOG"] and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+  app.before_request(_start_request)
+  app.after_request(_finish_request)
+  app.register_blueprint(debug)
+
+
+def stats():
+  return current_app.extensions["perf"]
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault("perf_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+  elapsed = time.perf_counter() - conn.info["perf_started"].pop()
+  if has_request_context():
+    g.setdefault("perf_queries", []).append((elapsed, " ".join(statement.split())[:500]))
+
+
+def query_count():
+  # Statements executed so far in this request
+  return len(g.get("perf_queries", ()))
+
+
+def _start_request():
+  # g may outlive the request (an outer app context), start from a clean slate
+  g.perf_queries = []
+  g.perf_started = time.perf_counter()
+
+
+def _finish_request(response):
+  if "perf_started" not in g:
+    return response
+  duration = time.perf_counter() - g.perf_started
+  queries = g.get("perf_queries", [])
+  db_time = sum(elapsed for elapsed, _ in queries)
+  endpoint = request.endpoint or "<unmatched>"
+
+  response.headers["X-Query-Count"] = str(len(queries))
+  response.headers["Server-Timing"] = (
+    f'db;dur={db_time * 1000:.2f};desc="{len(queries)} queries", app;dur={duration * 1000:.2f}'
+  )
+  stats().record(endpoint, duration, queries)
+
+  if current_app.config["PERF_LOG"]:
+    slowest = max(queries, default=None)
+    logger.info(json.dumps({
+      "event": "request",
+      "method": request.method,
+      "path": request.path,
+      "endpoint": endpoint,
+      "status": response.status_code,
+      "ms": round(duration * 1000, 2),
+      "queries": len(queries),
+      "db_ms": round(db_time * 1000, 2),
+      "slowest_ms": round(slowest[0] * 1000, 2) if slowest else None,
+    }))
+    threshold = current_app.config["PERF_SLOW_QUERY_MS"] / 1000
+    for elapsed, statement in queries:
+      if elapsed >= threshold:
+        logger.warning(json.dumps({
+          "event": "slow_query", "endpoint": endpoint,
+          "ms": round(elapsed * 1000, 2), "statement": statement,
+        }))
+  return response
+
+
+@debug.route("/debug/perf", methods=["GET", "DELETE"])
+def perf_report():
+  # Disabled unless a token is configured, the report includes SQL text
+  token = current_app.config["PERF_DEBUG_TOKEN"]
+  if not token:
+    abort(404)
+  given = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+  if not hmac.compare_digest(given.encode(), token.encode()):
+    abort(403)
+
+  if request.method == "DELETE":
+    stats().clear()
+    return "", 204
+  return jsonify(stats().report()), 200
+
+
+class QueryBudgetExceeded(AssertionError):
+  pass
+
+
+@contextmanager
+def max_queries(limit):
+  # Fails with QueryBudgetExceeded when the block runs more than `limit` statements
+  # (needs an app context; counts every engine, inside a request or not)
+  statements = []
+
+  def count(conn, cursor, statement, parameters, context, executemany):
+    statements.append(" ".join(statement.split()))
+
+  engines = list(db.engines.values())
+  for engine in engines:
+    event.listen(engine, "before_cursor_execute", count)
+  try:
+    yield statements
+  finally:
+    for engine in engines:
+      event.remove(engine, "before_cursor_execute", count)
+
+  if len(statements) > limit:
+    raise QueryBudgetExceeded(
+      f"{len(statements)} queries, budget is {limit}:\n" + "\n".join(statements)
+    )
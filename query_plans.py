@@ -0,0 +1,89 @@
+import re
+from datetime import date
+
+from sqlalchemy import select
+
+from models import db, Category, Expense
+from aggregates import category_totals_query
+from budgets import budget_rollup_query
+from pagination import page_query
+import alerts
+import dashboard
+import recurring
+import reports
+import search
+
+
+"""
+  EXPLAIN QUERY PLAN checks for the hot-path queries.
+  Each query must reach the expense tables through an index, never a full table scan,
+  must not OR several index ranges together, and must not sort its rows in a temp B-tree
+  unless the sort is listed in BOUNDED_SORTS with the reason it only sees a few rows.
+"""
+
+HOT_PATHS = {
+  "expenses page": page_query,
+  "expenses next page": lambda user_id: page_query(user_id, (date(2025, 6, 1), 1000)),
+  "dashboard recent entries": dashboard.recent_entries_query,
+  "single expense": lambda user_id: (
+    select(Expense)
+    .join(Category)
+    .where(Category.user_id==user_id, Expense.id==1)
+  ),
+  "category totals": category_totals_query,
+  "budget rollup": budget_rollup_query,
+  "timeseries days": lambda user_id: reports.daily_series_query(user_id, date(2025, 1, 6), date(2025, 7, 7)),
+  "timeseries month": lambda user_id: reports.monthly_series_query(user_id, date(2025, 1, 1), date(2026, 1, 1)),
+  "timeseries budgets": lambda user_id: reports.budget_series_query(user_id, date(2025, 1, 1), date(2026, 1, 1)),
+  "recurring due rules": lambda user_id: recurring.due_rules_query(date(2025, 1, 1)),
+  "expense search": lambda user_id: search.search_query(
+    user_id, "coffee", start=date(2025, 1, 1), indexed=search.has_index()
+  ),
+  "budgets of changed periods": lambda user_id: alerts.budgets_query([(user_id, 1, 2025, 1), (user_id, 2, 2025, 1)]),
+  "budget alerts since": lambda user_id: alerts.alerts_query(user_id, 1),
+  "unread budget alerts": alerts.alerts_query,
+}
+
+# A plain "SCAN <table>" step means every row of the table is visited
+FULL_SCAN = re.compile(r"\bSCAN (expenses|categories|budget_entries|spending_aggregates|recurring_rules|budget_alerts)\b")
+# Each index range of an OR is read in full before the rows are combined (and sorted)
+MULTI_INDEX_OR = re.compile(r"\bMULTI-INDEX OR\b")
+# Rows the indexes could not deliver in order are sorted in a temporary table
+TEMP_SORT = re.compile(r"\bUSE TEMP B-TREE\b")
+
+# Hot paths allowed a temp B-tree, and why it only ever holds a few rows
+BOUNDED_SORTS = {
+  "expenses page": "newest rows of each category's index range, merged and cut off at the page size",
+  "expenses next page": "newest rows of each category's index range, merged and cut off at the page size",
+  "dashboard recent entries": "newest row of each category's index range, LIMIT 1",
+  "category totals": "one row per category",
+  "expense search": "bm25 order has no index; unfiltered searches rank at most search.RANK_WINDOW matches",
+}
+
+
+def explain(stmt):
+  # render_postcompile expands IN lists into one parameter per value
+  compiled = stmt.compile(dialect=db.engine.dialect, compile_kwargs={"render_postcompile": True})
+  params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+  rows = db.session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + str(compiled), params)
+  return [row[3] for row in rows]
+
+
+def problem(name, plan):
+  # "SCAN", "OR" or "SORT" for a plan that fails the check, None if it passes
+  if any(FULL_SCAN.search(line) for line in plan):
+    return "SCAN"
+  if any(MULTI_INDEX_OR.search(line) for line in plan):
+    return "OR"
+  if name not in BOUNDED_SORTS and any(TEMP_SORT.search(line) for line in plan):
+    return "SORT"
+  return None
+
+
+def check(user_id=1):
+  # Returns {name: (plan lines, problem or None)} for every hot-path query
+  results = {}
+  for name, build in HOT_PATHS.items():
+    plan = explain(build(user_id))
+    results[name] = (plan, problem(name, plan))
+  return results
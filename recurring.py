@@ -0,0 +1,308 @@
+import logging
+import os
+import threading
+import time
+from calendar import monthrange
+from datetime import date, timedelta
+
+from sqlalchemy import insert, select, update
+
+from models import db, money, BudgetEntry, Expense, Income, RecurringRule, User
+from cache import response_cache
+import aggregates
+import categories
+import currencies
+import merchants
+
+
+"""
+  Recurring expenses and monthly budget rollover.
+  A RecurringRule holds the next date it is due (next_run). A run selects the rules due
+  today from ix_recurring_rules_next_run, in batches, so its cost follows the number of
+  due rules and not the number of users. Each batch is one transaction:
+    - every rule is claimed with a conditional UPDATE (next_run = new WHERE next_run = old),
+      a rule another run has already claimed is skipped
+    - the expenses / budget entries of every missed date up to today are inserted in bulk
+      with the spending aggregates
+  so a run can be repeated, interrupted or started from cron and the worker at once without
+  writing anything twice (ix_expenses_recurring_rule_created also rejects duplicates).
+
+  Budget rules create the month's BudgetEntry on the first of the month, unless the user
+  already set a budget for that category and month.
+
+  Config:
+    RECURRING_WORKER    run in a background thread of every app process (default off, use cron
+                        with `flask run-recurring` instead when there are many processes)
+    RECURRING_INTERVAL  seconds between worker runs (default 3600)
+"""
+
+KINDS = ("expense", "budget")
+FREQUENCIES = ("weekly", "monthly", "yearly")
+BATCH_SIZE = 500
+
+logger = logging.getLogger("recurring")
+
+
+def advance(day, frequency, anchor_day):
+  # The date after `day` for a rule started on day `anchor_day` of a month
+  if frequency == "weekly":
+    return day + timedelta(days=7)
+  months = day.year * 12 + day.month - 1 + (12 if frequency == "yearly" else 1)
+  year, month = months // 12, months % 12 + 1
+  return date(year, month, min(anchor_day, monthrange(year, month)[1]))
+
+
+def occurrences(rule, today):
+  # (dates due up to today, the next_run after them or None once the rule has ended)
+  dates = []
+  day = rule.next_run
+  while day <= today and (rule.end_date is None or day <= rule.end_date):
+    dates.append(day)
+    day = advance(day, rule.frequency, rule.anchor_day)
+  if rule.end_date is not None and day > rule.end_date:
+    day = None
+  return dates, day
+
+
+def due_rules_query(today, limit=BATCH_SIZE):
+  return (
+    select(RecurringRule)
+    .where(RecurringRule.next_run <= today)
+    .order_by(RecurringRule.next_run, RecurringRule.id)
+    .limit(limit)
+  )
+
+
+def run_due(today=None, batch_size=BATCH_SIZE):
+  # Materializes everything due up to `today`; returns counts of what was written
+  today = today or date.today()
+  report = {"rules": 0, "expenses": 0, "budgets": 0, "skipped": 0}
+  while True:
+    rules = db.session.execute(due_rules_query(today, batch_size)).scalars().all()
+    if not rules:
+      return report
+    _run_batch(rules, today, report)
+
+
+def _run_batch(rules, today, report):
+  owners = {rule.user_id for rule in rules}
+  incomes = dict(db.session.execute(
+    select(Income.user_id, Income.id).where(Income.user_id.in_(owners))
+  ).all())
+  # read with the batch, a base currency changed by another process counts from now on
+  bases = dict(db.session.execute(select(User.id, User.base_currency).where(User.id.in_(owners))).all())
+  expenses, budgets, users = [], [], set()
+  delta = aggregates.SpendingDelta()
+
+  for rule in rules:
+    dates, next_run = occurrences(rule, today)
+    claimed = db.session.execute(
+      update(RecurringRule)
+      .where(RecurringRule.id==rule.id, RecurringRule.next_run==rule.next_run)
+      .values(next_run=next_run)
+      .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+      continue
+    report["rules"] += 1
+
+    if rule.kind == "expense":
+      try:
+        normalized_amount = currencies.normalize(
+          rule.amount, rule.currency, bases.get(rule.user_id) or currencies.DEFAULT_BASE_CURRENCY
+        )
+      except ValueError as error:
+        logger.warning("recurring rule %s skipped: %s", rule.id, error)
+        report["skipped"] += len(dates)
+        continue
+      for day in dates:
+        expenses.append({
+          "expense": rule.expense, "merchant": rule.merchant,
+          "amount": rule.amount, "currency": rule.currency, "normalized_amount": normalized_amount,
+          "created_at": day, "category_id": rule.category_id, "recurring_rule_id": rule.id,
+        })
+        delta.add(rule.user_id, rule.category_id, day, normalized_amount)
+    else:
+      if rule.user_id not in incomes:
+        # budget entries belong to an income
+        logger.warning("recurring rule %s skipped: user %s has no income", rule.id, rule.user_id)
+        report["skipped"] += len(dates)
+        continue
+      for day in dates:
+        budgets.append({
+          "category_id": rule.category_id, "income_id": incomes[rule.user_id],
+          "year": day.year, "month": day.month, "budget_limit": rule.amount,
+        })
+    if dates:
+      users.add(rule.user_id)
+
+  kept = _without_existing_budgets(budgets)
+  report["skipped"] += len(budgets) - len(kept)
+  # budgets first, so the alerts check of this batch's expenses sees them
+  if kept:
+    db.session.execute(insert(BudgetEntry), kept)
+  if expenses:
+    db.session.execute(insert(Expense), expenses)
+    delta.apply()
+  db.session.commit()
+
+  report["expenses"] += len(expenses)
+  report["budgets"] += len(kept)
+  for user_id in users:
+    response_cache.invalidate(user_id)
+    merchants.invalidate(user_id)
+
+
+def _without_existing_budgets(budgets):
+  # Drops the months a budget was already set for by hand (one query per batch)
+  if not budgets:
+    return budgets
+  period = BudgetEntry.year * 100 + BudgetEntry.month
+  existing = set(db.session.execute(
+    select(BudgetEntry.category_id, BudgetEntry.year, BudgetEntry.month)
+    .where(
+      BudgetEntry.category_id.in_({row["category_id"] for row in budgets}),
+      period.in_({row["year"] * 100 + row["month"] for row in budgets}),
+    )
+  ).all())
+  kept = []
+  for row in budgets:
+    key = (row["category_id"], row["year"], row["month"])
+    if key not in existing:
+      existing.add(key)
+      kept.append(row)
+  return kept
+
+
+def _date(value, name):
+  try:
+    return date.fromisoformat(value)
+  except (TypeError, ValueError):
+    raise ValueError(f"{name} must be YYYY-MM-DD")
+
+
+def _text(data, name):
+  # A string field of the JSON body, stripped, "" when missing
+  value = data.get(name)
+  if value is None:
+    return ""
+  if not isinstance(value, str):
+    raise ValueError(f"{name} must be a string")
+  return value.strip()
+
+
+def create_rule(user_id, data):
+  # A rule from the /api/recurring JSON body; raises ValueError on bad input, the caller commits
+  if not isinstance(data, dict):
+    raise ValueError("A JSON object is required")
+  kind = _text(data, "kind") or "expense"
+  if kind not in KINDS:
+    raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+  name = _text(data, "category")
+  if not name:
+    raise ValueError("Category is required")
+  amount = money(data.get("amount"))
+  if amount <= 0:
+    raise ValueError("Amount must be greater than 0")
+
+  today = date.today()
+  if kind == "budget":
+    # a budget for every month, from next month unless told otherwise
+    frequency = "monthly"
+    start = _date(data["start"], "start") if data.get("start") else advance(today.replace(day=1), "monthly", 1)
+    start = start.replace(day=1)
+    currency = expense = merchant = None
+  else:
+    frequency = _text(data, "frequency") or "monthly"
+    if frequency not in FREQUENCIES:
+      raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    start = _date(data["start"], "start") if data.get("start") else today
+    currency = currencies.code(_text(data, "currency"))
+    if not currency:
+      raise ValueError("Currency is required")
+    # fails now rather than at every run
+    currencies.factor(currency, currencies.base_currency(user_id))
+    expense = (_text(data, "expense") or _text(data, "merchant"))[:125]
+    merchant = (_text(data, "merchant") or expense)[:125]
+    if not expense:
+      raise ValueError("Expense or merchant is required")
+
+  end_date = _date(data["end"], "end") if data.get("end") else None
+  if end_date is not None and end_date < start:
+    raise ValueError("end must not be before start")
+
+  rule = RecurringRule(
+    user_id=user_id,
+    category_id=categories.get_or_create(user_id, name),
+    kind=kind,
+    frequency=frequency,
+    amount=amount,
+    currency=currency,
+    expense=expense,
+    merchant=merchant,
+    anchor_day=start.day,
+    next_run=start,
+    end_date=end_date,
+  )
+  db.session.add(rule)
+  return rule
+
+
+def user_rules(user_id):
+  return db.session.execute(
+    select(RecurringRule)
+    .options(db.joinedload(RecurringRule.category))
+    .where(RecurringRule.user_id==user_id)
+    .order_by(RecurringRule.id)
+  ).scalars().all()
+
+
+def stop_rule(user_id, rule_id):
+  # Stops a rule (it is kept, expenses it wrote still point to it); False if it is not the user's
+  stopped = db.session.execute(
+    update(RecurringRule)
+    .where(RecurringRule.id==rule_id, RecurringRule.user_id==user_id)
+    .values(next_run=None)
+    .execution_options(synchronize_session=False)
+  ).rowcount
+  db.session.commit()
+  return bool(stopped)
+
+
+class Worker:
+  # Runs run_due() every `interval` seconds in a daemon thread, one per process
+  def __init__(self, app, interval):
+    self.app = app
+    self.interval = interval
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def start(self):
+    # Started lazily on the first request, a thread started before a fork would not survive it
+    if self._pid == os.getpid():
+      return
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      threading.Thread(target=self._run_forever, name="recurring", daemon=True).start()
+
+  def _run_forever(self):
+    while True:
+      try:
+        with self.app.app_context():
+          report = run_due()
+        if report["rules"]:
+          logger.info("recurring run: %s", report)
+      except Exception:
+        logger.exception("recurring run failed")
+      time.sleep(self.interval)
+
+
+def init_app(app):
+  app.config.setdefault("RECURRING_WORKER", False)
+  app.config.setdefault("RECURRING_INTERVAL", 3600)
+  if app.config["RECURRING_WORKER"]:
+    worker = Worker(app, app.config["RECURRING_INTERVAL"])
+    app.extensions["recurring_worker"] = worker
+    app.before_request(worker.start)
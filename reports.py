@@ -0,0 +1,178 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+from models import db, Category, Expense, BudgetEntry, SpendingAggregate
+import categories
+
+
+"""
+  Spending per category per period (day, week or month) over a date range.
+  A page covers at most `limit` consecutive periods, so the window is known from the
+  calendar alone and every query is a bounded range scan:
+    month  read from the spending aggregates (primary key user, category, year, month)
+    week, day  per-day sums over ix_expenses_category_created_normalized (covering), rolled up here
+  The next page starts where the previous one ended (next_cursor is that date).
+"""
+
+BUCKETS = ("day", "week", "month")
+DEFAULT_PERIODS = {"day": 31, "week": 26, "month": 12}
+MAX_PERIODS = 366
+
+
+def floor(day, bucket):
+  # First day of the period containing `day` (weeks start on Monday)
+  if bucket == "week":
+    return day - timedelta(days=day.weekday())
+  if bucket == "month":
+    return day.replace(day=1)
+  return day
+
+
+def advance(day, bucket, periods=1):
+  # Start of the period `periods` after the one starting at `day`; ValueError when that
+  # falls outside the dates Python can represent (a range ending near 9999-12-31)
+  try:
+    if bucket == "month":
+      months = day.year * 12 + day.month - 1 + periods
+      return date(months // 12, months % 12 + 1, 1)
+    return day + timedelta(days=periods * (7 if bucket == "week" else 1))
+  except (OverflowError, ValueError):
+    raise ValueError(f"dates must be between {date.min.isoformat()} and {date.max.isoformat()}")
+
+
+def daily_series_query(user_id, start, end, category_ids=None):
+  # (category id, day, total, count) rows for start <= created_at < end. Grouping by the
+  # raw day follows the covering index, weeks are summed up from the days afterwards.
+  user_categories = db.select(Category.id).where(Category.user_id==user_id)
+  return (
+    db.select(Expense.category_id, Expense.created_at, db.func.sum(Expense.normalized_amount), db.func.count())
+    .where(
+      Expense.category_id.in_(category_ids if category_ids is not None else user_categories),
+      Expense.created_at >= start,
+      Expense.created_at < end,
+    )
+    .group_by(Expense.category_id, Expense.created_at)
+  )
+
+
+def monthly_series_query(user_id, start, end, category=None):
+  period = SpendingAggregate.year * 100 + SpendingAggregate.month
+  query = (
+    db.select(
+      SpendingAggregate.year, SpendingAggregate.month, Category.name,
+      SpendingAggregate.total, SpendingAggregate.count,
+    )
+    .join(Category, SpendingAggregate.category_id==Category.id)
+    .where(
+      SpendingAggregate.user_id==user_id,
+      SpendingAggregate.count > 0,
+      period >= start.year * 100 + start.month,
+      period < end.year * 100 + end.month,
+    )
+  )
+  if category:
+    query = query.where(Category.name==category)
+  return query
+
+
+def budget_series_query(user_id, start, end, category=None):
+  # Budget limit per category per month (several entries for one month are added up)
+  period = BudgetEntry.year * 100 + BudgetEntry.month
+  query = (
+    db.select(BudgetEntry.year, BudgetEntry.month, Category.name, db.func.sum(BudgetEntry.budget_limit))
+    .join(Category, BudgetEntry.category_id==Category.id)
+    .where(
+      Category.user_id==user_id,
+      period >= start.year * 100 + start.month,
+      period < end.year * 100 + end.month,
+    )
+    .group_by(BudgetEntry.year, BudgetEntry.month, Category.id, Category.name)
+  )
+  if category:
+    query = query.where(Category.name==category)
+  return query
+
+
+def _category_names(user_id, category_ids):
+  # id -> name from the cached category list, reloaded if a category is newer than the cache
+  names = {entry.id: entry.name for entry in categories.user_categories(user_id)}
+  if not category_ids <= names.keys():
+    categories.invalidate(user_id)
+    names = {entry.id: entry.name for entry in categories.user_categories(user_id)}
+  return names
+
+
+def timeseries(user_id, bucket="month", start=None, end=None, category=None, cursor=None, limit=None):
+  # start/end are inclusive dates; cursor (a date) resumes a range at the next page
+  if bucket not in BUCKETS:
+    raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+  limit = min(limit or DEFAULT_PERIODS[bucket], MAX_PERIODS)
+  if limit < 1:
+    raise ValueError("limit must be at least 1")
+
+  end = floor(end or date.today(), bucket)
+  start = floor(start or advance(end, bucket, 1 - DEFAULT_PERIODS[bucket]), bucket)
+  if start > end:
+    raise ValueError("start must not be after end")
+
+  page_start = floor(cursor, bucket) if cursor else start
+  if not start <= page_start <= end:
+    raise ValueError("cursor is outside the requested range")
+  range_end = advance(end, bucket)
+  page_end = min(advance(page_start, bucket, limit), range_end)
+
+  periods = []
+  day = page_start
+  while day < page_end:
+    periods.append(day)
+    day = advance(day, bucket)
+  index = {period: i for i, period in enumerate(periods)}
+
+  series = {}
+  counts = {}
+  if bucket == "month":
+    rows = (
+      (date(year, month, 1), name, total, count)
+      for year, month, name, total, count in db.session.execute(
+        monthly_series_query(user_id, page_start, page_end, category)
+      )
+    )
+  else:
+    if category:
+      category_id = categories.find(user_id, category)
+      category_ids = [category_id] if category_id is not None else []
+    else:
+      category_ids = None
+    days = db.session.execute(daily_series_query(user_id, page_start, page_end, category_ids)).all()
+    names = _category_names(user_id, {row[0] for row in days})
+    rows = (
+      (floor(day, bucket), names[category_id], total, count)
+      for category_id, day, total, count in days
+    )
+  for period, name, total, count in rows:
+    i = index[period]
+    series.setdefault(name, [Decimal(0)] * len(periods))[i] += total
+    counts.setdefault(name, [0] * len(periods))[i] += count
+
+  budgets = {}
+  if bucket == "month":
+    for year, month, name, limit_total in db.session.execute(
+      budget_series_query(user_id, page_start, page_end, category)
+    ):
+      budgets.setdefault(name, [Decimal(0)] * len(periods))[index[date(year, month, 1)]] = limit_total
+
+  return {
+    "bucket": bucket,
+    "start": start.isoformat(),
+    "end": (range_end - timedelta(days=1)).isoformat(),
+    "periods": [period.isoformat() for period in periods],
+    "series": [
+      {"category": name, "values": values, "counts": counts[name]}
+      for name, values in sorted(series.items())
+    ],
+    "budgets": [
+      {"category": name, "values": values}
+      for name, values in sorted(budgets.items())
+    ],
+    "next_cursor": page_end.isoformat() if page_end < range_end else None,
+  }
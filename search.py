@@ -0,0 +1,159 @@
+import re
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import contains_eager
+
+from models import db, Category, Expense
+
+
+"""
+  Full-text search over expense descriptions and merchants (SQLite FTS5).
+  expenses_fts is a contentless FTS5 index of (expense, merchant, owner), where owner is a
+  "u<user id>" token, so a user's matches are an intersection of two posting lists and
+  never a scan of other users' rows. Triggers on expenses keep it in step with every
+  write path (forms, batch, import, recurring rules). Results are ranked with bm25 and
+  every search term is a prefix ("cof" finds "Coffee"). Without date or category filters
+  only the RANK_WINDOW newest matches are ranked, which bounds the cost of broad queries.
+
+  Databases without the index (PostgreSQL, SQLite built without FTS5, not migrated yet)
+  fall back to a LIKE search, newest first. `flask reindex-search` rebuilds the index.
+"""
+
+MAX_RESULTS = 200
+MAX_TERMS = 8
+# an unfiltered search ranks the newest matches only, bm25 is the costly part of a broad query
+RANK_WINDOW = 2000
+
+TERM = re.compile(r"\w+")
+
+# bm25 weights for (expense, merchant, owner); owner only filters
+WEIGHTS = (1.0, 1.0, 0.0)
+
+_OWNER = "(SELECT 'u' || user_id FROM categories WHERE id = {row}.category_id)"
+
+SEARCH_DDL = [
+  "CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5("
+  "expense, merchant, owner, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+  "CREATE TRIGGER IF NOT EXISTS expenses_fts_insert AFTER INSERT ON expenses BEGIN"
+  " INSERT INTO expenses_fts(rowid, expense, merchant, owner)"
+  f" VALUES (new.id, new.expense, new.merchant, {_OWNER.format(row='new')}); END",
+  # a contentless index deletes by the values it was given
+  "CREATE TRIGGER IF NOT EXISTS expenses_fts_delete AFTER DELETE ON expenses BEGIN"
+  " INSERT INTO expenses_fts(expenses_fts, rowid, expense, merchant, owner)"
+  f" VALUES ('delete', old.id, old.expense, old.merchant, {_OWNER.format(row='old')}); END",
+  "CREATE TRIGGER IF NOT EXISTS expenses_fts_update AFTER UPDATE OF expense, merchant, category_id"
+  " ON expenses BEGIN"
+  " INSERT INTO expenses_fts(expenses_fts, rowid, expense, merchant, owner)"
+  f" VALUES ('delete', old.id, old.expense, old.merchant, {_OWNER.format(row='old')});"
+  " INSERT INTO expenses_fts(rowid, expense, merchant, owner)"
+  f" VALUES (new.id, new.expense, new.merchant, {_OWNER.format(row='new')}); END",
+]
+
+fts = db.table("expenses_fts", db.column("rowid"))
+
+# connection url -> whether that database has the index
+_indexed = {}
+
+
+def supports_fts(connection):
+  if connection.dialect.name != "sqlite":
+    return False
+  return bool(connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def _create(target, connection, **kw):
+  if supports_fts(connection):
+    for statement in SEARCH_DDL:
+      connection.exec_driver_sql(statement)
+
+
+# new databases get the index with the expenses table (db.create_all)
+event.listen(Expense.__table__, "after_create", _create)
+
+
+def create_index():
+  # Creates the index and its triggers if missing (flask migrate); True if it was built
+  connection = db.session.connection()
+  if not supports_fts(connection) or inspect(connection).has_table("expenses_fts"):
+    return False
+  _create(None, connection)
+  reindex()
+  return True
+
+
+def reindex():
+  # Rebuilds the whole index from the expenses table, the caller commits
+  connection = db.session.connection()
+  connection.exec_driver_sql("INSERT INTO expenses_fts(expenses_fts) VALUES ('delete-all')")
+  connection.exec_driver_sql(
+    "INSERT INTO expenses_fts(rowid, expense, merchant, owner)"
+    " SELECT expenses.id, expenses.expense, expenses.merchant, 'u' || categories.user_id"
+    " FROM expenses LEFT JOIN categories ON categories.id = expenses.category_id"
+  )
+  connection.exec_driver_sql("INSERT INTO expenses_fts(expenses_fts) VALUES ('optimize')")
+  _indexed.clear()
+  return db.session.execute(text("SELECT count(*) FROM expenses")).scalar()
+
+
+def has_index():
+  bind = db.session.get_bind()
+  key = str(bind.url)
+  if key not in _indexed:
+    with bind.connect() as connection:
+      _indexed[key] = supports_fts(connection) and inspect(connection).has_table("expenses_fts")
+  return _indexed[key]
+
+
+def terms(query):
+  return TERM.findall(query or "")[:MAX_TERMS]
+
+
+def match_expression(user_id, words):
+  # every word a quoted prefix, in the expense or merchant column, of this user's rows
+  phrases = " AND ".join(f'"{word}"*' for word in words)
+  return f'owner:"u{user_id}" AND {{expense merchant}}:({phrases})'
+
+
+def search_query(user_id, query, category=None, start=None, end=None, limit=50, indexed=True):
+  words = terms(query)
+  if not words:
+    raise ValueError("Search terms are required")
+  stmt = (
+    select(Expense)
+    .join(Category)
+    .where(Category.user_id==user_id)
+    .options(contains_eager(Expense.category))
+  )
+  if category:
+    stmt = stmt.where(Category.name==category)
+  if start:
+    stmt = stmt.where(Expense.created_at >= start)
+  if end:
+    stmt = stmt.where(Expense.created_at <= end)
+  limit = min(max(limit or 50, 1), MAX_RESULTS)
+
+  if indexed:
+    # bm25() called directly is cheaper than the configurable rank column
+    matches = (
+      select(fts.c.rowid, db.func.bm25(db.literal_column("expenses_fts"), *WEIGHTS).label("rank"))
+      .where(db.literal_column("expenses_fts").op("MATCH")(match_expression(user_id, words)))
+    )
+    if not (category or start or end):
+      matches = matches.order_by(fts.c.rowid.desc()).limit(RANK_WINDOW)
+    matches = matches.subquery()
+    return (
+      stmt.join(matches, matches.c.rowid==Expense.id)
+      .order_by(matches.c.rank, Expense.created_at.desc())
+      .limit(limit)
+    )
+
+  for word in words:
+    pattern = f"%{word}%"
+    stmt = stmt.where(db.or_(Expense.expense.ilike(pattern), Expense.merchant.ilike(pattern)))
+  return stmt.order_by(Expense.created_at.desc(), Expense.id.desc()).limit(limit)
+
+
+def search(user_id, query, category=None, start=None, end=None, limit=50):
+  # Best matches first; raises ValueError when the query has no words
+  stmt = search_query(user_id, query, category, start, end, limit, indexed=has_index())
+  return db.session.execute(stmt).scalars().all()
@@ -0,0 +1,177 @@
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+import msgspec
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+"""
+  Session storage, selected with SESSION_BACKEND:
+    "cookie"      Flask's signed cookie (default). The session only holds user_id, theme and
+                  the odd flash message, so it fits in a small cookie and costs no I/O.
+    "sqlite"      server-side store in one SQLite file (WAL), msgpack-encoded rows,
+                  expired rows removed by a background sweep thread
+    anything else is handed to Flask-Session as SESSION_TYPE (e.g. "filesystem", "redis")
+
+  Config for "sqlite":
+    SESSION_SQLITE_PATH       database file (default: instance/sessions.db)
+    SESSION_SWEEP_INTERVAL    seconds between expiry sweeps (default 300)
+    PERMANENT_SESSION_LIFETIME  how long an idle session is kept
+"""
+
+
+def init_app(app):
+  app.config.setdefault("SESSION_BACKEND", "cookie")
+  app.config.setdefault("SESSION_COOKIE_SAMESITE", "Lax")
+  backend = app.config["SESSION_BACKEND"]
+
+  if backend == "cookie":
+    # Flask's default SecureCookieSessionInterface
+    return
+  if backend == "sqlite":
+    app.config.setdefault("SESSION_SQLITE_PATH", os.path.join(app.instance_path, "sessions.db"))
+    app.config.setdefault("SESSION_SWEEP_INTERVAL", 300)
+    app.session_interface = SqliteSessionInterface(
+      app.config["SESSION_SQLITE_PATH"], app.config["SESSION_SWEEP_INTERVAL"]
+    )
+    return
+  # Flask-Session is only imported by the apps that use one of its backends
+  from flask_session import Session
+  app.config["SESSION_TYPE"] = backend
+  Session(app)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+  def __init__(self, initial=None, sid=None, new=False, expires=None):
+    def on_update(self):
+      self.modified = True
+    super().__init__(initial, on_update)
+    self.sid = sid
+    self.new = new
+    self.expires = expires
+    self.modified = False
+
+
+class SqliteStore:
+  # One connection per thread; WAL lets readers and the single writer run side by side
+  def __init__(self, path):
+    self.path = path
+    self._local = threading.local()
+
+  def connection(self):
+    # Opened on first use in each thread, so starting the app never touches the file
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      directory = os.path.dirname(self.path)
+      if directory:
+        os.makedirs(directory, exist_ok=True)
+      conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+      conn.execute("PRAGMA journal_mode=WAL")
+      conn.execute("PRAGMA synchronous=NORMAL")
+      conn.execute(
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        " id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL"
+        ") WITHOUT ROWID"
+      )
+      conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)")
+      self._local.conn = conn
+    return conn
+
+  def load(self, sid, now):
+    return self.connection().execute(
+      "SELECT data, expires FROM sessions WHERE id = ? AND expires > ?", (sid, now)
+    ).fetchone()
+
+  def save(self, sid, data, expires):
+    self.connection().execute(
+      "INSERT INTO sessions (id, data, expires) VALUES (?, ?, ?)"
+      " ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires = excluded.expires",
+      (sid, data, expires),
+    )
+
+  def delete(self, sid):
+    self.connection().execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+  def sweep(self, now, batch_size=1000):
+    # Deletes expired rows in small batches, so the write lock is never held for long
+    removed = 0
+    while True:
+      count = self.connection().execute(
+        "DELETE FROM sessions WHERE id IN"
+        " (SELECT id FROM sessions WHERE expires <= ? LIMIT ?)",
+        (now, batch_size),
+      ).rowcount
+      removed += count
+      if count < batch_size:
+        return removed
+
+
+class SqliteSessionInterface(SessionInterface):
+  def __init__(self, path, sweep_interval=300):
+    self.store = SqliteStore(path)
+    self.sweep_interval = sweep_interval
+    self._sweeper_pid = None
+    self._sweeper_lock = threading.Lock()
+
+  def _start_sweeper(self):
+    # Started lazily and once per process, a thread started before a fork would not survive it
+    if self._sweeper_pid == os.getpid() or not self.sweep_interval:
+      return
+    with self._sweeper_lock:
+      if self._sweeper_pid == os.getpid():
+        return
+      self._sweeper_pid = os.getpid()
+      threading.Thread(target=self._sweep_forever, name="session-sweep", daemon=True).start()
+
+  def _sweep_forever(self):
+    store = SqliteStore(self.store.path)
+    while True:
+      time.sleep(self.sweep_interval)
+      try:
+        store.sweep(time.time())
+      except sqlite3.OperationalError:
+        # busy, try again next round
+        pass
+
+  def open_session(self, app, request):
+    self._start_sweeper()
+    sid = request.cookies.get(self.get_cookie_name(app))
+    if sid:
+      row = self.store.load(sid, time.time())
+      if row is not None:
+        return ServerSession(msgspec.msgpack.decode(row[0]), sid=sid, expires=row[1])
+    return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+  def save_session(self, app, session, response):
+    name = self.get_cookie_name(app)
+    domain = self.get_cookie_domain(app)
+    path = self.get_cookie_path(app)
+
+    if not session:
+      if session.modified and not session.new:
+        self.store.delete(session.sid)
+        response.delete_cookie(name, domain=domain, path=path)
+      return
+
+    lifetime = app.permanent_session_lifetime.total_seconds()
+    now = time.time()
+    # unchanged sessions are only rewritten when half their lifetime has passed
+    if session.modified or session.new or session.expires - now < lifetime / 2:
+      self.store.save(session.sid, msgspec.msgpack.encode(dict(session)), now + lifetime)
+    elif not self.should_set_cookie(app, session):
+      return
+
+    response.set_cookie(
+      name,
+      session.sid,
+      expires=self.get_expiration_time(app, session),
+      httponly=self.get_cookie_httponly(app),
+      domain=domain,
+      path=path,
+      secure=self.get_cookie_secure(app),
+      samesite=self.get_cookie_samesite(app),
+    )
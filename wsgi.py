@@ -0,0 +1,16 @@
+from app import create_app
+
+
+"""
+  WSGI entry point for production servers, e.g.
+    gunicorn --preload --workers 4 wsgi:app
+  Building the app only reads the config and registers routes: no database connection is
+  opened and the schema is never touched, so a preforked worker starts at once. Create or
+  upgrade the schema beforehand with `flask init-db` or `flask migrate`.
+"""
+
+app = create_app()
+
+# Compiled once here, so with --preload every worker forks with the templates ready
+for name in app.jinja_env.list_templates():
+  app.jinja_env.get_template(name)